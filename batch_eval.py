@@ -0,0 +1,233 @@
+from typing import Iterable, NamedTuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for batch evaluation
+    np = None
+
+from chess import Chess, PieceType, Side
+from evaluation import MAX_PHASE, PHASE_WEIGHTS, PSQT_EG, PSQT_MG
+from packed import unpack_positions
+
+# Positions in a batch are stored as 12 bitboards each, one per piece
+# type and colour: white pawn, knight, bishop, rook, queen, king, then the
+# same for black. Bit row*8 + file is set where the piece stands.
+PLANES = 12
+# positions unpacked to squares at a time: 768 bytes each as planes and
+# four times that in the piece-square product, about 16 MB in all
+CHUNK_SIZE = 4096
+
+# centipawns per square attacked, indexed by PieceType
+MOBILITY_WEIGHTS = [0, 0, 4, 5, 2, 1, 0]
+DOUBLED_PAWN_PENALTY = 15
+ISOLATED_PAWN_PENALTY = 15
+# bonus for a passed pawn by how many rows it has advanced
+PASSED_PAWN_BONUS = [0, 5, 10, 20, 35, 60, 100, 0]
+
+
+class PositionBatch(NamedTuple):
+    bitboards: "np.ndarray"  # (N, 12) uint64
+    white_to_move: "np.ndarray"  # (N,) bool
+
+    def __len__(self):
+        return len(self.bitboards)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("batch evaluation needs numpy")
+
+
+def plane_index(piece: PieceType, color: Side):
+    return (0 if color == Side.WHITE else 6) + piece - 1
+
+
+def from_games(games: Iterable[Chess]) -> PositionBatch:
+    # the games may be the same object at different points of a game
+    _require_numpy()
+    rows = []
+    turns = []
+    for game in games:
+        row = [0] * PLANES
+        for (square, piece, color) in game.placements():
+            row[plane_index(piece, color)] |= 1 << square
+        rows.append(row)
+        turns.append(game.turn == Side.WHITE)
+    return PositionBatch(np.array(rows, dtype=np.uint64).reshape(-1, PLANES),
+                         np.array(turns, dtype=bool))
+
+
+def from_fens(fens: Iterable[str]) -> PositionBatch:
+    game = Chess()
+    return from_games(_load_fen(game, fen) for fen in fens)
+
+def _load_fen(game: Chess, fen: str) -> Chess:
+    game.set_fen(fen)
+    return game
+
+
+def from_packed(data) -> PositionBatch:
+    # from positions in the 32 byte format of packed.py
+    return from_games(unpack_positions(data))
+
+
+def to_planes(batch: PositionBatch) -> "np.ndarray":
+    # (N, 12, 8, 8) array of 0/1, indexed [position, plane, row, file]
+    _require_numpy()
+    bitboards = batch.bitboards.astype("<u8")
+    squares = np.unpackbits(bitboards.view(np.uint8), axis=1,
+                            bitorder="little")
+    return squares.reshape(-1, PLANES, 8, 8)
+
+
+# middlegame and endgame piece-square values from evaluation.py laid out
+# by plane, black negated, as a (768, 2) matrix
+_PIECE_SQUARE_WEIGHTS = None
+
+def _piece_square_weights():
+    global _PIECE_SQUARE_WEIGHTS
+    if _PIECE_SQUARE_WEIGHTS is None:
+        weights = np.zeros((PLANES, 64, 2), dtype=np.int32)
+        for piece in range(PieceType.PAWN, PieceType.KING+1):
+            for (side, base) in ((0, 0), (1, 6)):
+                weights[base+piece-1, :, 0] = PSQT_MG[side][piece]
+                weights[base+piece-1, :, 1] = PSQT_EG[side][piece]
+        _PIECE_SQUARE_WEIGHTS = weights.reshape(PLANES*64, 2)
+    return _PIECE_SQUARE_WEIGHTS
+
+
+def _phase(bitboards):
+    # PHASE_WEIGHTS summed over the pieces of both sides
+    phase = np.zeros(len(bitboards), dtype=np.int32)
+    for piece in range(PieceType.PAWN, PieceType.KING+1):
+        if PHASE_WEIGHTS[piece]:
+            count = (_popcount(bitboards[:, piece-1])
+                     + _popcount(bitboards[:, piece+5]))
+            phase += PHASE_WEIGHTS[piece] * count
+    return np.minimum(phase, MAX_PHASE)
+
+
+def _popcount(bitboards):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bitboards).astype(np.int32)
+    bytes_ = bitboards.astype("<u8").view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(bytes_, axis=1).sum(axis=1, dtype=np.int32)
+
+
+def _shift(bitboards, shift):
+    if shift > 0:
+        return bitboards << np.uint64(shift)
+    return bitboards >> np.uint64(-shift)
+
+
+_NOT_FILE_A = 0xfefefefefefefefe
+_NOT_FILE_H = 0x7f7f7f7f7f7f7f7f
+_NOT_FILE_AB = 0xfcfcfcfcfcfcfcfc
+_NOT_FILE_GH = 0x3f3f3f3f3f3f3f3f
+# square shifts with the files a piece may not land on after wrapping
+_KNIGHT_SHIFTS = [(17, _NOT_FILE_A), (15, _NOT_FILE_H), (10, _NOT_FILE_AB),
+                  (6, _NOT_FILE_GH), (-6, _NOT_FILE_AB), (-10, _NOT_FILE_GH),
+                  (-15, _NOT_FILE_A), (-17, _NOT_FILE_H)]
+_ROOK_SHIFTS = [(8, ~0), (-8, ~0), (1, _NOT_FILE_A), (-1, _NOT_FILE_H)]
+_BISHOP_SHIFTS = [(9, _NOT_FILE_A), (7, _NOT_FILE_H), (-7, _NOT_FILE_A),
+                  (-9, _NOT_FILE_H)]
+
+
+def _slider_attacks(sliders, empty, shifts):
+    attacks = np.zeros_like(sliders)
+    for (shift, mask) in shifts:
+        mask = np.uint64(mask & 0xffffffffffffffff)
+        ray = sliders
+        for i in range(7):
+            ray = _shift(ray, shift) & mask
+            attacks |= ray
+            ray = ray & empty
+    return attacks
+
+
+def _mobility(bitboards):
+    # squares attacked by each kind of piece, not counting own pieces.
+    # Pieces of one kind are taken together, so a square two knights
+    # reach counts once.
+    occupied = np.bitwise_or.reduce(bitboards, axis=1)
+    empty = ~occupied
+    score = np.zeros(len(bitboards), dtype=np.int32)
+    for (base, sign) in ((0, 1), (6, -1)):
+        own = np.bitwise_or.reduce(bitboards[:, base:base+6], axis=1)
+        knights = bitboards[:, base + PieceType.KNIGHT-1]
+        bishops = bitboards[:, base + PieceType.BISHOP-1]
+        rooks = bitboards[:, base + PieceType.ROOK-1]
+        queens = bitboards[:, base + PieceType.QUEEN-1]
+        knight_attacks = np.zeros_like(knights)
+        for (shift, mask) in _KNIGHT_SHIFTS:
+            knight_attacks |= _shift(knights, shift) & np.uint64(mask)
+        attacks = [
+            (PieceType.KNIGHT, knight_attacks),
+            (PieceType.BISHOP, _slider_attacks(bishops, empty,
+                                               _BISHOP_SHIFTS)),
+            (PieceType.ROOK, _slider_attacks(rooks, empty, _ROOK_SHIFTS)),
+            (PieceType.QUEEN, _slider_attacks(queens, empty,
+                                              _ROOK_SHIFTS + _BISHOP_SHIFTS)),
+        ]
+        for (piece, targets) in attacks:
+            score += sign * MOBILITY_WEIGHTS[piece] * _popcount(targets & ~own)
+    return score
+
+
+def _pawn_structure(planes):
+    # doubled, isolated and passed pawns from the (N, 12, 8, 8) planes
+    white = planes[:, PieceType.PAWN-1].astype(bool)
+    black = planes[:, PieceType.PAWN+5].astype(bool)
+    rows = np.arange(8).reshape(1, 8, 1)
+    score = np.zeros(len(planes), dtype=np.int32)
+
+    for (pawns, enemy, sign) in ((white, black, 1), (black, white, -1)):
+        counts = pawns.sum(axis=1)  # (N, 8) pawns on each file
+        score -= sign * DOUBLED_PAWN_PENALTY * np.clip(counts-1, 0, None).sum(
+            axis=1, dtype=np.int32)
+        has_pawn = counts > 0
+        neighbours = np.zeros_like(has_pawn)
+        neighbours[:, 1:] |= has_pawn[:, :-1]
+        neighbours[:, :-1] |= has_pawn[:, 1:]
+        score -= sign * ISOLATED_PAWN_PENALTY * (counts * ~neighbours).sum(
+            axis=1, dtype=np.int32)
+
+        # furthest enemy pawn back on each file, from this side's view
+        if sign == 1:
+            enemy_rows = np.where(enemy, rows, -1).max(axis=1)
+        else:
+            enemy_rows = np.where(enemy, 7 - rows, -1).max(axis=1)
+        blockers = enemy_rows.copy()
+        blockers[:, 1:] = np.maximum(blockers[:, 1:], enemy_rows[:, :-1])
+        blockers[:, :-1] = np.maximum(blockers[:, :-1], enemy_rows[:, 1:])
+        # rows advanced by each pawn, passed when no enemy pawn is ahead
+        advanced = rows if sign == 1 else 7 - rows
+        passed = pawns & (advanced >= blockers[:, None, :])
+        bonus = np.array(PASSED_PAWN_BONUS, dtype=np.int32)
+        if sign == -1:
+            bonus = bonus[::-1]
+        score += sign * (passed * bonus.reshape(1, 8, 1)).sum(
+            axis=(1, 2), dtype=np.int32)
+    return score
+
+
+def evaluate_batch(batch: PositionBatch) -> "np.ndarray":
+    # Material, piece-square tables, mobility and pawn structure for every
+    # position, in centipawns for the side to move. Material and piece
+    # squares are tapered by phase as in Chess.static_eval.
+    _require_numpy()
+    scores = np.empty(len(batch), dtype=np.int32)
+    weights = _piece_square_weights()
+    for start in range(0, len(batch), CHUNK_SIZE):
+        chunk = PositionBatch(batch.bitboards[start:start+CHUNK_SIZE],
+                              batch.white_to_move[start:start+CHUNK_SIZE])
+        planes = to_planes(chunk)
+        (mg, eg) = (planes.reshape(len(chunk), PLANES*64).astype(np.int32)
+                    @ weights).T
+        phase = _phase(chunk.bitboards)
+        score = (mg*phase + eg*(MAX_PHASE - phase)) // MAX_PHASE
+        score += _mobility(chunk.bitboards)
+        score += _pawn_structure(planes)
+        scores[start:start+len(chunk)] = np.where(chunk.white_to_move,
+                                                  score, -score)
+    return scores
@@ -0,0 +1,301 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from bitboard import BACKENDS
+from chess import Chess, Move, Side
+from journal import Journal, detach
+from render import Renderer
+
+# Benchmarks of the hot paths. Each reports a rate, higher is better, and
+# is compared against a baseline file written by an earlier run with
+# --save; a rate more than the tolerance below its baseline is a
+# regression. Perft counts are checked against the known values on every
+# run. Exits 1 on a regression or a wrong count.
+#
+#   python bench.py --save            # record a baseline on this machine
+#   python bench.py                   # compare against it
+#   python bench.py --tolerance 0.2 --only perft
+
+BASELINE_FILE = "bench_baseline.json"
+DEFAULT_TOLERANCE = 0.10
+
+# standard perft positions with their node counts by depth
+PERFT_POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281]),
+    ("kiwipete",
+     "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862]),
+    ("endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238]),
+    ("promotions",
+     "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467]),
+    ("castling", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/"
+     "1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890]),
+]
+GAMES = 20  # random games replayed by the make_move and render benchmarks
+GAME_PLIES = 120
+SEED = 1
+
+
+class BenchResult(NamedTuple):
+    name: str
+    rate: float
+    unit: str
+
+
+def _best_time(function: Callable[[], None], repeat) -> float:
+    # the fastest of a few runs, which is the least disturbed by the rest
+    # of the machine
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _random_games(backend) -> List[List[Move]]:
+    rng = random.Random(SEED)
+    game = backend()
+    games = []
+    for i in range(GAMES):
+        game.reset()
+        moves = []
+        for ply in range(GAME_PLIES):
+            legal = game.generate_legal_moves()
+            if not legal:
+                break
+            move = rng.choice(legal)
+            game.push(move)
+            moves.append(move)
+        games.append(moves)
+    return games
+
+
+def bench_perft(backend_name, backend, depth_cut, repeat,
+                errors: List[str]) -> BenchResult:
+    game = backend()
+    nodes = 0
+    for (name, fen, counts) in PERFT_POSITIONS:
+        depth = max(1, len(counts) - depth_cut)
+        game.set_fen(fen)
+        found = game.perft(depth)
+        if found != counts[depth-1]:
+            errors.append(f"perft {backend_name} {name} depth {depth}: "
+                          f"{found} nodes, expected {counts[depth-1]}")
+        nodes += found
+    def run():
+        for (name, fen, counts) in PERFT_POSITIONS:
+            game.set_fen(fen)
+            game.perft(max(1, len(counts) - depth_cut))
+    return BenchResult(f"perft.{backend_name}", nodes / _best_time(run, repeat),
+                       "nodes/s")
+
+
+def bench_make_move(backend_name, backend, repeat) -> BenchResult:
+    games = _random_games(backend)
+    moves = sum(len(game) for game in games)
+    game = backend()
+    def run():
+        for played in games:
+            game.reset()
+            for move in played:
+                game.make_move(*move)
+    return BenchResult(f"make_move.{backend_name}",
+                       moves / _best_time(run, repeat), "moves/s")
+
+
+def bench_journaled_make_move(repeat) -> BenchResult:
+    # make_move with every move journaled, as the server does
+    games = _random_games(Chess)
+    moves = sum(len(game) for game in games)
+    game = Chess()
+    with tempfile.TemporaryDirectory() as directory:
+        with Journal(directory) as journal:
+            def run():
+                for (game_id, played) in enumerate(games):
+                    game.reset()
+                    journal.attach(game, game_id)
+                    for move in played:
+                        game.make_move(*move)
+                    detach(game)
+                    journal.end_game(game_id)
+            rate = moves / _best_time(run, repeat)
+    return BenchResult("make_move.journaled", rate, "moves/s")
+
+
+def bench_is_square_attacked(backend_name, backend, repeat) -> BenchResult:
+    positions = []
+    for (name, fen, counts) in PERFT_POSITIONS:
+        game = backend()
+        game.set_fen(fen)
+        positions.append(game)
+    squares = [divmod(square, 8) for square in range(64)]
+    def run():
+        for game in positions:
+            attacked = game.is_square_attacked
+            for side in (Side.WHITE, Side.BLACK):
+                for (row, file) in squares:
+                    attacked(row, file, side)
+    calls = len(positions) * 2 * 64
+    return BenchResult(f"is_square_attacked.{backend_name}",
+                       calls / _best_time(run, repeat), "calls/s")
+
+
+def bench_construction(backend_name, backend, repeat) -> BenchResult:
+    count = 200
+    def run():
+        for i in range(count):
+            backend()
+    return BenchResult(f"construction.{backend_name}",
+                       count / _best_time(run, repeat), "games/s")
+
+
+def bench_clone(backend_name, backend, repeat) -> BenchResult:
+    game = backend()
+    game.set_fen(PERFT_POSITIONS[1][1])
+    count = 1000
+    def run():
+        for i in range(count):
+            game.clone()
+    return BenchResult(f"clone.{backend_name}",
+                       count / _best_time(run, repeat), "games/s")
+
+
+def bench_render(tty: bool, repeat) -> BenchResult:
+    # frames drawn to memory while replaying games, redrawing only the
+    # changed squares on a terminal and the whole board without one
+    games = _random_games(Chess)
+    game = Chess()
+    frames = sum(len(played) for played in games)
+    def run():
+        renderer = Renderer(io.StringIO(), tty)
+        for played in games:
+            game.reset()
+            renderer.reset()
+            for move in played:
+                game.push(move)
+                renderer.draw(game.board_cells(), str(move))
+    name = "render.tty" if tty else "render.plain"
+    return BenchResult(name, frames / _best_time(run, repeat), "frames/s")
+
+
+def run_benchmarks(only=None, quick=False, repeat=3) -> Tuple[
+        List[BenchResult], List[str]]:
+    # returns the results and any wrong perft counts
+    errors: List[str] = []
+    depth_cut = 1 if quick else 0
+    benchmarks = []
+    for (name, backend) in BACKENDS.items():
+        benchmarks += [
+            (f"perft.{name}", lambda name=name, backend=backend: bench_perft(
+                name, backend, depth_cut, repeat, errors)),
+            (f"make_move.{name}", lambda name=name, backend=backend:
+                bench_make_move(name, backend, repeat)),
+            (f"is_square_attacked.{name}", lambda name=name, backend=backend:
+                bench_is_square_attacked(name, backend, repeat)),
+            (f"construction.{name}", lambda name=name, backend=backend:
+                bench_construction(name, backend, repeat)),
+            (f"clone.{name}", lambda name=name, backend=backend:
+                bench_clone(name, backend, repeat)),
+        ]
+    benchmarks += [("make_move.journaled",
+                    lambda: bench_journaled_make_move(repeat)),
+                   ("render.tty", lambda: bench_render(True, repeat)),
+                   ("render.plain", lambda: bench_render(False, repeat))]
+    results = []
+    for (name, benchmark) in benchmarks:
+        if only is None or any(name.startswith(prefix) for prefix in only):
+            results.append(benchmark())
+    return (results, errors)
+
+
+def load_baseline(path) -> Dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as stream:
+        return json.load(stream)["rates"]
+
+
+def save_baseline(path, results: List[BenchResult]):
+    with open(path, "w") as out:
+        json.dump({"python": platform.python_version(),
+                   "machine": platform.machine(),
+                   "saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "rates": {result.name: round(result.rate, 1)
+                             for result in results}}, out, indent=2)
+        out.write("\n")
+
+
+def compare(results: List[BenchResult], baseline: Dict[str, float],
+            tolerance) -> List[str]:
+    # prints a table and returns the names that regressed
+    regressions = []
+    print(f"{'Benchmark':<32} {'Rate':>14} {'Baseline':>14} {'Change':>8}")
+    for result in results:
+        line = f"{result.name:<32} {result.rate:>14.0f}"
+        base = baseline.get(result.name)
+        if base:
+            change = result.rate / base - 1
+            line += f" {base:>14.0f} {change:>+7.1%}"
+            if change < -tolerance:
+                line += "  REGRESSION"
+                regressions.append(result.name)
+        print(f"{line}  {result.unit}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chess benchmarks")
+    parser.add_argument("--baseline", default=BASELINE_FILE, metavar="FILE",
+                        help="baseline rates (default: %(default)s)")
+    parser.add_argument("--save", action="store_true",
+                        help="write the rates of this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction below the baseline that counts as a "
+                             "regression (default: %(default)s)")
+    parser.add_argument("--only", action="append", metavar="PREFIX",
+                        help="run benchmarks whose name starts with PREFIX, "
+                             "e.g. perft or make_move.bitboard")
+    parser.add_argument("--quick", action="store_true",
+                        help="one perft ply less, for a fast check")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per benchmark, the fastest is kept")
+    args = parser.parse_args()
+
+    (results, errors) = run_benchmarks(args.only, args.quick, args.repeat)
+    baseline = {} if args.save else load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.tolerance)
+    for error in errors:
+        print(f"WRONG {error}")
+    if args.save:
+        if errors:
+            print("Not saving a baseline with wrong perft counts")
+            return 1
+        save_baseline(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"No baseline in {args.baseline}, run with --save to make one")
+    if regressions:
+        print(f"{len(regressions)} regressed by more than "
+              f"{args.tolerance:.0%}")
+    return 1 if errors or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,535 @@
+from typing import List
+
+from chess import (BLACK_KINGSIDE, BLACK_QUEENSIDE, CASTLING_MASK,
+                   WHITE_KINGSIDE, WHITE_QUEENSIDE, ZOBRIST_PIECES,
+                   Chess, Move, PieceType, Side)
+from evaluation import PHASE_WEIGHTS, PIECE_VALUES, PSQT_EG, PSQT_MG
+
+# Squares are numbered 0 (a1) to 63 (h8), square = row*8 + file, and a
+# bitboard is a 64-bit int with one bit per square.
+BOARD_SQUARES = 64
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+ALL_SQUARES = (1 << BOARD_SQUARES) - 1
+
+WHITE = 0
+BLACK = 1
+SIDE_INDEX = {Side.WHITE: WHITE, Side.BLACK: BLACK}
+PIECE_TYPES = [PieceType.PAWN, PieceType.KNIGHT, PieceType.BISHOP,
+               PieceType.ROOK, PieceType.QUEEN, PieceType.KING]
+INDEX_SIDE = [Side.WHITE, Side.BLACK]
+ZOBRIST_BY_INDEX = [ZOBRIST_PIECES[Side.WHITE], ZOBRIST_PIECES[Side.BLACK]]
+
+
+def square_mask(row, file):
+    return 1 << (row*8 + file)
+
+
+def _step_targets(steps):
+    targets = []
+    for square in range(BOARD_SQUARES):
+        (row, file) = divmod(square, 8)
+        mask = 0
+        for (row_step, file_step) in steps:
+            to_row = row+row_step
+            to_file = file+file_step
+            if 0 <= to_row < 8 and 0 <= to_file < 8:
+                mask |= square_mask(to_row, to_file)
+        targets.append(mask)
+    return targets
+
+
+def _rays(row_step, file_step):
+    # squares beyond each square in one direction, up to the board edge
+    rays = []
+    for square in range(BOARD_SQUARES):
+        (row, file) = divmod(square, 8)
+        mask = 0
+        row += row_step
+        file += file_step
+        while 0 <= row < 8 and 0 <= file < 8:
+            mask |= square_mask(row, file)
+            row += row_step
+            file += file_step
+        rays.append(mask)
+    return rays
+
+
+KNIGHT_ATTACKS = _step_targets(Chess.KNIGHT_STEPS)
+KING_ATTACKS = _step_targets(Chess.KING_STEPS)
+# PAWN_ATTACKS[side][square] are the squares a pawn of that side attacks
+PAWN_ATTACKS = [_step_targets([(1, -1), (1, 1)]),
+                _step_targets([(-1, -1), (-1, 1)])]
+
+# Rays pointing to higher square numbers find their nearest blocker with
+# the lowest set bit, the others with the highest set bit.
+ROOK_RAYS_UP = [_rays(1, 0), _rays(0, 1)]
+ROOK_RAYS_DOWN = [_rays(-1, 0), _rays(0, -1)]
+BISHOP_RAYS_UP = [_rays(1, 1), _rays(1, -1)]
+BISHOP_RAYS_DOWN = [_rays(-1, -1), _rays(-1, 1)]
+ROOK_LINES = [ROOK_RAYS_UP[0][square] | ROOK_RAYS_UP[1][square]
+              | ROOK_RAYS_DOWN[0][square] | ROOK_RAYS_DOWN[1][square]
+              for square in range(BOARD_SQUARES)]
+BISHOP_LINES = [BISHOP_RAYS_UP[0][square] | BISHOP_RAYS_UP[1][square]
+                | BISHOP_RAYS_DOWN[0][square] | BISHOP_RAYS_DOWN[1][square]
+                for square in range(BOARD_SQUARES)]
+
+
+def _between():
+    # BETWEEN[a][b] are the squares strictly between two squares on a
+    # line, or 0 if they do not share one
+    between = [[0] * BOARD_SQUARES for square in range(BOARD_SQUARES)]
+    for square in range(BOARD_SQUARES):
+        for (row_step, file_step) in (Chess.ROOK_DIRECTIONS
+                                      + Chess.BISHOP_DIRECTIONS):
+            (row, file) = divmod(square, 8)
+            passed = 0
+            row += row_step
+            file += file_step
+            while 0 <= row < 8 and 0 <= file < 8:
+                between[square][row*8 + file] = passed
+                passed |= square_mask(row, file)
+                row += row_step
+                file += file_step
+    return between
+
+
+BETWEEN = _between()
+
+
+def _slide(square, occupied, rays_up, rays_down):
+    attacks = 0
+    for rays in rays_up:
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length()-1]
+        attacks |= ray
+    for rays in rays_down:
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[blockers.bit_length()-1]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(square, occupied):
+    return _slide(square, occupied, ROOK_RAYS_UP, ROOK_RAYS_DOWN)
+
+
+def bishop_attacks(square, occupied):
+    return _slide(square, occupied, BISHOP_RAYS_UP, BISHOP_RAYS_DOWN)
+
+
+class BitboardChess(Chess):
+    # Same rules and front-end as Chess, but the position is held in
+    # 64-bit integer bitboards rather than 64 BoardPiece objects.
+    # pieces[side*7 + piece_type] is the bitboard for that piece type, and
+    # pieces[side*7] (the NOPIECE slot) is the occupancy of that side.
+
+    def init_board(self):
+        self.pieces: List[int] = [0] * 14
+        self.occupied = 0
+
+    def _copy_board(self, game):
+        game.pieces = self.pieces[:]
+        game.occupied = self.occupied
+
+    def piece_type_on(self, square, side_index):
+        mask = 1 << square
+        pieces = self.pieces
+        base = side_index*7
+        if not pieces[base] & mask:
+            return PieceType.NOPIECE
+        for piece in PIECE_TYPES:
+            if pieces[base+piece] & mask:
+                return piece
+        return PieceType.NOPIECE
+
+    def piece_at(self, row, file):
+        square = row*8 + file
+        mask = 1 << square
+        if self.pieces[WHITE] & mask:
+            return (self.piece_type_on(square, WHITE), Side.WHITE)
+        if self.pieces[7] & mask:
+            return (self.piece_type_on(square, BLACK), Side.BLACK)
+        return (PieceType.NOPIECE, Side.NEUTRAL)
+
+    def placements(self):
+        result = []
+        for (side_index, color) in ((WHITE, Side.WHITE), (BLACK, Side.BLACK)):
+            for piece in PIECE_TYPES:
+                bits = self.pieces[side_index*7 + piece]
+                while bits:
+                    bit = bits & -bits
+                    bits ^= bit
+                    result.append((bit.bit_length()-1, piece, color))
+        return result
+
+    def king_square(self, side: Side):
+        kings = self.pieces[SIDE_INDEX[side]*7 + PieceType.KING]
+        if not kings:
+            return None
+        return divmod(kings.bit_length()-1, 8)
+
+    def remove_piece(self, piece_row, piece_file):
+        square = piece_row*8 + piece_file
+        mask = 1 << square
+        if not self.occupied & mask:
+            return
+        side_index = WHITE if self.pieces[WHITE] & mask else BLACK
+        piece = self.piece_type_on(square, side_index)
+        base = side_index*7
+        self.pieces[base+piece] ^= mask
+        self.pieces[base] ^= mask
+        self.occupied ^= mask
+        self.zobrist_key ^= ZOBRIST_BY_INDEX[side_index][piece][square]
+        self.material[INDEX_SIDE[side_index]] -= PIECE_VALUES[piece]
+        self.psq_mg -= PSQT_MG[side_index][piece][square]
+        self.psq_eg -= PSQT_EG[side_index][piece][square]
+        self.phase -= PHASE_WEIGHTS[piece]
+
+    def add_piece(self, piece: PieceType, color: Side, row, file):
+        self.remove_piece(row, file)
+        square = row*8 + file
+        mask = 1 << square
+        side_index = SIDE_INDEX[color]
+        base = side_index*7
+        self.pieces[base+piece] |= mask
+        self.pieces[base] |= mask
+        self.occupied |= mask
+        self.zobrist_key ^= ZOBRIST_BY_INDEX[side_index][piece][square]
+        self.material[color] += PIECE_VALUES[piece]
+        self.psq_mg += PSQT_MG[side_index][piece][square]
+        self.psq_eg += PSQT_EG[side_index][piece][square]
+        self.phase += PHASE_WEIGHTS[piece]
+
+    def move_piece(self, from_row, from_file, to_row, to_file,
+                   is_pawn_move_two=False):
+        (piece, color) = self.piece_at(from_row, from_file)
+        self.remove_piece(from_row, from_file)
+        self.add_piece(piece, color, to_row, to_file)
+        self._set_castling(self.castling
+                           & CASTLING_MASK[from_row*8 + from_file]
+                           & CASTLING_MASK[to_row*8 + to_file])
+        if is_pawn_move_two:
+            self._record_pawn_move_two(from_row, to_row, to_file)
+
+    def _record_pawn_move_two(self, from_row, to_row, file):
+        ep_square = ((from_row+to_row) // 2)*8 + file
+        us = SIDE_INDEX[self.turn]
+        if PAWN_ATTACKS[us][ep_square] & self.pieces[(1-us)*7 + PieceType.PAWN]:
+            self._set_ep_square(ep_square)
+
+    def attackers(self, square, side_index, occupied=None):
+        # bitboard of pieces of one side attacking the square
+        if occupied is None:
+            occupied = self.occupied
+        pieces = self.pieces
+        base = side_index*7
+        attackers = (
+            (PAWN_ATTACKS[1-side_index][square] & pieces[base+PieceType.PAWN])
+            | (KNIGHT_ATTACKS[square] & pieces[base+PieceType.KNIGHT])
+            | (KING_ATTACKS[square] & pieces[base+PieceType.KING]))
+        queens = pieces[base+PieceType.QUEEN]
+        rooks = pieces[base+PieceType.ROOK] | queens
+        if ROOK_LINES[square] & rooks:
+            attackers |= rook_attacks(square, occupied) & rooks
+        bishops = pieces[base+PieceType.BISHOP] | queens
+        if BISHOP_LINES[square] & bishops:
+            attackers |= bishop_attacks(square, occupied) & bishops
+        return attackers
+
+    def is_square_attacked(self, target_row, target_file, by_side: Side):
+        return self.attackers(target_row*8 + target_file,
+                              SIDE_INDEX[by_side]) != 0
+
+    def check_info(self):
+        # Same as Chess.check_info but in bitboards: the checkers bitboard,
+        # pins mapping each pinned square to a bitboard of where it can
+        # still move, and the bitboard of squares that answer the check
+        if self._check_info_key == self.zobrist_key:
+            return self._check_info
+        us = SIDE_INDEX[self.turn]
+        them = 1-us
+        pieces = self.pieces
+        king = pieces[us*7 + PieceType.KING].bit_length()-1
+        checkers = self.attackers(king, them)
+        pins = {}
+
+        queens = pieces[them*7 + PieceType.QUEEN]
+        snipers = ((ROOK_LINES[king]
+                    & (pieces[them*7 + PieceType.ROOK] | queens))
+                   | (BISHOP_LINES[king]
+                      & (pieces[them*7 + PieceType.BISHOP] | queens)))
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            between = BETWEEN[king][bit.bit_length()-1]
+            blockers = between & self.occupied
+            if (blockers and not blockers & (blockers-1)
+                    and blockers & pieces[us*7]):
+                pins[blockers.bit_length()-1] = between | bit
+
+        if not checkers:
+            evasions = ALL_SQUARES
+        elif checkers & (checkers-1):
+            evasions = 0  # double check, only the king can move
+        else:
+            evasions = BETWEEN[king][checkers.bit_length()-1] | checkers
+        self._check_info = (checkers, pins, evasions)
+        self._check_info_key = self.zobrist_key
+        return self._check_info
+
+    def checkers(self):
+        checkers = self.check_info()[0]
+        squares = []
+        while checkers:
+            bit = checkers & -checkers
+            checkers ^= bit
+            squares.append(bit.bit_length()-1)
+        return squares
+
+    def generate_pseudo_legal_moves(self) -> List[Move]:
+        return self._generate_moves(ALL_SQUARES, {}, False)
+
+    def generate_legal_moves(self) -> List[Move]:
+        (checkers, pins, evasions) = self.check_info()
+        return self._generate_moves(evasions, pins, True)
+
+    def generate_evasions(self) -> List[Move]:
+        if not self.check_info()[0]:
+            return []
+        return self.generate_legal_moves()
+
+    def generate_captures(self) -> List[Move]:
+        (checkers, pins, evasions) = self.check_info()
+        us = SIDE_INDEX[self.turn]
+        enemy = self.pieces[(1-us)*7]
+        last_rank = 0xff << 56 if us == WHITE else 0xff
+        # the mask does not apply to king moves and en passant
+        moves = self._generate_moves(evasions & (enemy | last_rank), pins,
+                                     True)
+        return [move for move in moves
+                if move.promotion != PieceType.NOPIECE
+                or (1 << (move.to_row*8 + move.to_file)) & enemy
+                or (move.to_row*8 + move.to_file == self.ep_square
+                    and self.piece_type_on(move.from_row*8 + move.from_file,
+                                           us) == PieceType.PAWN)]
+
+    def has_legal_move(self):
+        # stops at the first legal move found, only generating the
+        # evasions in check. Castling needs no look: when it is legal so
+        # is the king's step towards the rook.
+        (checkers, pins, evasions) = self.check_info()
+        if checkers:
+            return bool(self._generate_moves(evasions, pins, True))
+        us = SIDE_INDEX[self.turn]
+        them = 1-us
+        pieces = self.pieces
+        base = us*7
+        own = pieces[base]
+        occupied = self.occupied
+
+        for piece in (PieceType.KNIGHT, PieceType.BISHOP, PieceType.ROOK,
+                      PieceType.QUEEN):
+            movers = pieces[base+piece]
+            while movers:
+                bit = movers & -movers
+                movers ^= bit
+                from_square = bit.bit_length()-1
+                if piece == PieceType.KNIGHT:
+                    targets = KNIGHT_ATTACKS[from_square]
+                elif piece == PieceType.BISHOP:
+                    targets = bishop_attacks(from_square, occupied)
+                elif piece == PieceType.ROOK:
+                    targets = rook_attacks(from_square, occupied)
+                else:
+                    targets = (rook_attacks(from_square, occupied)
+                               | bishop_attacks(from_square, occupied))
+                targets &= ~own
+                if from_square in pins:
+                    targets &= pins[from_square]
+                if targets:
+                    return True
+
+        king_bit = pieces[base+PieceType.KING]
+        targets = KING_ATTACKS[king_bit.bit_length()-1] & ~own
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            if not self.attackers(bit.bit_length()-1, them,
+                                  occupied ^ king_bit):
+                return True
+
+        pawns = pieces[base+PieceType.PAWN]
+        empty = ~occupied & ALL_SQUARES
+        enemy = pieces[them*7]
+        if us == WHITE:
+            shifts = (((pawns << 8) & empty, 8),
+                      (((pawns & ~FILE_A) << 7) & enemy, 7),
+                      (((pawns & ~FILE_H) << 9) & enemy, 9))
+        else:
+            shifts = (((pawns >> 8) & empty, -8),
+                      (((pawns & ~FILE_A) >> 9) & enemy, -9),
+                      (((pawns & ~FILE_H) >> 7) & enemy, -7))
+        # a double step is only legal where the single one is
+        for (targets, shift) in shifts:
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                from_square = bit.bit_length()-1-shift
+                if from_square not in pins or bit & pins[from_square]:
+                    return True
+        if self.ep_square is not None:
+            return bool(self._generate_moves(1 << self.ep_square, pins, True,
+                                             pawns))
+        return False
+
+    def legal_moves_from(self, row, file) -> List[Move]:
+        (checkers, pins, evasions) = self.check_info()
+        return self._generate_moves(evasions, pins, True,
+                                    square_mask(row, file))
+
+    def _generate_moves(self, target_mask, pins, legal,
+                        from_mask=ALL_SQUARES) -> List[Move]:
+        # Moves of the side to move landing on target_mask, of the pieces
+        # on from_mask. With legal set the pins are respected and king
+        # moves and en passant are checked, so every move returned is
+        # legal.
+        moves: List[Move] = []
+        us = SIDE_INDEX[self.turn]
+        them = 1-us
+        pieces = self.pieces
+        base = us*7
+        own = pieces[base]
+        enemy = pieces[them*7]
+        occupied = self.occupied
+        empty = ~occupied & ALL_SQUARES
+
+        # pawns, all pushes and captures of one kind at once
+        pawns = pieces[base+PieceType.PAWN] & from_mask
+        if us == WHITE:
+            single = (pawns << 8) & empty
+            double = ((single & (0xff << 16)) << 8) & empty
+            left = ((pawns & ~FILE_A) << 7) & enemy
+            right = ((pawns & ~FILE_H) << 9) & enemy
+            shifts = ((single, 8), (double, 16), (left, 7), (right, 9))
+            last_rank = 0xff << 56
+        else:
+            single = (pawns >> 8) & empty
+            double = ((single & (0xff << 40)) >> 8) & empty
+            left = ((pawns & ~FILE_A) >> 9) & enemy
+            right = ((pawns & ~FILE_H) >> 7) & enemy
+            shifts = ((single, -8), (double, -16), (left, -9), (right, -7))
+            last_rank = 0xff
+        for (targets, shift) in shifts:
+            targets &= target_mask
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                to_square = bit.bit_length()-1
+                from_square = to_square-shift
+                if pins and from_square in pins and not bit & pins[from_square]:
+                    continue
+                (from_row, from_file) = divmod(from_square, 8)
+                (to_row, to_file) = divmod(to_square, 8)
+                if bit & last_rank:
+                    for promotion in Chess.PROMOTION_PIECES:
+                        moves.append(Move(from_row, from_file,
+                                          to_row, to_file, promotion))
+                else:
+                    moves.append(Move(from_row, from_file, to_row, to_file))
+        if self.ep_square is not None:
+            capturers = PAWN_ATTACKS[them][self.ep_square] & pawns
+            (to_row, to_file) = divmod(self.ep_square, 8)
+            while capturers:
+                bit = capturers & -capturers
+                capturers ^= bit
+                (from_row, from_file) = divmod(bit.bit_length()-1, 8)
+                move = Move(from_row, from_file, to_row, to_file)
+                if legal:
+                    # en passant takes two pieces off one row, just try it
+                    self.push(move)
+                    king = pieces[base+PieceType.KING].bit_length()-1
+                    safe = not self.attackers(king, them)
+                    self.pop()
+                    if not safe:
+                        continue
+                moves.append(move)
+
+        # pieces, one square at a time
+        for piece in (PieceType.KNIGHT, PieceType.BISHOP, PieceType.ROOK,
+                      PieceType.QUEEN):
+            movers = pieces[base+piece] & from_mask
+            while movers:
+                bit = movers & -movers
+                movers ^= bit
+                from_square = bit.bit_length()-1
+                if piece == PieceType.KNIGHT:
+                    targets = KNIGHT_ATTACKS[from_square]
+                elif piece == PieceType.BISHOP:
+                    targets = bishop_attacks(from_square, occupied)
+                elif piece == PieceType.ROOK:
+                    targets = rook_attacks(from_square, occupied)
+                else:
+                    targets = (rook_attacks(from_square, occupied)
+                               | bishop_attacks(from_square, occupied))
+                targets &= ~own & target_mask
+                if pins and from_square in pins:
+                    targets &= pins[from_square]
+                (from_row, from_file) = divmod(from_square, 8)
+                while targets:
+                    bit = targets & -targets
+                    targets ^= bit
+                    (to_row, to_file) = divmod(bit.bit_length()-1, 8)
+                    moves.append(Move(from_row, from_file, to_row, to_file))
+
+        # the king, checked with itself lifted off the board so it cannot
+        # hide behind its own square from a slider
+        king_bit = pieces[base+PieceType.KING]
+        if not king_bit & from_mask:
+            return moves
+        king = king_bit.bit_length()-1
+        targets = KING_ATTACKS[king] & ~own
+        (from_row, from_file) = divmod(king, 8)
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            to_square = bit.bit_length()-1
+            if legal and self.attackers(to_square, them, occupied ^ king_bit):
+                continue
+            moves.append(Move(from_row, from_file, *divmod(to_square, 8)))
+        if target_mask == ALL_SQUARES:
+            self._add_castling_moves(moves)
+        return moves
+
+    def _add_castling_moves(self, moves: List[Move]):
+        us = SIDE_INDEX[self.turn]
+        if us == WHITE:
+            rights = (WHITE_KINGSIDE, WHITE_QUEENSIDE)
+            row = 0
+        else:
+            rights = (BLACK_KINGSIDE, BLACK_QUEENSIDE)
+            row = 7
+        if not self.castling & (rights[0] | rights[1]):
+            return
+        king_square = row*8 + 4
+        if self.attackers(king_square, 1-us):
+            return
+        occupied = self.occupied
+        if (self.castling & rights[0]
+                and not occupied & (0x60 << (row*8))
+                and not self.attackers(king_square+1, 1-us)
+                and not self.attackers(king_square+2, 1-us)):
+            moves.append(Move(row, 4, row, 6))
+        if (self.castling & rights[1]
+                and not occupied & (0x0e << (row*8))
+                and not self.attackers(king_square-1, 1-us)
+                and not self.attackers(king_square-2, 1-us)):
+            moves.append(Move(row, 4, row, 2))
+
+
+# the games by the name --backend, tournament players and bench.py give
+BACKENDS = {"board": Chess, "bitboard": BitboardChess}
@@ -0,0 +1,237 @@
+import collections
+import heapq
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import tempfile
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from chess import (Chess, ChessInputError, ChessMoveError, Move, Side,
+                   decode_move, encode_move)
+from pgn import PgnGame, parse_game, split_games
+
+# Book file, a sorted array of fixed size entries with no header so it can
+# be searched where it lies:
+#   position zobrist_key  8 bytes
+#   move, as chess.encode_move  2 bytes
+#   weight  2 bytes
+# little endian, ordered by key then move.
+ENTRY_FORMAT = struct.Struct("<QHH")
+ENTRY_SIZE = ENTRY_FORMAT.size  # 12
+KEY_FORMAT = struct.Struct("<Q")
+MAX_WEIGHT = 65535
+# entries of the temporary runs written while building, the weight is
+# not capped yet
+RUN_FORMAT = struct.Struct("<QHI")
+
+BOOK_PLIES = 24  # moves from the start of each game put in the book
+RUN_ENTRIES = 1 << 20  # distinct entries summed in memory per run
+RESULT_WINNERS = {"1-0": Side.WHITE, "0-1": Side.BLACK}
+
+
+class BookEntry(NamedTuple):
+    move: Move
+    weight: int
+
+
+def game_entries(game: Chess, pgn_game: PgnGame,
+                 plies=BOOK_PLIES) -> Iterator[tuple]:
+    # (key, encoded move, weight) for the opening moves of a game, stopping
+    # at an illegal one. A move weighs 2 if its side won, 1 if the game
+    # was drawn or has no result and 0, left out, if its side lost.
+    try:
+        if "FEN" in pgn_game.headers:
+            game.set_fen(pgn_game.headers["FEN"])
+        else:
+            game.reset()
+    except ChessInputError:
+        return
+    winner = RESULT_WINNERS.get(pgn_game.result)
+    for san in pgn_game.moves[:plies]:
+        try:
+            move = game.parse_san(san)
+        except (ChessInputError, ChessMoveError):
+            return
+        if winner is None:
+            yield (game.zobrist_key, encode_move(move), 1)
+        elif game.turn == winner:
+            yield (game.zobrist_key, encode_move(move), 2)
+        game.push(move)
+
+
+# one Chess per worker process, reset for each game it replays
+_worker_game: Optional[Chess] = None
+
+def _init_worker(backend):
+    global _worker_game
+    _worker_game = backend()
+
+def _batch_entries(batch):
+    (texts, plies) = batch
+    entries = []
+    for text in texts:
+        entries.extend(game_entries(_worker_game, parse_game(text), plies))
+    return entries
+
+
+def _entry_batches(texts: Iterable[str], processes: Optional[int],
+                   plies, backend, batch_size=64) -> Iterator[List[tuple]]:
+    # the entries of every game, a batch of games at a time, with few
+    # batches in flight as in pgn.validate_games
+    if processes == 1:
+        game = backend()
+        for text in texts:
+            yield list(game_entries(game, parse_game(text), plies))
+        return
+
+    with multiprocessing.Pool(processes, _init_worker, (backend,)) as pool:
+        max_pending = 4 * (processes or multiprocessing.cpu_count())
+        pending = collections.deque()
+        batch: List[str] = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) == batch_size:
+                pending.append(pool.apply_async(_batch_entries,
+                                                ((batch, plies),)))
+                batch = []
+                if len(pending) >= max_pending:
+                    yield pending.popleft().get()
+        if batch:
+            pending.append(pool.apply_async(_batch_entries,
+                                            ((batch, plies),)))
+        while pending:
+            yield pending.popleft().get()
+
+
+def _write_run(weights: Dict[tuple, int]):
+    run = tempfile.TemporaryFile()
+    entries = sorted(weights.items())
+    for start in range(0, len(entries), 65536):
+        run.write(b"".join(RUN_FORMAT.pack(key, move, weight)
+                           for ((key, move), weight)
+                           in entries[start:start+65536]))
+    run.seek(0)
+    return run
+
+def _read_run(run) -> Iterator[tuple]:
+    while True:
+        data = run.read(RUN_FORMAT.size * 4096)
+        if not data:
+            return
+        yield from RUN_FORMAT.iter_unpack(data)
+
+
+def build_book(pgn_paths: Iterable[str], book_path: str,
+               processes: Optional[int] = None, plies=BOOK_PLIES,
+               backend=Chess) -> int:
+    # Compiles the opening moves of every game in the PGN files into a
+    # book, returning the number of entries. Weights are summed in memory
+    # up to RUN_ENTRIES entries at a time, each batch is written out as a
+    # sorted temporary run, and the runs are merged into the book, so the
+    # corpus can be much bigger than memory.
+    def texts():
+        for path in pgn_paths:
+            with open(path, encoding="utf-8", errors="replace") as stream:
+                yield from split_games(stream)
+
+    runs = []
+    try:
+        weights: Dict[tuple, int] = {}
+        for entries in _entry_batches(texts(), processes, plies, backend):
+            for (key, move, weight) in entries:
+                weights[key, move] = weights.get((key, move), 0) + weight
+            if len(weights) >= RUN_ENTRIES:
+                runs.append(_write_run(weights))
+                weights = {}
+        runs.append(_write_run(weights))
+
+        count = 0
+        buffer = []
+        with open(book_path, "wb") as book:
+            merged = heapq.merge(*[_read_run(run) for run in runs])
+            (last_key, last_move, total) = (None, None, 0)
+            for (key, move, weight) in merged:
+                if (key, move) != (last_key, last_move):
+                    if last_key is not None:
+                        buffer.append(ENTRY_FORMAT.pack(
+                            last_key, last_move, min(total, MAX_WEIGHT)))
+                        count += 1
+                        if len(buffer) == 65536:
+                            book.write(b"".join(buffer))
+                            buffer = []
+                    (last_key, last_move, total) = (key, move, 0)
+                total += weight
+            if last_key is not None:
+                buffer.append(ENTRY_FORMAT.pack(last_key, last_move,
+                                                min(total, MAX_WEIGHT)))
+                count += 1
+            book.write(b"".join(buffer))
+        return count
+    finally:
+        for run in runs:
+            run.close()
+
+
+class OpeningBook:
+    # A book file opened with mmap and binary searched in place. Opening
+    # takes the same time for a book of any size, and only the pages a
+    # lookup touches are read from disk.
+
+    def __init__(self, path: str, rng: Optional[random.Random] = None):
+        self.path = path
+        self.rng = rng  # picks by weight, None always plays the heaviest
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.entries = size // ENTRY_SIZE
+        if size:
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            if hasattr(self.data, "madvise"):
+                self.data.madvise(mmap.MADV_RANDOM)
+        else:
+            self.data = b""  # an empty file cannot be mapped
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, key) -> List[BookEntry]:
+        (low, high) = (0, self.entries)
+        while low < high:
+            middle = (low + high) // 2
+            if KEY_FORMAT.unpack_from(self.data, middle*ENTRY_SIZE)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for index in range(low, self.entries):
+            (entry_key, move, weight) = ENTRY_FORMAT.unpack_from(
+                self.data, index*ENTRY_SIZE)
+            if entry_key != key:
+                break
+            entries.append(BookEntry(decode_move(move), weight))
+        return entries
+
+    def choose_move(self, game: Chess) -> Optional[Move]:
+        # a book move for the position, or None out of book. Moves are
+        # checked against the legal ones in case two positions share a key.
+        entries = self.lookup(game.zobrist_key)
+        if not entries:
+            return None
+        legal = game.generate_legal_moves()
+        entries = [entry for entry in entries if entry.move in legal]
+        if not entries:
+            return None
+        if self.rng is None:
+            return max(entries, key=lambda entry: entry.weight).move
+        return self.rng.choices([entry.move for entry in entries],
+                                [entry.weight for entry in entries])[0]
@@ -1,9 +1,11 @@
-import copy
-from email.errors import NonPrintableDefect
 import enum
-import os
-from tkinter import PIESLICE
-from typing import List, Optional
+import random
+import re
+from array import array
+from typing import List, NamedTuple, Optional
+
+from evaluation import PHASE_WEIGHTS, PIECE_VALUES, PSQT_EG, PSQT_MG, taper
+from render import Renderer, board_lines
 
 class PieceType(enum.IntEnum):
     NOPIECE = 0
@@ -23,18 +25,139 @@ class BoardPiece:
     def __init__(self, piece: PieceType, color: Side, row, file):
         self.piece = piece
         self.color = color
-        self.last_move = 0  # for special moves like castling
-        self.pawn_move_two = False  # was last move a pawn moving two squares
         self.row = row
         self.file = file
         self.next: BoardPiece = None  # for linked list of pieces of the same side
         self.prev: BoardPiece = None
 
+class Move(NamedTuple):
+    from_row: int
+    from_file: int
+    to_row: int
+    to_file: int
+    promotion: PieceType = PieceType.NOPIECE
+
+    def __str__(self):
+        # long algebraic notation, e.g. e2e4 or e7e8q
+        text = (f"{FILE_NAMES[self.from_file]}{self.from_row+1}"
+                f"{FILE_NAMES[self.to_file]}{self.to_row+1}")
+        if self.promotion != PieceType.NOPIECE:
+            text += PROMOTION_NAMES[self.promotion]
+        return text
+
+def encode_move(move: Move) -> int:
+    # 16 bits: from square, to square and promotion piece, squares are
+    # row*8 + file
+    (from_row, from_file, to_row, to_file, promotion) = move
+    return ((from_row*8 + from_file) | (to_row*8 + to_file) << 6
+            | promotion << 12)
+
+def decode_move(code: int) -> Move:
+    (from_row, from_file) = divmod(code & 63, 8)
+    (to_row, to_file) = divmod(code >> 6 & 63, 8)
+    return Move(from_row, from_file, to_row, to_file, PIECE_TYPES[code >> 12])
+
+FILE_NAMES = "abcdefgh"
+PIECE_TYPES = list(PieceType)  # by value, quicker than calling PieceType
+PROMOTION_NAMES = {PieceType.KNIGHT: 'n', PieceType.BISHOP: 'b',
+                   PieceType.ROOK: 'r', PieceType.QUEEN: 'q'}
+PROMOTION_PIECE_NAMES = {name: piece
+                         for (piece, name) in PROMOTION_NAMES.items()}
+SAN_PIECES = {'N': PieceType.KNIGHT, 'B': PieceType.BISHOP,
+              'R': PieceType.ROOK, 'Q': PieceType.QUEEN, 'K': PieceType.KING}
+# piece, from file, from row, destination, promotion
+SAN_PATTERN = re.compile(
+    r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$")
+LAN_PATTERN = re.compile(r"^[a-h][1-8][a-h][1-8][nbrq]?$")
+FEN_NAMES = {PieceType.PAWN: 'P', PieceType.KNIGHT: 'N',
+             PieceType.BISHOP: 'B', PieceType.ROOK: 'R',
+             PieceType.QUEEN: 'Q', PieceType.KING: 'K'}
+FEN_PIECES = {name: piece for (piece, name) in FEN_NAMES.items()}
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# castling rights bits
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+
+# castling rights kept after a piece moves from or to each square,
+# squares are numbered row*8 + file
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[0] = ALL_CASTLING & ~WHITE_QUEENSIDE
+CASTLING_MASK[4] = ALL_CASTLING & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[7] = ALL_CASTLING & ~WHITE_KINGSIDE
+CASTLING_MASK[56] = ALL_CASTLING & ~BLACK_QUEENSIDE
+CASTLING_MASK[60] = ALL_CASTLING & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[63] = ALL_CASTLING & ~BLACK_KINGSIDE
+
+# (right, side, king square, rook square) for each castling right
+CASTLING_HOMES = [(WHITE_KINGSIDE, Side.WHITE, 4, 7),
+                  (WHITE_QUEENSIDE, Side.WHITE, 4, 0),
+                  (BLACK_KINGSIDE, Side.BLACK, 60, 63),
+                  (BLACK_QUEENSIDE, Side.BLACK, 60, 56)]
+FEN_CASTLING = {'K': WHITE_KINGSIDE, 'Q': WHITE_QUEENSIDE,
+                'k': BLACK_KINGSIDE, 'q': BLACK_QUEENSIDE}
+
+# Zobrist keys, from a fixed seed so position hashes are the same in
+# every process and can be stored on disk
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = {
+    color: [[_zobrist_random.getrandbits(64) for square in range(64)]
+            for piece in PieceType]
+    for color in (Side.WHITE, Side.BLACK)}
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for rights in range(16)]
+ZOBRIST_CASTLING[0] = 0
+ZOBRIST_EP_FILE = [_zobrist_random.getrandbits(64) for file in range(8)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)  # black to move
+
+# evaluation.py tables by Side, signed so White's pieces add and Black's
+# subtract
+PSQT_MG_BY_SIDE = {Side.WHITE: PSQT_MG[0], Side.BLACK: PSQT_MG[1]}
+PSQT_EG_BY_SIDE = {Side.WHITE: PSQT_EG[0], Side.BLACK: PSQT_EG[1]}
+
+class GameStatus(enum.Enum):
+    ONGOING = 0
+    CHECKMATE = 1
+    STALEMATE = 2
+    REPETITION = 3  # the same position for the third time
+    FIFTY_MOVES = 4  # fifty moves each without a capture or pawn move
+
+class MoveResult(NamedTuple):
+    move: Move
+    piece: PieceType  # piece that moved, before any promotion
+    captured: PieceType
+    check: bool  # the side now to move is in check
+    status: GameStatus
+
+class Snapshot(NamedTuple):
+    # A position that cannot change, from Chess.snapshot(), to hand to
+    # spectators or other threads while the game goes on. Chess.restore()
+    # or Chess.from_snapshot() load it into a game to play on.
+    pieces: tuple  # (row, file, piece, color) like Chess.SETUP
+    turn: Side
+    castling: int
+    ep_square: Optional[int]
+    halfmove_clock: int
+    move_num: int
+    # zobrist keys of the positions since the last capture or pawn move,
+    # ending with this one, the only ones it can be a repetition of
+    keys: tuple
+
+    @property
+    def zobrist_key(self):
+        return self.keys[-1]
+
 class ChessInputError(Exception):
     pass
 
 class ChessMoveError(Exception):
     pass
+
+class ChessPromotionError(ChessMoveError):
+    # the move is legal once a promotion piece is given
+    pass
     
 class Chess:
     BOARD_SIZE = 8
@@ -80,75 +203,321 @@ class Chess:
     BLACK_PIECES = [' ', '\u265f', '\u265e', '\u265d',
                     '\u265c', '\u265b', '\u265a']
     STARTING_PLAYER = Side.WHITE
+    MAX_PLY = 256  # undo records allocated up front, more are added if needed
+    CHECKPOINT_INTERVAL = 32  # plies between positions kept for seek()
+
+    # (row, file) offsets used by move generation
+    KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2),
+                    (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+    KING_STEPS = [(1, 0), (1, 1), (0, 1), (-1, 1),
+                  (-1, 0), (-1, -1), (0, -1), (1, -1)]
+    ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    PROMOTION_PIECES = [PieceType.QUEEN, PieceType.ROOK,
+                        PieceType.BISHOP, PieceType.KNIGHT]
 
     def __init__(self):
-        self.board: List[List[BoardPiece]]= [[],] * Chess.BOARD_SIZE
         self.squares = [[],] * Chess.BOARD_SIZE  # square colours
-        self.turn: Side = Chess.STARTING_PLAYER
-        self.move_num = 1
+        # undo records reused by push/pop: move, captured piece, captured
+        # square, castling, ep_square and halfmove_clock before the move
+        self._undo_stack = [[None] * 6 for i in range(Chess.MAX_PLY)]
+
+        for i in range(Chess.BOARD_SIZE):
+            self.squares[i] = [' ',] * Chess.BOARD_SIZE
+            self.squares[i][(i % 2):Chess.BOARD_SIZE:2] = (
+                ['#',] * ((Chess.BOARD_SIZE + i%2) // 2))
+
+        self.reset()
+
+    def clone(self):
+        # A game of the same class at this position, with the same record
+        # and repetition counts, that can be played on without affecting
+        # this one. Much cheaper than copy.deepcopy: the board is copied
+        # piece by piece and the game record is shared until either game
+        # changes it.
+        game = self.__class__.__new__(self.__class__)
+        game.squares = self.squares  # never changed
+        # only the records in use, push() adds more as needed
+        game._undo_stack = [record[:]
+                            for record in self._undo_stack[:self.ply]]
+        for name in ("turn", "move_num", "zobrist_key", "castling",
+                     "ep_square", "halfmove_clock", "ply", "psq_mg", "psq_eg",
+                     "phase", "_check_info_key", "_check_info", "start_ply",
+                     "_log", "_log_keys", "_checkpoints", "_earlier_keys"):
+            setattr(game, name, getattr(self, name))
+        game.material = self.material.copy()
+        game._keys = self._keys[:]
+        game._key_counts = self._key_counts.copy()
+        game._record_shared = self._record_shared = True
+        self._copy_board(game)
+        return game
+
+    def _copy_board(self, game):
+        # the pieces of this game onto a new game, kept in the same list
+        # order so both generate moves in the same order
+        game.init_board()
+        for color in (Side.WHITE, Side.BLACK):
+            last = None
+            piece = self.piece_list[color]
+            while piece is not None:
+                square = game.board[piece.row][piece.file]
+                square.piece = piece.piece
+                square.color = color
+                square.prev = last
+                if last is None:
+                    game.piece_list[color] = square
+                else:
+                    last.next = square
+                last = square
+                piece = piece.next
+            king = self.kings[color]
+            if king is not None:
+                game.kings[color] = game.board[king.row][king.file]
+
+    def snapshot(self) -> Snapshot:
+        keys = self._keys[max(0, len(self._keys) - self.halfmove_clock - 1):]
+        missing = self.halfmove_clock + 1 - len(keys)
+        if missing > 0 and self._earlier_keys:
+            keys = list(self._earlier_keys[-missing:]) + keys
+        (pieces, *state) = self._snapshot()
+        # pieces in square order, so equal positions make equal snapshots
+        return Snapshot(tuple(sorted(pieces)), *state, tuple(keys))
+
+    def restore(self, snapshot: Snapshot):
+        # set up a snapshot's position, starting a new game record from it
+        # that knows the positions it can repeat
+        self._load_position(*snapshot[:6])
+        self._start_record(snapshot.keys[:-1])
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot):
+        game = cls()
+        game.restore(snapshot)
+        return game
+
+    def reset(self):
+        # back to the starting position, reusing this object so callers
+        # replaying many games need not build a new one per game
+        self.set_position(Chess.SETUP, Chess.STARTING_PLAYER, ALL_CASTLING)
+
+    def set_position(self, pieces, turn: Side = Side.WHITE,
+                     castling=ALL_CASTLING, ep_square: Optional[int] = None,
+                     halfmove_clock=0, move_num=1):
+        # pieces are (row, file, piece, color) like SETUP. Castling rights
+        # without the king and rook at home are dropped, as is an en
+        # passant square no pawn can capture on.
+        squares = set((row, file) for (row, file, piece, color) in pieces)
+        if len(squares) != len(pieces):
+            raise ChessInputError("Two pieces on one square")
+        for color in (Side.WHITE, Side.BLACK):
+            if [piece for (row, file, piece, piece_color) in pieces
+                    if piece == PieceType.KING and piece_color == color
+                    ] != [PieceType.KING]:
+                raise ChessInputError("Each side needs one King")
+
+        self._load_position(pieces, turn, castling, ep_square, halfmove_clock,
+                            move_num)
+        self._start_record()
+
+    def _start_record(self, earlier_keys=()):
+        # game record, moves played with make_move from this position
+        self.start_ply = 0  # game ply of the bottom of the undo stack
+        self._log = array('H')  # encode_move of each move, kept for redo()
+        self._log_keys = array('Q')  # zobrist_key after each move
+        self._checkpoints = [self._snapshot()]  # every CHECKPOINT_INTERVAL
+        self._record_shared = False  # the three above are shared by a clone
+        # keys of the positions since this one, with how often each occurs,
+        # and of earlier positions it can repeat, which are counted but
+        # cannot be reached with pop()
+        self._keys = [self.zobrist_key]
+        self._key_counts = {self.zobrist_key: 1}
+        self._earlier_keys = tuple(earlier_keys)
+        for key in earlier_keys:
+            self._key_counts[key] = self._key_counts.get(key, 0) + 1
+
+    def _load_position(self, pieces, turn, castling, ep_square,
+                       halfmove_clock, move_num):
+        self.turn: Side = turn
+        self.move_num = move_num
+        self.zobrist_key = 0  # updated as pieces and state change
+        self.castling = 0
+        self.ep_square: Optional[int] = None  # behind a pawn that moved two
+        self.halfmove_clock = halfmove_clock  # for the fifty move rule
+        self.ply = 0
+        # evaluation terms, updated as pieces are added and removed
+        self.material = {Side.WHITE: 0, Side.BLACK: 0}  # without kings
+        self.psq_mg = 0  # material and piece squares, White minus Black
+        self.psq_eg = 0
+        self.phase = 0  # PHASE_WEIGHTS of the pieces on the board
+        self._check_info_key = None  # zobrist_key check_info is cached for
+        self._check_info = None
+
+        self.init_board()
+
+        for piece_position in pieces:
+            (row, file, piece, color) = piece_position
+            self.add_piece(piece, color, row, file)
+
+        for (right, color, king, rook) in CASTLING_HOMES:
+            if (self.piece_at(*divmod(king, 8)) != (PieceType.KING, color)
+                    or self.piece_at(*divmod(rook, 8)) != (PieceType.ROOK,
+                                                           color)):
+                castling &= ~right
+        self._set_castling(castling)
+
+        if ep_square is not None:
+            (row, file) = divmod(ep_square, 8)
+            mover = Side.WHITE if turn == Side.BLACK else Side.BLACK
+            (from_row, to_row) = (1, 3) if mover == Side.WHITE else (6, 4)
+            if (row == (from_row+to_row) // 2
+                    and self.piece_at(to_row, file) == (PieceType.PAWN,
+                                                        mover)):
+                self.turn = mover  # as if the pawn had just moved
+                self._record_pawn_move_two(from_row, to_row, file)
+                self.turn = turn
+        if self.turn == Side.BLACK:
+            self.zobrist_key ^= ZOBRIST_SIDE
+
+    def set_fen(self, fen: str):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ChessInputError("FEN needs at least four fields")
+        rows = fields[0].split("/")
+        if len(rows) != Chess.BOARD_SIZE:
+            raise ChessInputError("FEN board needs eight rows")
+        pieces = []
+        for (i, row_text) in enumerate(rows):
+            row = Chess.BOARD_SIZE-1 - i
+            file = 0
+            for char in row_text:
+                if char.isdigit():
+                    file += int(char)
+                    continue
+                piece = FEN_PIECES.get(char.upper())
+                if piece is None or file >= Chess.BOARD_SIZE:
+                    raise ChessInputError(f"Invalid FEN row {row_text}")
+                color = Side.WHITE if char.isupper() else Side.BLACK
+                pieces.append((row, file, piece, color))
+                file += 1
+            if file != Chess.BOARD_SIZE:
+                raise ChessInputError(f"Invalid FEN row {row_text}")
+
+        if fields[1] not in ("w", "b"):
+            raise ChessInputError("FEN side to move must be w or b")
+        turn = Side.WHITE if fields[1] == "w" else Side.BLACK
+        castling = 0
+        if fields[2] != "-":
+            for char in fields[2]:
+                if char not in FEN_CASTLING:
+                    raise ChessInputError(f"Invalid FEN castling {fields[2]}")
+                castling |= FEN_CASTLING[char]
+        ep_square = None
+        if fields[3] != "-":
+            (row, file) = Chess.parse_position(fields[3])
+            ep_square = row*8 + file
+        try:
+            halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            move_num = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ChessInputError("Invalid FEN move counters")
+        self.set_position(pieces, turn, castling, ep_square,
+                          halfmove_clock, move_num)
+
+    def fen(self) -> str:
+        rows = []
+        for row in range(Chess.BOARD_SIZE-1, -1, -1):
+            row_text = ""
+            empty = 0
+            for file in range(Chess.BOARD_SIZE):
+                (piece, color) = self.piece_at(row, file)
+                if piece == PieceType.NOPIECE:
+                    empty += 1
+                    continue
+                if empty:
+                    row_text += str(empty)
+                    empty = 0
+                name = FEN_NAMES[piece]
+                row_text += name if color == Side.WHITE else name.lower()
+            if empty:
+                row_text += str(empty)
+            rows.append(row_text)
+        castling = "".join(char for (char, right) in FEN_CASTLING.items()
+                           if self.castling & right) or "-"
+        if self.ep_square is None:
+            ep = "-"
+        else:
+            (row, file) = divmod(self.ep_square, 8)
+            ep = f"{FILE_NAMES[file]}{row+1}"
+        turn = "w" if self.turn == Side.WHITE else "b"
+        return (f"{'/'.join(rows)} {turn} {castling} {ep} "
+                f"{self.halfmove_clock} {self.move_num}")
+
+    def init_board(self):
+        # empty board of square objects, each piece is linked into the
+        # piece list of its side
         self.piece_list: dict[Side, Optional[BoardPiece]] = {
             Side.WHITE: None, Side.BLACK: None}
         self.kings = {Side.WHITE: None, Side.BLACK: None}
+        if getattr(self, "flat_board", None) is not None:
+            # setting up another position, clear the existing squares
+            for square in self.flat_board:
+                square.piece = PieceType.NOPIECE
+                square.color = Side.NEUTRAL
+                square.next = None
+                square.prev = None
+            return
 
+        self.board: List[List[BoardPiece]]= [[],] * Chess.BOARD_SIZE
         for i in range(Chess.BOARD_SIZE):
             self.board[i] = [None,] * Chess.BOARD_SIZE
             for j in range(Chess.BOARD_SIZE):
                 self.board[i][j] = BoardPiece(PieceType.NOPIECE,
                                               Side.NEUTRAL,
                                               i, j)
-            self.squares[i] = [' ',] * Chess.BOARD_SIZE
-            self.squares[i][(i % 2):Chess.BOARD_SIZE:2] = (
-                ['#',] * ((Chess.BOARD_SIZE + i%2) // 2))
+        # the same square objects indexed by row*8 + file
+        self.flat_board: List[BoardPiece] = [
+            square for row in self.board for square in row]
 
-        # Set up default chessboard
-        for piece_position in Chess.SETUP:
-            (row, file, piece, color) = piece_position
-            try:
-                self.add_piece(piece, color, row, file, 0)
-                if piece == PieceType.KING:
-                    self.kings[color] = self.board[row][file]
-            except IndexError:
-                # Do nothing if out of range
-                pass
-        
-        assert(self.kings[Side.WHITE] is not None)
-        assert(self.kings[Side.BLACK] is not None)
+    def piece_at(self, row, file):
+        square = self.board[row][file]
+        return (square.piece, square.color)
 
-    def print_board(self):
-        print("")
+    def placements(self):
+        # (square, piece, color) for every piece on the board
+        result = []
+        for color in (Side.WHITE, Side.BLACK):
+            piece = self.piece_list[color]
+            while piece is not None:
+                result.append((piece.row*8 + piece.file, piece.piece, color))
+                piece = piece.next
+        return result
 
-        # top of board
-        print("  ", end="")
-        for i in range(Chess.BOARD_SIZE):
-            print("__", end="")
-        print("_")
-        
-        # the board itself
-        for row in range(Chess.BOARD_SIZE-1,-1,-1):
-            print(f"{row+1} ", end="")
-            for file, piece in enumerate(self.board[row]):
-                print("|", end="")
-                if piece.piece == PieceType.NOPIECE:
-                    print(self.squares[row][file], end="")
-                elif piece.color == Side.WHITE:
-                    print(Chess.WHITE_PIECES[piece.piece], end="")
-                elif piece.color == Side.BLACK:
-                    print(Chess.BLACK_PIECES[piece.piece], end="")
+    def king_square(self, side: Side):
+        king = self.kings[side]
+        if king is None:
+            return None
+        return (king.row, king.file)
+
+    def board_cells(self) -> List[List[str]]:
+        # the character shown on each square, row 8 first
+        cells = []
+        for row in range(Chess.BOARD_SIZE-1, -1, -1):
+            row_cells = []
+            for file in range(Chess.BOARD_SIZE):
+                (piece, color) = self.piece_at(row, file)
+                if piece == PieceType.NOPIECE:
+                    row_cells.append(self.squares[row][file])
+                elif color == Side.WHITE:
+                    row_cells.append(Chess.WHITE_PIECES[piece])
                 else:
-                    assert(True)
-            print("|")
+                    row_cells.append(Chess.BLACK_PIECES[piece])
+            cells.append(row_cells)
+        return cells
 
-        # bottom of board
-        print("  ", end="")
-        for i in range(Chess.BOARD_SIZE):
-            print("~~", end="")
-        print("~")
+    def print_board(self):
+        # one write for the whole board
+        print("\n" + "\n".join(board_lines(self.board_cells())))
 
-        print("  ", end="")
-        for file_char in ['a','b','c','d','e','f','g','h']:
-            print(f" {file_char}", end="")
-        print("")
-    
     def input_move(self):
         if self.turn == Side.WHITE:
             print("White to move:")
@@ -158,10 +527,10 @@ class Chess:
         print("Enter position of piece to move (e.g. a1)")
         piece_pos = input(">>> ")
         (piece_row, piece_file) = Chess.parse_position(piece_pos)
-        if (self.board[piece_row][piece_file].piece ==
-                PieceType.NOPIECE):
+        (piece, color) = self.piece_at(piece_row, piece_file)
+        if piece == PieceType.NOPIECE:
             raise ChessInputError("No piece there!")
-        if self.board[piece_row][piece_file].color != self.turn:
+        if color != self.turn:
             raise ChessInputError("Not your piece!")
 
         print("Enter position to move to")
@@ -172,6 +541,14 @@ class Chess:
 
         
     
+    def input_and_make_move(self) -> MoveResult:
+        (from_row, from_file, to_row, to_file) = self.input_move()
+        try:
+            return self.make_move(from_row, from_file, to_row, to_file)
+        except ChessPromotionError:
+            return self.make_move(from_row, from_file, to_row, to_file,
+                                  self.choose_promotion())
+
     def parse_position(input_text: str):
         # hardcoded to assume rank and file are one character each
         # TODO allow regex to catch sequence of letters followed by numbers
@@ -180,17 +557,16 @@ class Chess:
         file = ord(input_text[0]) - ord('a')
         if file < 0 or file >= Chess.BOARD_SIZE:
             raise ChessInputError("Invalid file notation")
-        row = int(input_text[1]) - 1
-        if row < 0 or row >= Chess.BOARD_SIZE:
+        if not "1" <= input_text[1] <= str(Chess.BOARD_SIZE):
             raise ChessInputError("Invalid row notation")
+        row = int(input_text[1]) - 1
         return(row, file)
 
-    def make_move(self, from_row, from_file, to_row, to_file):
-        valid_move = False
-        is_pawn_move_two = False
-        passant_target: Optional[BoardPiece] = None
-        kingside_castling_rook: Optional[BoardPiece] = None
-        queenside_castling_rook: Optional[BoardPiece] = None
+    def make_move(self, from_row, from_file, to_row, to_file,
+                  promotion: Optional[PieceType] = None) -> MoveResult:
+        # Validate and play a move for the side to move. Never prompts:
+        # a pawn reaching the last row needs the promotion piece, and
+        # ChessPromotionError is raised if it is missing.
         other_side = Side.WHITE if self.turn == Side.BLACK else Side.BLACK
         general_error_msg = "Invalid move!"
 
@@ -198,260 +574,182 @@ class Chess:
         if (from_row == to_row and from_file == to_file):
             raise ChessMoveError("Cannot move to same square")
 
+        (piece, color) = self.piece_at(from_row, from_file)
+        if piece == PieceType.NOPIECE:
+            raise ChessMoveError("No piece there!")
+        if color != self.turn:
+            raise ChessMoveError("Not your piece!")
+
         # check own piece is not at destination
-        move_piece = self.board[from_row][from_file]
-        to_square = self.board[to_row][to_file]
-        if (self.board[to_row][to_file].piece != PieceType.NOPIECE
-                and move_piece.color == self.board[to_row][to_file].color):
+        (captured, captured_color) = self.piece_at(to_row, to_file)
+        if captured != PieceType.NOPIECE and captured_color == color:
             raise ChessMoveError("Cannot take own piece")
 
-        black_pawn_row = Chess.BOARD_SIZE - 2
-        row_diff = abs(to_row - from_row)
-        file_diff = abs(to_file - from_file)
-
-
-        # special rules for each piece
-        if move_piece.piece == PieceType.PAWN and self.turn == Side.WHITE:
-            # White pawn
-            # allow capture
-            if (to_row == from_row+1
-                    and file_diff == 1
-                    and to_square.piece != PieceType.NOPIECE
-                    and to_square.color == Side.BLACK):
-                valid_move = True
-
-            # if not direct capture, destination should be empty
-            elif (self.board[to_row][to_file].piece == PieceType.NOPIECE):
-                # allow two spaces if at starting point
-                if (from_row == 1 and to_row == 3 and from_file == to_file
-                        and self.board[2][from_file].piece
-                            == PieceType.NOPIECE):
-                    valid_move = True
-                    is_pawn_move_two = True
-
-                # allow en passant
-                elif (from_row == black_pawn_row-2
-                        and to_row == black_pawn_row-1
-                        and file_diff == 1):
-                    passant_target = self.board[to_row-1][to_file]
-                    if (passant_target.color == Side.BLACK
-                            and passant_target.piece == PieceType.PAWN
-                            and passant_target.last_move == self.move_num-1
-                            and passant_target.pawn_move_two):
-                        valid_move = True
-
-                # allow moving one space forward
-                elif to_row == from_row+1 and from_file == to_file:
-                    valid_move = True
-
-        elif move_piece.piece == PieceType.PAWN and self.turn == Side.BLACK:
-            # Black pawn
-            # allow capture
-            if (to_row == from_row-1
-                    and file_diff == 1
-                    and to_square.piece != PieceType.NOPIECE
-                    and to_square.color == Side.WHITE):
-                valid_move = True
-
-            # if not direct capture, destination should be empty
-            elif (self.board[to_row][to_file].piece == PieceType.NOPIECE):
-                # allow two spaces if at starting point
-                if (from_row == black_pawn_row
-                        and to_row == black_pawn_row-2
-                        and from_file == to_file
-                        and self.board[black_pawn_row-1][from_file].piece
-                            == PieceType.NOPIECE):
-                    valid_move = True
-                    is_pawn_move_two = True
-
-                # allow en passant
-                elif from_row == 3 and to_row == 2 and file_diff == 1:
-                    passant_target = self.board[to_row+1][to_file]
-                    if (passant_target.color == Side.WHITE
-                            and passant_target.piece == PieceType.PAWN
-                            and passant_target.last_move == self.move_num
-                            and passant_target.pawn_move_two):
-                        valid_move = True
-
-                # allow moving one space forward
-                elif to_row == from_row-1 and from_file == to_file:
-                    valid_move = True
-
-        elif move_piece.piece == PieceType.KNIGHT:
-            # only need to check that destination is an L shaped jump
-            if ((row_diff == 1 and file_diff == 2)
-                    or (row_diff == 2 and file_diff == 1)):
-                valid_move = True
-
-        elif move_piece.piece == PieceType.BISHOP:
-            # check destination is diagonal
-            if row_diff != file_diff:
-                raise ChessMoveError(general_error_msg)
-            
-            # check no other pieces in between
-            row_step = 1 if to_row > from_row else -1
-            file_step = 1 if to_file > from_file else -1
-            next_row = from_row
-            next_file = from_file
-            for i in range(1,row_diff):
-                next_row += row_step
-                next_file += file_step
-                if self.board[next_row][next_file].piece != PieceType.NOPIECE:
-                    raise ChessMoveError(general_error_msg)
-            
-            valid_move = True
-
-        elif move_piece.piece == PieceType.ROOK:
-            # check destination is orthogonal
-            if row_diff == 0:
-                # check no other pieces in between
-                file_step = 1 if to_file > from_file else -1
-                for next_file in range(from_file+file_step,
-                                       to_file, file_step):
-                    if (self.board[from_row][next_file].piece
-                            != PieceType.NOPIECE):
-                        raise ChessMoveError(general_error_msg)
-            elif file_diff == 0:
-                # check no other pieces in between
-                row_step = 1 if to_row > from_row else -1
-                for next_row in range(from_row+row_step, to_row, row_step):
-                    if (self.board[next_row][from_file].piece
-                            != PieceType.NOPIECE):
-                        raise ChessMoveError(general_error_msg)
-            else:
-                raise ChessMoveError(general_error_msg)
-            valid_move = True
-
-        elif move_piece.piece == PieceType.QUEEN:
-            # check destination is orthogonal or diagonal
-            row_step = 0
-            file_step = 0
-            num_steps = 0
-
-            if row_diff == 0:
-                num_steps = file_diff
-                file_step = 1 if to_file > from_file else -1
-            elif file_diff == 0:
-                num_steps = row_diff
-                row_step = 1 if to_row > from_row else -1
-            elif row_diff == file_diff:
-                num_steps = row_diff
-                file_step = 1 if to_file > from_file else -1
-                row_step = 1 if to_row > from_row else -1
-            else:
-                raise ChessMoveError(general_error_msg)
-
-            # check no other pieces in between
-            next_row = from_row
-            next_file = from_file
-            for i in range(1,num_steps):
-                next_row += row_step
-                next_file += file_step
-                if self.board[next_row][next_file].piece != PieceType.NOPIECE:
-                    raise ChessMoveError(general_error_msg)
-            valid_move = True
-
-        elif move_piece.piece == PieceType.KING:
-            # check if castling
-            if move_piece.last_move == 0:
-                # Kingside castling
-                if to_file == from_file+2:
-                    castling_rook = self.board[from_row][from_file+3]
-                    if (castling_rook.piece == PieceType.ROOK
-                            and castling_rook.color == self.turn
-                            and castling_rook.last_move == 0
-                            and self.board[from_row][from_file+1].piece
-                                == PieceType.NOPIECE):
-                        if self.is_square_attacked(from_row, from_file+1,
-                                                   other_side):
-                            raise ChessMoveError("Cannot castle through check")
-                        kingside_castling_rook = castling_rook
-                
-                # Queenside castling
-                if to_file == from_file-2:
-                    castling_rook = self.board[from_row][from_file-4]
-                    if (castling_rook.piece == PieceType.ROOK
-                            and castling_rook.color == self.turn
-                            and castling_rook.last_move == 0
-                            and self.board[from_row][from_file-1].piece
-                                == PieceType.NOPIECE
-                            and self.board[from_row][from_file-3].piece
-                                == PieceType.NOPIECE):
-                        if self.is_square_attacked(from_row, from_file+1,
-                                                   other_side):
-                            raise ChessMoveError("Cannot castle through check")
-                        queenside_castling_rook = castling_rook
-                
-            # check destination is only one square away in any direction
-            elif row_diff > 1 or file_diff > 1:
-                raise ChessMoveError(general_error_msg)
-
-            # verify that king does not move into check
-            if self.is_square_attacked(to_row, to_file, other_side):
-                raise ChessMoveError("Cannot move King into check!")
-
-            valid_move = True
-
-        if not valid_move:
+        squares = (from_row, from_file, to_row, to_file)
+        matches = [move for move in self.legal_moves_from(from_row, from_file)
+                   if move[:4] == squares]
+        if not matches:
+            # only a rejected move pays for generating every move, to say
+            # why it was rejected
+            if piece == PieceType.KING and abs(to_file-from_file) == 2:
+                step = 1 if to_file > from_file else -1
+                if self.is_check():
+                    raise ChessMoveError("Cannot castle out of check")
+                if self.is_square_attacked(from_row, from_file+step,
+                                           other_side):
+                    raise ChessMoveError("Cannot castle through check")
+            if any(move[:4] == squares
+                   for move in self.generate_pseudo_legal_moves()):
+                if piece == PieceType.KING:
+                    raise ChessMoveError("Cannot move King into check!")
+                raise ChessMoveError("Cannot put own King into check")
             raise ChessMoveError(general_error_msg)
-        
-        # save pieces before moving with shallow copies
-        from_piece_copy = copy.copy(self.board[from_row][from_file])
-        to_piece_copy = copy.copy(self.board[to_row][to_file])
-        self.move_piece(from_row, from_file, to_row, to_file, is_pawn_move_two)
-
-        # check that this move has not exposed king to check
-        if self.is_square_attacked(self.kings[self.turn].row,
-                                   self.kings[self.turn].file,
-                                   other_side):
-            # reset pieces to previous move and then raise error
-            self.move_piece(to_row, to_file, from_row, from_file,
-                            from_piece_copy.pawn_move_two)
-            self.board[from_row][from_file].last_move = \
-                from_piece_copy.last_move
-            if to_piece_copy.piece != PieceType.NOPIECE:
-                self.add_piece(to_piece_copy.piece, to_piece_copy.color,
-                               to_row, to_file, to_piece_copy.last_move,
-                               to_piece_copy.pawn_move_two)
-            raise ChessMoveError("Cannot put own King into check")
-
-        if passant_target is not None:
-            passant_target.remove()
-        if kingside_castling_rook is not None:
-            self.move_piece(kingside_castling_rook.row,
-                            kingside_castling_rook.file,
-                            to_row, to_file-1)
-        if queenside_castling_rook is not None:
-            self.move_piece(queenside_castling_rook.row,
-                            queenside_castling_rook.file,
-                            to_row, to_file+1)
-        
-        # Check if pawn can be queened
-        after_move = self.board[to_row][to_file]
-        if after_move.piece == PieceType.PAWN:
-            if ((after_move.color == Side.WHITE
-                    and to_row == self.BOARD_SIZE-1)
-                    or (after_move.color == Side.BLACK and to_row == 1)):
-                while True:
-                    new_piece = input(
-                        ">>> Choose piece to replace pawn (Q/R/B/N)")
-                    match new_piece:
-                        case 'Q' | 'q':
-                            after_move.piece = PieceType.QUEEN
-                            break
-                        case 'R' | 'r':
-                            after_move.piece = PieceType.ROOK
-                            break
-                        case 'B' | 'b':
-                            after_move.piece = PieceType.BISHOP
-                            break
-                        case 'N' | 'n':
-                            after_move.piece = PieceType.KNIGHT
-                            break
-                        case _:
-                            print("Invalid piece")
-                            continue
 
+        if matches[0].promotion == PieceType.NOPIECE:
+            if promotion not in (None, PieceType.NOPIECE):
+                raise ChessMoveError("Only a pawn on the last row can be "
+                                     "promoted")
+            move = matches[0]
+        else:
+            if promotion is None or promotion == PieceType.NOPIECE:
+                raise ChessPromotionError("Choose piece to replace pawn")
+            if promotion not in Chess.PROMOTION_PIECES:
+                raise ChessMoveError("Invalid promotion piece")
+            move = matches[0]._replace(promotion=promotion)
+
+        if (piece == PieceType.PAWN and captured == PieceType.NOPIECE
+                and from_file != to_file):
+            captured = PieceType.PAWN  # en passant
+        self.push(move)
+        self._log_move(move)
+        return MoveResult(move, piece, captured, self.is_check(),
+                          self.game_status())
+
+    def game_status(self) -> GameStatus:
+        # draws by repetition and the fifty move rule count as claimed
+        if not self.has_legal_move():
+            if self.is_check():
+                return GameStatus.CHECKMATE
+            return GameStatus.STALEMATE
+        if self.halfmove_clock >= 100:
+            return GameStatus.FIFTY_MOVES
+        if self.repetitions() >= 3:
+            return GameStatus.REPETITION
+        return GameStatus.ONGOING
+
+    def parse_move(self, input_text: str) -> Move:
+        # coordinate notation as used by UCI, e.g. e2e4 or e7e8q
+        text = input_text.strip()
+        if len(text) not in (4, 5):
+            raise ChessInputError("Invalid move notation")
+        (from_row, from_file) = Chess.parse_position(text[0:2])
+        (to_row, to_file) = Chess.parse_position(text[2:4])
+        promotion = PieceType.NOPIECE
+        if len(text) == 5:
+            promotion = PROMOTION_PIECE_NAMES.get(text[4].lower())
+            if promotion is None:
+                raise ChessInputError("Invalid promotion piece")
+        return Move(from_row, from_file, to_row, to_file, promotion)
+
+    def parse_san(self, input_text: str) -> Move:
+        # Standard algebraic notation (Nf3, exd5, e8=Q+, O-O) for the side
+        # to move. Coordinate notation is accepted as well.
+        text = input_text.rstrip("+#!?")
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            (row, file) = self.king_square(self.turn)
+            to_file = file + (2 if len(text) == 3 else -2)
+            for move in self.generate_legal_moves():
+                if move[:4] == (row, file, row, to_file):
+                    return move
+            raise ChessMoveError(f"Illegal move {input_text}")
+
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            if LAN_PATTERN.match(text):
+                move = self.parse_move(text)
+                for legal in self.generate_legal_moves():
+                    if legal == move:
+                        return move
+                raise ChessMoveError(f"Illegal move {input_text}")
+            raise ChessInputError(f"Invalid move notation {input_text}")
+        (piece_name, from_file, from_row, to_name, promotion_name) = (
+            match.groups())
+        piece = SAN_PIECES[piece_name] if piece_name else PieceType.PAWN
+        to_file = ord(to_name[0]) - ord('a')
+        to_row = int(to_name[1]) - 1
+        from_file = ord(from_file) - ord('a') if from_file else None
+        from_row = int(from_row) - 1 if from_row else None
+        promotion = (SAN_PIECES[promotion_name.upper()] if promotion_name
+                     else PieceType.NOPIECE)
+
+        found = None
+        for move in self.generate_legal_moves():
+            if (move.to_row != to_row or move.to_file != to_file
+                    or move.promotion != promotion
+                    or (from_file is not None and move.from_file != from_file)
+                    or (from_row is not None and move.from_row != from_row)
+                    or self.piece_at(move.from_row, move.from_file)[0]
+                    != piece):
+                continue
+            if found is not None:
+                raise ChessMoveError(f"Ambiguous move {input_text}")
+            found = move
+        if found is None:
+            raise ChessMoveError(f"Illegal move {input_text}")
+        return found
+
+    def san(self, move: Move) -> str:
+        # standard algebraic notation of a legal move, as parse_san reads
+        # and PGN files need
+        (piece, color) = self.piece_at(move.from_row, move.from_file)
+        to_name = f"{FILE_NAMES[move.to_file]}{move.to_row+1}"
+        if piece == PieceType.KING and abs(move.to_file-move.from_file) == 2:
+            text = "O-O" if move.to_file > move.from_file else "O-O-O"
+        elif piece == PieceType.PAWN:
+            text = to_name
+            if move.from_file != move.to_file:
+                text = f"{FILE_NAMES[move.from_file]}x{to_name}"
+            if move.promotion != PieceType.NOPIECE:
+                text += "=" + FEN_NAMES[move.promotion]
+        else:
+            # the same piece type moving to the same square from elsewhere
+            others = [other for other in self.generate_legal_moves()
+                      if other[2:4] == move[2:4] and other[:2] != move[:2]
+                      and self.piece_at(other.from_row,
+                                        other.from_file)[0] == piece]
+            source = ""
+            if others:
+                if all(other.from_file != move.from_file for other in others):
+                    source = FILE_NAMES[move.from_file]
+                elif all(other.from_row != move.from_row for other in others):
+                    source = str(move.from_row+1)
+                else:
+                    source = f"{FILE_NAMES[move.from_file]}{move.from_row+1}"
+            capture = ("x" if self.piece_at(move.to_row, move.to_file)[0]
+                       != PieceType.NOPIECE else "")
+            text = f"{FEN_NAMES[piece]}{source}{capture}{to_name}"
+        self.push(move)
+        if self.is_check():
+            text += "#" if not self.has_legal_move() else "+"
+        self.pop()
+        return text
+
+    def choose_promotion(self) -> PieceType:
+        while True:
+            new_piece = input(
+                ">>> Choose piece to replace pawn (Q/R/B/N)")
+            match new_piece:
+                case 'Q' | 'q':
+                    return PieceType.QUEEN
+                case 'R' | 'r':
+                    return PieceType.ROOK
+                case 'B' | 'b':
+                    return PieceType.BISHOP
+                case 'N' | 'n':
+                    return PieceType.KNIGHT
+                case _:
+                    print("Invalid piece")
+                    continue
     
     def remove_piece(self, piece_row, piece_file):
         target_piece = self.board[piece_row][piece_file]
@@ -461,26 +759,25 @@ class Chess:
             else:  # is not head of list
                 target_piece.prev.next = target_piece.next
             if target_piece.next is not None:
-                target_piece.next.prev = None
+                target_piece.next.prev = target_piece.prev
             target_piece.next = None
             target_piece.prev = None
+            (piece, color) = (target_piece.piece, target_piece.color)
+            square = piece_row*8 + piece_file
+            self.zobrist_key ^= ZOBRIST_PIECES[color][piece][square]
+            self.material[color] -= PIECE_VALUES[piece]
+            self.psq_mg -= PSQT_MG_BY_SIDE[color][piece][square]
+            self.psq_eg -= PSQT_EG_BY_SIDE[color][piece][square]
+            self.phase -= PHASE_WEIGHTS[piece]
             target_piece.piece = PieceType.NOPIECE
             target_piece.color = Side.NEUTRAL
-            target_piece.last_move = 0
-            target_piece.pawn_move_two = False
     
-    def add_piece(self, piece: PieceType, color: Side,
-                  row, file, last_move=None, pawn_move_two=False):
+    def add_piece(self, piece: PieceType, color: Side, row, file):
         # adding new piece to the board
         self.remove_piece(row, file)
         new_square = self.board[row][file]
         new_square.piece = piece
         new_square.color = color
-        if last_move is None:
-            new_square.last_move = self.move_num
-        else:
-            new_square.last_move = last_move
-        new_square.pawn_move_two = pawn_move_two
         # add to head of piece list
         old_head = self.piece_list[color]
         if old_head is not None:
@@ -488,128 +785,812 @@ class Chess:
             new_square.next = old_head
         new_square.prev = None
         self.piece_list[color] = new_square
+        if piece == PieceType.KING:
+            self.kings[color] = new_square
+        square = row*8 + file
+        self.zobrist_key ^= ZOBRIST_PIECES[color][piece][square]
+        self.material[color] += PIECE_VALUES[piece]
+        self.psq_mg += PSQT_MG_BY_SIDE[color][piece][square]
+        self.psq_eg += PSQT_EG_BY_SIDE[color][piece][square]
+        self.phase += PHASE_WEIGHTS[piece]
     
     def move_piece(self, from_row, from_file, to_row, to_file,
                    is_pawn_move_two=False):
         self.remove_piece(to_row, to_file)
         from_piece = self.board[from_row][from_file]
-        self.add_piece(from_piece.piece, from_piece.color, to_row, to_file,
-                       pawn_move_two = is_pawn_move_two)
-        if from_piece.piece == PieceType.KING:
-            self.kings[from_piece.color] = self.board[to_row][to_file]
+        self.add_piece(from_piece.piece, from_piece.color, to_row, to_file)
         self.remove_piece(from_row, from_file)
+        self._set_castling(self.castling
+                           & CASTLING_MASK[from_row*8 + from_file]
+                           & CASTLING_MASK[to_row*8 + to_file])
+        if is_pawn_move_two:
+            self._record_pawn_move_two(from_row, to_row, to_file)
+
+    def _record_pawn_move_two(self, from_row, to_row, file):
+        # only kept when an enemy pawn is next to it, so positions that
+        # differ in name only hash the same
+        (pawn, color) = self.piece_at(to_row, file)
+        for next_file in (file-1, file+1):
+            if 0 <= next_file < Chess.BOARD_SIZE:
+                (piece, next_color) = self.piece_at(to_row, next_file)
+                if (piece == PieceType.PAWN and next_color != color):
+                    self._set_ep_square(((from_row+to_row) // 2)*8 + file)
+                    return
+
+    def _set_castling(self, castling):
+        if castling != self.castling:
+            self.zobrist_key ^= (ZOBRIST_CASTLING[self.castling]
+                                 ^ ZOBRIST_CASTLING[castling])
+            self.castling = castling
+
+    def _set_ep_square(self, ep_square):
+        if self.ep_square is not None:
+            self.zobrist_key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        if ep_square is not None:
+            self.zobrist_key ^= ZOBRIST_EP_FILE[ep_square & 7]
+        self.ep_square = ep_square
+
+    def compute_zobrist_key(self):
+        # full recalculation, the incremental zobrist_key should match it
+        key = ZOBRIST_CASTLING[self.castling]
+        if self.ep_square is not None:
+            key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        if self.turn == Side.BLACK:
+            key ^= ZOBRIST_SIDE
+        for row in range(Chess.BOARD_SIZE):
+            for file in range(Chess.BOARD_SIZE):
+                (piece, color) = self.piece_at(row, file)
+                if piece != PieceType.NOPIECE:
+                    key ^= ZOBRIST_PIECES[color][piece][row*8 + file]
+        return key
+
+    def static_eval(self) -> int:
+        # material and piece squares blended between middlegame and
+        # endgame by phase, in centipawns for the side to move. O(1), the
+        # terms are kept up to date by add_piece and remove_piece.
+        score = taper(self.psq_mg, self.psq_eg, self.phase)
+        return score if self.turn == Side.WHITE else -score
+
+    def compute_eval_terms(self):
+        # full recalculation of (material, psq_mg, psq_eg, phase), the
+        # incremental terms should match it
+        material = {Side.WHITE: 0, Side.BLACK: 0}
+        (psq_mg, psq_eg, phase) = (0, 0, 0)
+        for (square, piece, color) in self.placements():
+            material[color] += PIECE_VALUES[piece]
+            psq_mg += PSQT_MG_BY_SIDE[color][piece][square]
+            psq_eg += PSQT_EG_BY_SIDE[color][piece][square]
+            phase += PHASE_WEIGHTS[piece]
+        return (material, psq_mg, psq_eg, phase)
 
     def is_square_attacked(self, target_row, target_file, by_side: Side):
-        pieces = self.piece_list[by_side]
+        # look outward from the target square for a piece that could
+        # reach it, rather than walking every piece of the attacking side
+        squares = self.flat_board
+        target = target_row*8 + target_file
 
-        while pieces is not None:
-            row_diff = abs(target_row - pieces.row)
-            file_diff = abs(target_file - pieces.file)
+        for square in PAWN_ATTACKERS[by_side][target]:
+            piece = squares[square]
+            if piece.piece == PieceType.PAWN and piece.color == by_side:
+                return True
+        for square in KNIGHT_SQUARES[target]:
+            piece = squares[square]
+            if piece.piece == PieceType.KNIGHT and piece.color == by_side:
+                return True
+        for square in KING_SQUARES[target]:
+            piece = squares[square]
+            if piece.piece == PieceType.KING and piece.color == by_side:
+                return True
 
-            if pieces.piece == PieceType.PAWN:
-                # check if attacked by pawns
-                if file_diff == 1:
-                    if by_side == Side.BLACK and pieces.row-1 == target_row:
+        # sliders, stopping each ray at the first piece found
+        for ray in ROOK_RAYS[target]:
+            for square in ray:
+                piece = squares[square]
+                if piece.piece != PieceType.NOPIECE:
+                    if piece.color == by_side and (
+                            piece.piece == PieceType.ROOK
+                            or piece.piece == PieceType.QUEEN):
                         return True
-                    elif by_side == Side.WHITE and pieces.row+1 == target_row:
+                    break
+        for ray in BISHOP_RAYS[target]:
+            for square in ray:
+                piece = squares[square]
+                if piece.piece != PieceType.NOPIECE:
+                    if piece.color == by_side and (
+                            piece.piece == PieceType.BISHOP
+                            or piece.piece == PieceType.QUEEN):
                         return True
+                    break
 
-            if pieces.piece == PieceType.KING:
-                # check if attacked by another King
-                if file_diff <= 1 and row_diff <= 1:
-                    return True
+        return False
 
-            if pieces.piece in [PieceType.QUEEN, PieceType.ROOK]:
-                # check if attacked orthogonally by Rook or Queen
-                if row_diff == 0:
-                    # check no other pieces in between
-                    blocked = False
-                    file_step = 1 if target_file > pieces.file else -1
-                    for next_file in range(pieces.file+file_step,
-                                           target_file, file_step):
-                        if (self.board[target_row][next_file].piece
-                                != PieceType.NOPIECE):
-                            blocked = True
-                            break
-                    if not blocked:
-                        return True
-                elif file_diff == 0:
-                    blocked = False
-                    row_step = 1 if target_row > pieces.row else -1
-                    for next_row in range(pieces.row+row_step,
-                                          target_row, row_step):
-                        if (self.board[next_row][target_file].piece
-                                != PieceType.NOPIECE):
-                            blocked = True
+    def castling_allowed(self, side: Side, kingside: bool):
+        # king and rook have not moved, squares between are not checked
+        if side == Side.WHITE:
+            right = WHITE_KINGSIDE if kingside else WHITE_QUEENSIDE
+        else:
+            right = BLACK_KINGSIDE if kingside else BLACK_QUEENSIDE
+        return bool(self.castling & right)
+
+    def en_passant_square(self):
+        # square behind a pawn that has just moved two squares, if any
+        if self.ep_square is None:
+            return None
+        return divmod(self.ep_square, 8)
+
+    def generate_pseudo_legal_moves(self) -> List[Move]:
+        # moves that follow the piece rules but may leave the king in check
+        moves: List[Move] = []
+        passant_square = self.en_passant_square()
+        piece = self.piece_list[self.turn]
+        while piece is not None:
+            self._add_piece_moves(piece, moves, passant_square)
+            piece = piece.next
+        self._add_castling_moves(moves)
+        return moves
+
+    def _add_piece_moves(self, piece: BoardPiece, moves: List[Move],
+                         passant_square):
+        side = piece.color
+        board = self.board
+        size = Chess.BOARD_SIZE
+        row = piece.row
+        file = piece.file
+        kind = piece.piece
+
+        if kind == PieceType.PAWN:
+            pawn_step = 1 if side == Side.WHITE else -1
+            ahead = row+pawn_step
+            targets = []
+            if board[ahead][file].piece == PieceType.NOPIECE:
+                targets.append(file)
+                if (row == (1 if side == Side.WHITE else size-2)
+                        and board[ahead+pawn_step][file].piece
+                            == PieceType.NOPIECE):
+                    moves.append(Move(row, file, ahead+pawn_step, file))
+            for to_file in (file-1, file+1):
+                if to_file < 0 or to_file >= size:
+                    continue
+                target = board[ahead][to_file]
+                if ((target.piece != PieceType.NOPIECE
+                            and target.color != side)
+                        or (ahead, to_file) == passant_square):
+                    targets.append(to_file)
+            for to_file in targets:
+                if ahead == 0 or ahead == size-1:
+                    for promotion in Chess.PROMOTION_PIECES:
+                        moves.append(Move(row, file, ahead, to_file,
+                                          promotion))
+                else:
+                    moves.append(Move(row, file, ahead, to_file))
+
+        elif kind == PieceType.KNIGHT or kind == PieceType.KING:
+            steps = (Chess.KNIGHT_STEPS if kind == PieceType.KNIGHT
+                     else Chess.KING_STEPS)
+            for (row_step, file_step) in steps:
+                to_row = row+row_step
+                to_file = file+file_step
+                if 0 <= to_row < size and 0 <= to_file < size:
+                    target = board[to_row][to_file]
+                    if (target.piece == PieceType.NOPIECE
+                            or target.color != side):
+                        moves.append(Move(row, file, to_row, to_file))
+
+        else:
+            if kind == PieceType.ROOK:
+                directions = Chess.ROOK_DIRECTIONS
+            elif kind == PieceType.BISHOP:
+                directions = Chess.BISHOP_DIRECTIONS
+            else:
+                directions = Chess.ROOK_DIRECTIONS+Chess.BISHOP_DIRECTIONS
+            for (row_step, file_step) in directions:
+                to_row = row+row_step
+                to_file = file+file_step
+                while 0 <= to_row < size and 0 <= to_file < size:
+                    target = board[to_row][to_file]
+                    if target.piece != PieceType.NOPIECE:
+                        if target.color != side:
+                            moves.append(Move(row, file, to_row, to_file))
+                        break
+                    moves.append(Move(row, file, to_row, to_file))
+                    to_row += row_step
+                    to_file += file_step
+
+    def _add_castling_moves(self, moves: List[Move]):
+        side = self.turn
+        other_side = Side.WHITE if side == Side.BLACK else Side.BLACK
+        row = 0 if side == Side.WHITE else Chess.BOARD_SIZE-1
+        board_row = self.board[row]
+        for kingside in (True, False):
+            if not self.castling_allowed(side, kingside):
+                continue
+            if kingside:
+                between = (5, 6)
+                passing_file = 5
+                to_file = 6
+            else:
+                between = (1, 2, 3)
+                passing_file = 3
+                to_file = 2
+            if any(board_row[file].piece != PieceType.NOPIECE
+                   for file in between):
+                continue
+            # cannot castle out of or through check, destination is left
+            # to the legality test
+            if (self.is_square_attacked(row, 4, other_side)
+                    or self.is_square_attacked(row, passing_file,
+                                               other_side)):
+                continue
+            moves.append(Move(row, 4, row, to_file))
+
+    def check_info(self):
+        # (checkers, pins, evasion_squares) for the side to move, worked
+        # out from the king square once per position. checkers are the
+        # squares of pieces giving check, pins maps each pinned piece's
+        # square to the squares it can still move to, and evasion_squares
+        # are where a piece other than the king must move to in order to
+        # block or capture a single checker.
+        if self._check_info_key == self.zobrist_key:
+            return self._check_info
+        side = self.turn
+        other_side = Side.WHITE if side == Side.BLACK else Side.BLACK
+        squares = self.flat_board
+        (king_row, king_file) = self.king_square(side)
+        king = king_row*8 + king_file
+        checkers = []
+        pins = {}
+        evasion_squares = set()
+
+        for square in PAWN_ATTACKERS[other_side][king]:
+            piece = squares[square]
+            if piece.piece == PieceType.PAWN and piece.color == other_side:
+                checkers.append(square)
+                evasion_squares.add(square)
+        for square in KNIGHT_SQUARES[king]:
+            piece = squares[square]
+            if piece.piece == PieceType.KNIGHT and piece.color == other_side:
+                checkers.append(square)
+                evasion_squares.add(square)
+
+        for (rays, slider) in ((ROOK_RAYS[king], PieceType.ROOK),
+                               (BISHOP_RAYS[king], PieceType.BISHOP)):
+            for ray in rays:
+                own_piece = None
+                for (index, square) in enumerate(ray):
+                    piece = squares[square]
+                    if piece.piece == PieceType.NOPIECE:
+                        continue
+                    if piece.color == side:
+                        if own_piece is not None:
                             break
-                    if not blocked:
-                        return True
+                        own_piece = square
+                        continue
+                    if (piece.piece == slider
+                            or piece.piece == PieceType.QUEEN):
+                        if own_piece is None:
+                            checkers.append(square)
+                            evasion_squares.update(ray[:index+1])
+                        else:
+                            pins[own_piece] = set(ray[:index+1])
+                    break
+
+        if len(checkers) > 1:
+            evasion_squares.clear()  # only the king can move
+        self._check_info = (checkers, pins, evasion_squares)
+        self._check_info_key = self.zobrist_key
+        return self._check_info
 
-            if pieces.piece in [PieceType.QUEEN, PieceType.BISHOP]:
-                # check if attacked diagonally by Bishop or Queen
-                if row_diff == file_diff:
-                    # check no other pieces in between
-                    row_step = 1 if target_row > pieces.row else -1
-                    file_step = 1 if target_file > pieces.file else -1
-                    next_row = pieces.row
-                    next_file = pieces.file
-                    blocked = False
-                    for i in range(1, row_diff):
-                        next_row += row_step
-                        next_file += file_step
-                        if (self.board[next_row][next_file].piece
-                                != PieceType.NOPIECE):
-                            blocked = True
+    def checkers(self):
+        return self.check_info()[0]
+
+    def _king_move_safe(self, king, to_square):
+        # the king is lifted off the board so that a slider checking it
+        # along a line still covers the squares behind it
+        other_side = Side.WHITE if self.turn == Side.BLACK else Side.BLACK
+        king_piece = self.flat_board[king]
+        king_piece.piece = PieceType.NOPIECE
+        attacked = self.is_square_attacked(to_square >> 3, to_square & 7,
+                                           other_side)
+        king_piece.piece = PieceType.KING
+        return not attacked
+
+    def _is_legal(self, move: Move, pins, king):
+        # legality of a pseudo-legal move when not in check
+        from_square = move[0]*8 + move[1]
+        to_square = move[2]*8 + move[3]
+        if from_square == king:
+            return self._king_move_safe(king, to_square)
+        if from_square in pins and to_square not in pins[from_square]:
+            return False
+        if (to_square == self.ep_square
+                and self.flat_board[from_square].piece == PieceType.PAWN):
+            # en passant takes two pieces off one row, just try it
+            side = self.turn
+            other_side = Side.WHITE if side == Side.BLACK else Side.BLACK
+            self.push(move)
+            legal = not self.is_square_attacked(king >> 3, king & 7,
+                                                other_side)
+            self.pop()
+            return legal
+        return True
+
+    def generate_legal_moves(self) -> List[Move]:
+        (checkers, pins, evasion_squares) = self.check_info()
+        if checkers:
+            return self.generate_evasions()
+        (king_row, king_file) = self.king_square(self.turn)
+        king = king_row*8 + king_file
+        return [move for move in self.generate_pseudo_legal_moves()
+                if self._is_legal(move, pins, king)]
+
+    def generate_evasions(self) -> List[Move]:
+        # legal moves when in check. Rather than trying every move, only
+        # king steps and pieces that can reach a capture or block square
+        # (looking outward from it) are considered.
+        (checkers, pins, evasion_squares) = self.check_info()
+        if not checkers:
+            return []
+        side = self.turn
+        squares = self.flat_board
+        (king_row, king_file) = self.king_square(side)
+        king = king_row*8 + king_file
+        moves: List[Move] = []
+
+        for square in KING_SQUARES[king]:
+            target = squares[square]
+            if ((target.piece == PieceType.NOPIECE or target.color != side)
+                    and self._king_move_safe(king, square)):
+                moves.append(Move(king_row, king_file,
+                                  square >> 3, square & 7))
+
+        pawn_step = 8 if side == Side.WHITE else -8
+        double_row = 3 if side == Side.WHITE else Chess.BOARD_SIZE-4
+        for target in evasion_squares:
+            starts = []
+            if squares[target].piece != PieceType.NOPIECE:
+                for square in PAWN_ATTACKERS[side][target]:
+                    piece = squares[square]
+                    if piece.piece == PieceType.PAWN and piece.color == side:
+                        starts.append(square)
+            elif 0 <= target-pawn_step < 64:
+                behind = squares[target-pawn_step]
+                if behind.piece == PieceType.PAWN and behind.color == side:
+                    starts.append(target-pawn_step)
+                elif (behind.piece == PieceType.NOPIECE
+                        and target >> 3 == double_row):
+                    piece = squares[target-2*pawn_step]
+                    if piece.piece == PieceType.PAWN and piece.color == side:
+                        starts.append(target-2*pawn_step)
+            for square in KNIGHT_SQUARES[target]:
+                piece = squares[square]
+                if piece.piece == PieceType.KNIGHT and piece.color == side:
+                    starts.append(square)
+            for (rays, slider) in ((ROOK_RAYS[target], PieceType.ROOK),
+                                   (BISHOP_RAYS[target], PieceType.BISHOP)):
+                for ray in rays:
+                    for square in ray:
+                        piece = squares[square]
+                        if piece.piece != PieceType.NOPIECE:
+                            if piece.color == side and (
+                                    piece.piece == slider
+                                    or piece.piece == PieceType.QUEEN):
+                                starts.append(square)
                             break
-                    if not blocked:
-                        return True
 
-            # check if attacked by Knights
-            if pieces.piece == PieceType.KNIGHT:
-                if ((row_diff == 1 and file_diff == 2)
-                        or (row_diff == 2 and file_diff == 1)):
-                    return True
+            (to_row, to_file) = divmod(target, 8)
+            for square in starts:
+                if square in pins:
+                    # a pinned piece can never block or capture a checker
+                    continue
+                if (squares[square].piece == PieceType.PAWN
+                        and (to_row == 0 or to_row == Chess.BOARD_SIZE-1)):
+                    for promotion in Chess.PROMOTION_PIECES:
+                        moves.append(Move(square >> 3, square & 7,
+                                          to_row, to_file, promotion))
+                else:
+                    moves.append(Move(square >> 3, square & 7,
+                                      to_row, to_file))
 
-            # Go to next piece
-            pieces = pieces.next
-        
+        if self.ep_square is not None and len(checkers) == 1:
+            for square in PAWN_ATTACKERS[side][self.ep_square]:
+                piece = squares[square]
+                if piece.piece == PieceType.PAWN and piece.color == side:
+                    move = Move(square >> 3, square & 7,
+                                self.ep_square >> 3, self.ep_square & 7)
+                    self.push(move)
+                    legal = not self.is_square_attacked(
+                        king_row, king_file, self.turn)
+                    self.pop()
+                    if legal:
+                        moves.append(move)
+        return moves
+
+    def generate_captures(self) -> List[Move]:
+        # legal captures, including en passant, and promotions
+        board = self.board
+        moves = []
+        for move in self.generate_legal_moves():
+            if (move.promotion != PieceType.NOPIECE
+                    or board[move.to_row][move.to_file].piece
+                    != PieceType.NOPIECE
+                    or (move.from_file != move.to_file
+                        and board[move.from_row][move.from_file].piece
+                        == PieceType.PAWN)):
+                moves.append(move)
+        return moves
+
+    def has_legal_move(self):
+        # stops at the first legal move found
+        (checkers, pins, evasion_squares) = self.check_info()
+        if checkers:
+            return bool(self.generate_evasions())
+        (king_row, king_file) = self.king_square(self.turn)
+        king = king_row*8 + king_file
+        passant_square = self.en_passant_square()
+        piece = self.piece_list[self.turn]
+        while piece is not None:
+            moves: List[Move] = []
+            self._add_piece_moves(piece, moves, passant_square)
+            for move in moves:
+                if self._is_legal(move, pins, king):
+                    return True
+            piece = piece.next
         return False
 
-    def is_check():
-        pass
+    def legal_moves_from(self, row, file) -> List[Move]:
+        # legal moves of the piece of the side to move on one square,
+        # without generating those of the other pieces
+        piece = self.flat_board[row*8 + file]
+        if piece.piece == PieceType.NOPIECE or piece.color != self.turn:
+            return []
+        (checkers, pins, evasion_squares) = self.check_info()
+        if checkers:
+            return [move for move in self.generate_evasions()
+                    if move[0] == row and move[1] == file]
+        moves: List[Move] = []
+        self._add_piece_moves(piece, moves, self.en_passant_square())
+        if piece.piece == PieceType.KING:
+            self._add_castling_moves(moves)
+        (king_row, king_file) = self.king_square(self.turn)
+        king = king_row*8 + king_file
+        return [move for move in moves if self._is_legal(move, pins, king)]
+
+    def push(self, move: Move):
+        # play a move without validation, it can be taken back with pop()
+        (from_row, from_file, to_row, to_file, promotion) = move
+        if self.ply == len(self._undo_stack):
+            self._undo_stack.append([None] * 6)
+        record = self._undo_stack[self.ply]
+        self.ply += 1
+        (piece, color) = self.piece_at(from_row, from_file)
+        (captured, captured_color) = self.piece_at(to_row, to_file)
+        record[0] = move
+        record[1] = captured
+        record[2] = to_row*8 + to_file
+        record[3] = self.castling
+        record[4] = self.ep_square
+        record[5] = self.halfmove_clock
+        passant_square = self.ep_square
+        self._set_ep_square(None)
+
+        if piece == PieceType.PAWN:
+            self.halfmove_clock = 0
+            if to_row*8 + to_file == passant_square:
+                # en passant, the captured pawn is beside the moving one
+                record[1] = PieceType.PAWN
+                record[2] = from_row*8 + to_file
+                self.remove_piece(from_row, to_file)
+            self.move_piece(from_row, from_file, to_row, to_file,
+                            abs(to_row-from_row) == 2)
+            if promotion != PieceType.NOPIECE:
+                self.add_piece(promotion, color, to_row, to_file)
+        elif piece == PieceType.KING and abs(to_file-from_file) == 2:
+            # castling, move the rook over the king
+            self.halfmove_clock += 1
+            rook_file = Chess.BOARD_SIZE-1 if to_file > from_file else 0
+            self.move_piece(from_row, from_file, to_row, to_file)
+            self.move_piece(from_row, rook_file,
+                            from_row, (from_file+to_file) // 2)
+        else:
+            if captured == PieceType.NOPIECE:
+                self.halfmove_clock += 1
+            else:
+                self.halfmove_clock = 0
+            self.move_piece(from_row, from_file, to_row, to_file)
+
+        self._next_turn()
+        key = self.zobrist_key
+        self._keys.append(key)
+        self._key_counts[key] = self._key_counts.get(key, 0) + 1
+
+    def pop(self) -> Move:
+        # take back the last move played with push()
+        key = self._keys.pop()
+        count = self._key_counts[key]
+        if count == 1:
+            del self._key_counts[key]
+        else:
+            self._key_counts[key] = count - 1
+        self.ply -= 1
+        (move, captured, captured_square, castling, ep_square,
+         halfmove_clock) = self._undo_stack[self.ply]
+        (from_row, from_file, to_row, to_file, promotion) = move
+        self._previous_turn()
+
+        if promotion != PieceType.NOPIECE:
+            self.remove_piece(to_row, to_file)
+            self.add_piece(PieceType.PAWN, self.turn, from_row, from_file)
+        else:
+            (piece, color) = self.piece_at(to_row, to_file)
+            self.move_piece(to_row, to_file, from_row, from_file)
+            if piece == PieceType.KING and abs(to_file-from_file) == 2:
+                rook_file = Chess.BOARD_SIZE-1 if to_file > from_file else 0
+                self.move_piece(from_row, (from_file+to_file) // 2,
+                                from_row, rook_file)
+        if captured != PieceType.NOPIECE:
+            other_side = Side.WHITE if self.turn == Side.BLACK else Side.BLACK
+            self.add_piece(captured, other_side, *divmod(captured_square, 8))
+
+        self._set_castling(castling)
+        self._set_ep_square(ep_square)
+        self.halfmove_clock = halfmove_clock
+        return move
+
+    def repetitions(self) -> int:
+        # times the position has occurred since set_position, counting
+        # this one and positions searched on the way here
+        return self._key_counts[self.zobrist_key]
+
+    def game_ply(self) -> int:
+        # plies played since set_position
+        return self.start_ply + self.ply
+
+    def move_log(self) -> List[Move]:
+        # moves of the game record up to the current position
+        self._sync_log()
+        return [decode_move(code) for code in self._log[:self.game_ply()]]
+
+    def undo(self) -> Move:
+        # take back the last move of the game, redo() plays it again
+        ply = self.game_ply()
+        if ply == 0:
+            raise ChessMoveError("No move to take back")
+        self.seek(ply - 1)
+        return decode_move(self._log[ply - 1])
+
+    def redo(self) -> Move:
+        self._sync_log()
+        ply = self.game_ply()
+        if ply >= len(self._log):
+            raise ChessMoveError("No move to play again")
+        self.seek(ply + 1)
+        return decode_move(self._log[ply])
+
+    def seek(self, ply):
+        # Go to the position after ply moves of the game record. Moves are
+        # taken back or played from here, or from the nearest checkpoint
+        # before ply, whichever plays fewer.
+        self._sync_log()
+        if not 0 <= ply <= len(self._log):
+            raise ChessInputError("No such ply in the game")
+        current = self.game_ply()
+        checkpoint = min(ply // Chess.CHECKPOINT_INTERVAL,
+                         len(self._checkpoints) - 1)
+        checkpoint_ply = checkpoint * Chess.CHECKPOINT_INTERVAL
+        if (self.start_ply <= ply <= current
+                and current - ply <= ply - checkpoint_ply):
+            while self.game_ply() > ply:
+                self.pop()
+            return
+        if not checkpoint_ply <= current <= ply:
+            self._restore_checkpoint(checkpoint)
+        while self.game_ply() < ply:
+            self.push(decode_move(self._log[self.game_ply()]))
+            self._add_checkpoint()
+
+    def _log_move(self, move: Move):
+        # add a move just pushed to the game record. A move other than the
+        # one recorded for this ply drops the rest of the record.
+        self._sync_log()
+        ply = self.game_ply() - 1
+        code = encode_move(move)
+        if ply < len(self._log) and self._log[ply] == code:
+            return
+        self._own_record()
+        if ply < len(self._log):
+            del self._log[ply:]
+            del self._log_keys[ply:]
+            del self._checkpoints[ply // Chess.CHECKPOINT_INTERVAL + 1:]
+        self._log.append(code)
+        self._log_keys.append(self.zobrist_key)
+        self._add_checkpoint()
+
+    def _sync_log(self):
+        # moves pushed without make_move are recorded from the undo stack
+        missing = self.game_ply() - len(self._log)
+        if missing > 0:
+            self._own_record()
+        for record in self._undo_stack[self.ply - missing:self.ply]:
+            self._log.append(encode_move(record[0]))
+            self._log_keys.append(self._keys[len(self._log)])
 
-    def is_checkmate():
-        pass
+    def _own_record(self):
+        # copy the game record before changing it if a clone shares it
+        if self._record_shared:
+            self._log = array('H', self._log)
+            self._log_keys = array('Q', self._log_keys)
+            self._checkpoints = self._checkpoints[:]
+            self._record_shared = False
 
-    def is_stalemate():
-        pass
+    def _snapshot(self):
+        # set_position arguments for the position now
+        return (tuple((*divmod(square, 8), piece, color)
+                      for (square, piece, color) in self.placements()),
+                self.turn, self.castling, self.ep_square, self.halfmove_clock,
+                self.move_num)
+
+    def _add_checkpoint(self):
+        if (self.game_ply() == len(self._checkpoints)
+                * Chess.CHECKPOINT_INTERVAL):
+            self._own_record()
+            self._checkpoints.append(self._snapshot())
+
+    def _restore_checkpoint(self, checkpoint):
+        # the repetition counts drop the positions after the checkpoint, or
+        # add those of the record up to it
+        ply = checkpoint * Chess.CHECKPOINT_INTERVAL
+        for key in self._keys[ply + 1:]:
+            count = self._key_counts[key]
+            if count == 1:
+                del self._key_counts[key]
+            else:
+                self._key_counts[key] = count - 1
+        del self._keys[ply + 1:]
+        for key in self._log_keys[len(self._keys) - 1:ply]:
+            self._keys.append(key)
+            self._key_counts[key] = self._key_counts.get(key, 0) + 1
+        self._load_position(*self._checkpoints[checkpoint])
+        self.start_ply = ply
+
+    def _next_turn(self):
+        self.zobrist_key ^= ZOBRIST_SIDE
+        if self.turn == Side.WHITE:
+            self.turn = Side.BLACK
+        else:
+            self.turn = Side.WHITE
+            self.move_num += 1
+
+    def _previous_turn(self):
+        self.zobrist_key ^= ZOBRIST_SIDE
+        if self.turn == Side.WHITE:
+            self.turn = Side.BLACK
+            self.move_num -= 1
+        else:
+            self.turn = Side.WHITE
+
+    def perft(self, depth: int, table=None) -> int:
+        # count leaf nodes of the legal move tree to the given depth,
+        # subtree counts are cached by position in table if one is given
+        if depth == 0:
+            return 1
+        if table is not None:
+            entry = table.probe(self.zobrist_key)
+            if entry is not None and entry.depth == depth:
+                return entry.value
+        moves = self.generate_legal_moves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.push(move)
+            nodes += self.perft(depth-1, table)
+            self.pop()
+        if table is not None:
+            table.store(self.zobrist_key, depth, nodes)
+        return nodes
+
+    def perft_divide(self, depth: int, table=None) -> dict[Move, int]:
+        # node counts split by root move, for comparing against other engines
+        divide: dict[Move, int] = {}
+        for move in self.generate_legal_moves():
+            self.push(move)
+            divide[move] = self.perft(depth-1, table) if depth > 1 else 1
+            self.pop()
+        return divide
+
+    def is_check(self):
+        return bool(self.checkers())
+
+    def is_checkmate(self):
+        # only the check evasions need generating to decide this
+        return self.is_check() and not self.generate_evasions()
+
+    def is_stalemate(self):
+        return not self.is_check() and not self.has_legal_move()
     
-    def run(self):
-        os.system('cls' if os.name == 'nt' else 'clear')
-        print("")  # leaving room for messages
+    def run(self, engines=None, renderer: Optional[Renderer] = None,
+            book=None):
+        # Terminal front-end, all prompting happens here. engines maps a
+        # Side to a computer player with choose_move(game) and last_info,
+        # moves for the other sides are asked for. The engines play from
+        # book, a book.OpeningBook, while it has a move.
+        engines = engines or {}
+        renderer = renderer or Renderer()
+        message = ""
         while True:
-            while True:
-                self.print_board()
-                print("")
-                try:
-                    (from_row, from_file, to_row, to_file) = self.input_move()
-                    # Move piece
-                    self.make_move(from_row, from_file, to_row, to_file)
-                except ChessInputError as e:
-                    os.system('cls' if os.name == 'nt' else 'clear')
-                    print(e)
-                    continue
-                except ChessMoveError as e:
-                    os.system('cls' if os.name == 'nt' else 'clear')
-                    print(e)
-                    continue
-                break
+            renderer.draw(self.board_cells(), message)
+            engine = engines.get(self.turn)
+            book_move = None
+            try:
+                if engine is not None:
+                    if book is not None:
+                        book_move = book.choose_move(self)
+                    result = self.make_move(*(book_move
+                                              or engine.choose_move(self)))
+                else:
+                    result = self.input_and_make_move()
+            except (ChessInputError, ChessMoveError) as e:
+                message = str(e)
+                continue
 
-            if self.turn == Side.WHITE:
-                self.turn = Side.BLACK
-            else:
-                self.turn = Side.WHITE
-                self.move_num += 1
+            messages = []
+            if engine is not None:
+                name = "White" if self.turn == Side.BLACK else "Black"
+                info = "book" if book_move is not None else engine.last_info
+                messages.append(f"{name} played {result.move} ({info})")
+            if result.status == GameStatus.CHECKMATE:
+                winner = "White" if self.turn == Side.BLACK else "Black"
+                messages.append(f"Checkmate! {winner} wins")
+            elif result.status == GameStatus.STALEMATE:
+                messages.append("Stalemate! The game is a draw")
+            elif result.status == GameStatus.REPETITION:
+                messages.append("Draw by threefold repetition")
+            elif result.status == GameStatus.FIFTY_MOVES:
+                messages.append("Draw by the fifty move rule")
+            elif result.check:
+                messages.append("Check!")
+            message = " ".join(messages)
+            if result.status != GameStatus.ONGOING:
+                renderer.draw(self.board_cells(), message)
+                return
+
+
+# Attack tables, built once at import. Squares are numbered row*8 + file
+# and each table lists the squares a piece could attack a square from.
+def _step_squares(steps):
+    table = []
+    for square in range(64):
+        (row, file) = divmod(square, 8)
+        table.append([(row+row_step)*8 + file+file_step
+                      for (row_step, file_step) in steps
+                      if 0 <= row+row_step < 8 and 0 <= file+file_step < 8])
+    return table
+
+def _ray_squares(directions):
+    # squares outward from each square, one list per direction and
+    # nearest first
+    table = []
+    for square in range(64):
+        rays = []
+        for (row_step, file_step) in directions:
+            (row, file) = divmod(square, 8)
+            ray = []
+            row += row_step
+            file += file_step
+            while 0 <= row < 8 and 0 <= file < 8:
+                ray.append(row*8 + file)
+                row += row_step
+                file += file_step
+            if ray:
+                rays.append(ray)
+        table.append(rays)
+    return table
 
-            os.system('cls' if os.name == 'nt' else 'clear')
-            print("")  # leaving room for messages
+KNIGHT_SQUARES = _step_squares(Chess.KNIGHT_STEPS)
+KING_SQUARES = _step_squares(Chess.KING_STEPS)
+# a white pawn attacks a square from the row below it, a black one from
+# the row above
+PAWN_ATTACKERS = {Side.WHITE: _step_squares([(-1, -1), (-1, 1)]),
+                  Side.BLACK: _step_squares([(1, -1), (1, 1)])}
+ROOK_RAYS = _ray_squares(Chess.ROOK_DIRECTIONS)
+BISHOP_RAYS = _ray_squares(Chess.BISHOP_DIRECTIONS)
@@ -0,0 +1,29 @@
+import os
+
+# Files rewritten whole (journal snapshots, game database segments and
+# manifest, tablebases) are written to path + ".tmp", synced and renamed
+# over path. The rename itself is only on disk once the directory holding
+# it is synced, and until then a crash can bring back the old file, so
+# replace_file() syncs the directory before anything the new file
+# supersedes is removed.
+
+
+def sync_file(out):
+    out.flush()
+    os.fsync(out.fileno())
+
+
+def sync_directory(directory: str):
+    if os.name == "nt":
+        return  # directories cannot be opened, renames are journaled
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_file(path: str):
+    # path + ".tmp", already synced, in place of path, durably
+    os.replace(path + ".tmp", path)
+    sync_directory(os.path.dirname(path))
@@ -0,0 +1,344 @@
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from chess import Chess, Move, PieceType
+from evaluation import PIECE_VALUES
+from transposition import EXACT, LOWER_BOUND, UPPER_BOUND, TranspositionTable
+
+MATE = 30000
+MATE_BOUND = MATE - 1000  # scores past this are mates in so many plies
+INFINITY = 32000
+MAX_DEPTH = 64
+TIME_CHECK_NODES = 256  # the clock is read once per this many nodes
+DELTA_MARGIN = 200  # positional gain allowed for in quiescence pruning
+
+def evaluate(game: Chess) -> int:
+    # material and piece placement, in centipawns for the side to move,
+    # kept up to date by the position itself
+    return game.static_eval()
+
+
+class SearchInfo(NamedTuple):
+    depth: int  # last completed iteration
+    score: int  # centipawns for the side to move
+    nodes: int
+    time: float
+    nps: int
+    pv: List[Move]
+
+    def __str__(self):
+        if abs(self.score) >= MATE_BOUND:
+            plies = MATE - abs(self.score)
+            moves = (plies + 1) // 2
+            score = f"mate {moves if self.score > 0 else -moves}"
+        else:
+            score = f"cp {self.score}"
+        return (f"depth {self.depth} score {score} nodes {self.nodes} "
+                f"nps {self.nps} time {self.time:.2f}s "
+                f"pv {' '.join(str(move) for move in self.pv)}")
+
+
+class _SearchTimeout(Exception):
+    pass
+
+
+def _value_to_table(value, ply):
+    # mate scores are stored relative to the position, not the root
+    if value >= MATE_BOUND:
+        return value + ply
+    if value <= -MATE_BOUND:
+        return value - ply
+    return value
+
+def _value_from_table(value, ply):
+    if value >= MATE_BOUND:
+        return value - ply
+    if value <= -MATE_BOUND:
+        return value + ply
+    return value
+
+
+class Engine:
+    # Negamax alpha-beta with iterative deepening and a quiescence search
+    # over captures. Moves are ordered by transposition table move, then
+    # captures by most valuable victim / least valuable attacker, then
+    # killer moves and the history of quiet moves that caused cutoffs.
+    # The time limit is hard: an unfinished iteration is abandoned.
+
+    def __init__(self, hash_bits=20, time_limit: Optional[float] = 1.0,
+                 max_depth=MAX_DEPTH,
+                 info: Optional[Callable[[SearchInfo], None]] = None,
+                 book=None, tablebases=None):
+        self.table = TranspositionTable(hash_bits)
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.info = info  # called after each completed iteration
+        self.book = book  # a book.OpeningBook tried before searching
+        # tablebase.Tablebases, probed in search and played from directly
+        self.tablebases = tablebases
+        self.last_info: Optional[SearchInfo] = None
+        # a threading.Event another thread can set to end the search as if
+        # its time was up, see uci.py
+        self.stop_event = None
+        # nodes a search may visit, None for no limit; checked with the
+        # time, so a search can overshoot it by up to TIME_CHECK_NODES
+        self.node_limit: Optional[int] = None
+        self.nodes = 0
+        self.deadline = None
+        self.killers: List[List[Optional[Move]]] = []
+        self.history: dict[Move, int] = {}
+        self.root_moves: Optional[List[Move]] = None
+        self.root_move: Optional[Move] = None
+        self.previous_root_move: Optional[Move] = None
+        self.root_score = 0
+
+    def choose_move(self, game: Chess) -> Move:
+        if self.book is not None:
+            move = self.book.choose_move(game)
+            if move is not None:
+                self.last_info = SearchInfo(0, 0, 0, 0.0, 0, [move])
+                return move
+        if self.tablebases is not None:
+            move = self.tablebases.best_move(game)
+            if move is not None:
+                result = self.tablebases.probe(game)
+                self.last_info = SearchInfo(
+                    0, self._table_score(result, 0), 0, 0.0, 0, [move])
+                return move
+        return self.search(game).pv[0]
+
+    def search(self, game: Chess, time_limit: Optional[float] = None,
+               max_depth: Optional[int] = None,
+               root_moves: Optional[List[Move]] = None) -> SearchInfo:
+        # root_moves limits the search to some of the legal moves
+        if time_limit is None:
+            time_limit = self.time_limit
+        if max_depth is None:
+            max_depth = self.max_depth
+        start = time.perf_counter()
+        self.deadline = None if time_limit is None else start + time_limit
+        self.nodes = 0
+        self.killers = [[None, None] for ply in range(max_depth + 1)]
+        self.history = {}
+        self.table.new_search()
+        self.root_moves = root_moves
+        root_ply = game.ply
+
+        moves = game.generate_legal_moves()
+        if root_moves is not None:
+            moves = [move for move in moves if move in root_moves]
+        if not moves:
+            score = -MATE if game.is_check() else 0
+            self.last_info = SearchInfo(0, score, 0, 0.0, 0, [])
+            return self.last_info
+        best = SearchInfo(0, 0, 0, 0.0, 0, [moves[0]])
+
+        for depth in range(1, max_depth + 1):
+            self.root_move = None
+            self.previous_root_move = best.pv[0]
+            try:
+                score = self._negamax(game, depth, -INFINITY, INFINITY, 0)
+                pv = self._principal_variation(game, depth)
+            except _SearchTimeout:
+                while game.ply > root_ply:
+                    game.pop()
+                # the previous best move is searched first, so a move that
+                # beat it in the unfinished iteration is safe to play
+                if (self.root_move is not None
+                        and self.root_move != best.pv[0]):
+                    best = best._replace(score=self.root_score,
+                                         pv=[self.root_move])
+                break
+            elapsed = time.perf_counter() - start
+            best = SearchInfo(depth, score, self.nodes, elapsed,
+                              int(self.nodes / elapsed) if elapsed else 0,
+                              pv)
+            if self.info is not None:
+                self.info(best)
+            if abs(score) >= MATE_BOUND:
+                break
+            if time_limit is not None and elapsed*2 > time_limit:
+                break  # the next iteration would not finish
+
+        elapsed = time.perf_counter() - start
+        self.last_info = best._replace(
+            nodes=self.nodes, time=elapsed,
+            nps=int(self.nodes / elapsed) if elapsed else 0)
+        return self.last_info
+
+    def _principal_variation(self, game: Chess, depth) -> List[Move]:
+        # the best root move, then the best moves stored in the
+        # transposition table, which need not hold the root
+        pv = [self.root_move]
+        game.push(self.root_move)
+        for i in range(depth - 1):
+            entry = self.table.probe(game.zobrist_key)
+            if (entry is None or entry.move is None
+                    or entry.move not in game.generate_legal_moves()):
+                break
+            pv.append(entry.move)
+            game.push(entry.move)
+        for move in pv:
+            game.pop()
+        return pv
+
+    def _count_node(self):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0 and (
+                (self.deadline is not None
+                 and time.perf_counter() > self.deadline)
+                or (self.node_limit is not None
+                    and self.nodes >= self.node_limit)
+                or (self.stop_event is not None and self.stop_event.is_set())):
+            raise _SearchTimeout()
+
+    def _negamax(self, game: Chess, depth, alpha, beta, ply) -> int:
+        if depth <= 0:
+            return self._quiesce(game, alpha, beta, ply)
+        self._count_node()
+        # a position seen before in the game or on the way here is scored
+        # as the draw it leads to if repeated
+        if ply and (game.halfmove_clock >= 100 or game.repetitions() > 1):
+            return 0
+        if ply and self.tablebases is not None:
+            result = self.tablebases.probe(game)
+            if result is not None:
+                return self._table_score(result, ply)
+
+        key = game.zobrist_key
+        entry = self.table.probe(key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry.move
+            if ply and entry.depth >= depth:
+                value = _value_from_table(entry.value, ply)
+                if (entry.bound == EXACT
+                        or (entry.bound == LOWER_BOUND and value >= beta)
+                        or (entry.bound == UPPER_BOUND and value <= alpha)):
+                    return value
+
+        moves = game.generate_legal_moves()
+        if ply == 0 and self.root_moves is not None:
+            moves = [move for move in moves if move in self.root_moves]
+            # the root is not stored for some of the moves (see below), so
+            # the last iteration's best goes first from here instead
+            tt_move = self.previous_root_move
+        if not moves:
+            return -MATE + ply if game.is_check() else 0
+
+        original_alpha = alpha
+        best_value = -INFINITY
+        best_move = None
+        for move in self._order_moves(game, moves, tt_move, ply):
+            game.push(move)
+            value = -self._negamax(game, depth-1, -beta, -alpha, ply+1)
+            game.pop()
+            if value <= best_value:
+                continue
+            best_value = value
+            best_move = move
+            if value <= alpha:
+                continue
+            alpha = value
+            if ply == 0:
+                self.root_move = move
+                self.root_score = value
+            if alpha >= beta:
+                if not self._is_tactical(game, move):
+                    self._record_quiet_cutoff(move, depth, ply)
+                break
+
+        if ply == 0 and self.root_moves is not None:
+            # a result over some of the moves is no bound on the position,
+            # and a worker's table outlives the search
+            return best_value
+        if best_value >= beta:
+            bound = LOWER_BOUND
+        elif best_value > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+        self.table.store(key, depth, _value_to_table(best_value, ply), bound,
+                         best_move)
+        return best_value
+
+    @staticmethod
+    def _table_score(result, ply) -> int:
+        if result.wdl == 0:
+            return 0
+        mate = MATE - ply - result.plies
+        return mate if result.wdl > 0 else -mate
+
+    def _quiesce(self, game: Chess, alpha, beta, ply) -> int:
+        # only captures and promotions, unless in check
+        self._count_node()
+        if game.is_check():
+            best_value = -INFINITY
+            moves = game.generate_legal_moves()
+            if not moves:
+                return -MATE + ply
+        else:
+            best_value = evaluate(game)
+            if best_value >= beta:
+                return best_value
+            alpha = max(alpha, best_value)
+            # captures that cannot raise the score to alpha are skipped
+            margin = max(alpha - best_value - DELTA_MARGIN, 0)
+            moves = [move for move in game.generate_captures()
+                     if PIECE_VALUES[self._captured(game, move)]
+                     + PIECE_VALUES[move.promotion] > margin]
+        for move in self._order_moves(game, moves, None, None):
+            game.push(move)
+            value = -self._quiesce(game, -beta, -alpha, ply+1)
+            game.pop()
+            if value > best_value:
+                best_value = value
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+        return best_value
+
+    def _captured(self, game: Chess, move: Move) -> PieceType:
+        (piece, color) = game.piece_at(move.to_row, move.to_file)
+        if (piece == PieceType.NOPIECE and move.from_file != move.to_file
+                and game.piece_at(move.from_row, move.from_file)[0]
+                == PieceType.PAWN):
+            return PieceType.PAWN  # en passant
+        return piece
+
+    def _is_tactical(self, game: Chess, move: Move):
+        return (move.promotion != PieceType.NOPIECE
+                or self._captured(game, move) != PieceType.NOPIECE)
+
+    def _order_moves(self, game: Chess, moves: List[Move],
+                     tt_move: Optional[Move], ply) -> List[Move]:
+        killers = self.killers[ply] if ply is not None else ()
+        history = self.history
+        scores = {}
+        for move in moves:
+            if move == tt_move:
+                scores[move] = 1 << 30
+                continue
+            victim = self._captured(game, move)
+            if victim != PieceType.NOPIECE or move.promotion:
+                attacker = game.piece_at(move.from_row, move.from_file)[0]
+                scores[move] = ((1 << 24) + PIECE_VALUES[victim]*16
+                                + PIECE_VALUES[move.promotion]*16 - attacker)
+            elif move in killers:
+                scores[move] = 1 << 22
+            else:
+                scores[move] = history.get(move, 0)
+        return sorted(moves, key=scores.__getitem__, reverse=True)
+
+    def _record_quiet_cutoff(self, move: Move, depth, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        value = self.history.get(move, 0) + depth*depth
+        self.history[move] = value
+        if value > 1 << 20:
+            # kept below the killer and capture scores
+            for (key, old) in self.history.items():
+                self.history[key] = old >> 1
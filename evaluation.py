@@ -0,0 +1,115 @@
+# Evaluation terms kept up to date by Chess as pieces are added and
+# removed. Pieces are indexed as in PieceType and sides as 0 for White and
+# 1 for Black; this module does not import chess so that chess can
+# import it.
+
+# centipawns, indexed by piece
+PIECE_VALUES = [0, 100, 320, 330, 500, 900, 0]
+
+# Game phase: the weights of the pieces left on the board add up to
+# MAX_PHASE at the start and fall towards 0 in the endgame.
+PHASE_WEIGHTS = [0, 0, 1, 1, 2, 4, 0]
+MAX_PHASE = 24
+
+# Piece-square bonuses from White's side, laid out as seen on the board
+# with a8 first. Black reads them mirrored. Tables without an endgame
+# version are used in both phases.
+PAWN_MG_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0]
+QUEEN_TABLE = [
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20]
+KING_MG_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20]
+
+PAWN_EG_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0]
+KING_EG_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+MG_TABLES = [[0] * 64, PAWN_MG_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE,
+             QUEEN_TABLE, KING_MG_TABLE]
+EG_TABLES = [[0] * 64, PAWN_EG_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE,
+             QUEEN_TABLE, KING_EG_TABLE]
+
+
+def _signed_tables(tables):
+    # [side][piece][square] value plus bonus, negative for Black so a sum
+    # over the board is White's advantage. Squares are row*8 + file.
+    white = [[PIECE_VALUES[piece] + table[(7 - square//8)*8 + square%8]
+              for square in range(64)]
+             for (piece, table) in enumerate(tables)]
+    black = [[-(PIECE_VALUES[piece] + table[square])
+              for square in range(64)]
+             for (piece, table) in enumerate(tables)]
+    return [white, black]
+
+PSQT_MG = _signed_tables(MG_TABLES)
+PSQT_EG = _signed_tables(EG_TABLES)
+
+
+def taper(mg, eg, phase):
+    # blend of middlegame and endgame scores by the game phase
+    phase = min(phase, MAX_PHASE)
+    return (mg*phase + eg*(MAX_PHASE - phase)) // MAX_PHASE
@@ -0,0 +1,484 @@
+import collections
+import heapq
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from chess import (START_FEN, Chess, ChessInputError, ChessMoveError, Move,
+                   decode_move, encode_move)
+from durable import replace_file, sync_file
+from pgn import parse_game, split_games
+
+# A directory of games with an index of the positions they reach:
+#   games.bin   per game, a header (plies, result, FEN length, tags
+#               length), the FEN (empty for the starting position), the
+#               tags as "name\tvalue" lines and the moves as
+#               chess.encode_move, two bytes each
+#   games.idx   the offset of each game in games.bin, 8 bytes, so game
+#               ids are indexes into it. Read into memory on opening.
+#   positions-N.seg  sorted (zobrist key, game id, ply) entries, 16 bytes
+#               each, searched through mmap
+#   positions.tail   entries of the latest games not yet in a segment,
+#               unsorted and also held in memory
+#   manifest.json    the segments in use and the first game in the tail
+# A game's entries are the positions it reaches, the first time each. The
+# tail is sorted into a new segment every TAIL_ENTRIES entries, and the
+# newest segments are merged while one is no more than MERGE_RATIO times
+# the size of the next, so a lookup searches a few segments at most.
+GAME_FORMAT = struct.Struct("<HBBH")
+OFFSET_FORMAT = struct.Struct("<Q")
+ENTRY_FORMAT = struct.Struct("<QII")
+ENTRY_SIZE = ENTRY_FORMAT.size  # 16
+KEY_FORMAT = struct.Struct("<Q")
+RESULT_CODES = {"*": 0, "1-0": 1, "0-1": 2, "1/2-1/2": 3}
+RESULT_NAMES = list(RESULT_CODES)
+TAIL_ENTRIES = 1 << 18
+MERGE_RATIO = 2
+MAX_PLIES = 65535
+
+
+class GameRecord(NamedTuple):
+    game_id: int
+    fen: str
+    result: str
+    tags: Dict[str, str]
+    moves: List[Move]
+
+
+class PositionHit(NamedTuple):
+    game_id: int
+    ply: int  # moves played to reach the position, 0 for the start
+
+
+class _Replayed(NamedTuple):
+    # a validated game ready to store
+    fen: str
+    result: str
+    tags: Dict[str, str]
+    moves: bytes  # array('H') of encode_move
+    keys: List[tuple]  # (zobrist key, ply), first occurrences
+
+
+def _replay(game: Chess, fen: Optional[str], moves: Iterable,
+            result: str, tags: Dict[str, str]) -> _Replayed:
+    # Checks every move, a Move or SAN, and collects the positions, raising
+    # ChessMoveError or ChessInputError at the first bad one.
+    if result not in RESULT_CODES:
+        raise ChessInputError(f"Invalid result {result}")
+    game.set_fen(fen or START_FEN)
+    codes = array('H')
+    seen = {game.zobrist_key}
+    keys = [(game.zobrist_key, 0)]
+    for move in moves:
+        if isinstance(move, str):
+            move = game.parse_san(move)
+        elif move not in game.generate_legal_moves():
+            raise ChessMoveError(f"Illegal move {move}")
+        game.push(move)
+        codes.append(encode_move(move))
+        if game.zobrist_key not in seen:
+            seen.add(game.zobrist_key)
+            keys.append((game.zobrist_key, len(codes)))
+    if len(codes) > MAX_PLIES:
+        raise ChessInputError("Game too long to store")
+    return _Replayed("" if fen in (None, START_FEN) else fen, result,
+                     tags, codes.tobytes(), keys)
+
+
+def _replay_pgn(game: Chess, text: str) -> Optional[_Replayed]:
+    pgn_game = parse_game(text)
+    tags = {name: value for (name, value) in pgn_game.headers.items()
+            if "\t" not in value and "\n" not in value}
+    try:
+        return _replay(game, pgn_game.headers.get("FEN"), pgn_game.moves,
+                       pgn_game.result, tags)
+    except (ChessInputError, ChessMoveError):
+        return None
+
+
+# one Chess per worker process, reset for each game it replays
+_worker_game: Optional[Chess] = None
+
+def _init_worker(backend):
+    global _worker_game
+    _worker_game = backend()
+
+def _replay_batch(texts):
+    return [_replay_pgn(_worker_game, text) for text in texts]
+
+
+def _replayed_batches(texts: Iterable[str], processes: Optional[int],
+                      backend, batch_size=64) -> Iterator[list]:
+    # games replayed a batch at a time, few batches in flight as in
+    # pgn.validate_games
+    if processes == 1:
+        game = backend()
+        for text in texts:
+            yield [_replay_pgn(game, text)]
+        return
+
+    with multiprocessing.Pool(processes, _init_worker, (backend,)) as pool:
+        max_pending = 4 * (processes or multiprocessing.cpu_count())
+        pending = collections.deque()
+        batch: List[str] = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) == batch_size:
+                pending.append(pool.apply_async(_replay_batch, (batch,)))
+                batch = []
+                if len(pending) >= max_pending:
+                    yield pending.popleft().get()
+        if batch:
+            pending.append(pool.apply_async(_replay_batch, (batch,)))
+        while pending:
+            yield pending.popleft().get()
+
+
+class _Segment:
+    # one sorted entry file, binary searched in place like book.OpeningBook
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.entries = size // ENTRY_SIZE
+        if size:
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            if hasattr(self.data, "madvise"):
+                self.data.madvise(mmap.MADV_RANDOM)
+        else:
+            self.data = b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def lookup(self, key) -> List[PositionHit]:
+        (low, high) = (0, self.entries)
+        while low < high:
+            middle = (low + high) // 2
+            if KEY_FORMAT.unpack_from(self.data, middle*ENTRY_SIZE)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        hits = []
+        for index in range(low, self.entries):
+            (entry_key, game_id, ply) = ENTRY_FORMAT.unpack_from(
+                self.data, index*ENTRY_SIZE)
+            if entry_key != key:
+                break
+            hits.append(PositionHit(game_id, ply))
+        return hits
+
+    def __iter__(self) -> Iterator[tuple]:
+        for start in range(0, self.entries, 4096):
+            yield from ENTRY_FORMAT.iter_unpack(
+                self.data[start*ENTRY_SIZE:(start+4096)*ENTRY_SIZE])
+
+
+class GameDatabase:
+    # Games are appended with add_game() or add_pgn() and read back with
+    # game(); find() lists the games that reached a position. One process
+    # writes at a time. Appended games are on disk after flush() or
+    # close(), and a game cut short by a crash is dropped on opening.
+
+    def __init__(self, directory: str, backend=Chess):
+        self.directory = directory
+        self.backend = backend
+        self.game_replayer: Chess = backend()
+        os.makedirs(directory, exist_ok=True)
+        self.games_file = open(self._path("games.bin"), "a+b")
+        self.offsets_file = open(self._path("games.idx"), "a+b")
+        self.offsets = array('Q')
+        self._recover_games()
+        self.games_end = self.games_file.seek(0, os.SEEK_END)
+
+        manifest = {"segments": [], "tail_start": 0, "next_segment": 0}
+        if os.path.exists(self._path("manifest.json")):
+            with open(self._path("manifest.json")) as stream:
+                manifest = json.load(stream)
+        self.segments = [_Segment(self._path(name))
+                         for name in manifest["segments"]]
+        self.tail_start = manifest["tail_start"]
+        self.next_segment = manifest["next_segment"]
+        for name in os.listdir(directory):
+            # left by a merge or segment write that did not finish
+            if (name.endswith((".seg", ".tmp"))
+                    and name not in manifest["segments"]):
+                os.remove(self._path(name))
+        self._load_tail()
+
+    def _path(self, name) -> str:
+        return os.path.join(self.directory, name)
+
+    def close(self):
+        self.flush()
+        for segment in self.segments:
+            segment.close()
+        self.games_file.close()
+        self.offsets_file.close()
+        self.tail_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def flush(self):
+        # games.bin first, so games.idx never points past its end
+        for stream in (self.games_file, self.offsets_file, self.tail_file):
+            stream.flush()
+            os.fsync(stream.fileno())
+
+    def _recover_games(self):
+        # reads the offsets, dropping a half written one and games that
+        # did not reach games.bin, then anything after the last game
+        self.offsets_file.seek(0)
+        data = self.offsets_file.read()
+        self.offsets.frombytes(data[:len(data) - len(data) % 8])
+        size = self.games_file.seek(0, os.SEEK_END)
+        end = 0
+        while self.offsets:
+            offset = self.offsets[-1]
+            self.games_file.seek(offset)
+            header = self.games_file.read(GAME_FORMAT.size)
+            if len(header) == GAME_FORMAT.size:
+                (plies, result, fen_length, tags_length) = GAME_FORMAT.unpack(
+                    header)
+                end = (offset + GAME_FORMAT.size + fen_length + tags_length
+                       + 2*plies)
+                if end <= size:
+                    break
+            self.offsets.pop()
+            end = 0
+        self.offsets_file.truncate(len(self.offsets) * OFFSET_FORMAT.size)
+        self.games_file.truncate(end)
+
+    def _load_tail(self):
+        # entries of games after the segments, re-indexing any game the
+        # tail file lost in a crash
+        self.tail: Dict[int, List[PositionHit]] = {}
+        self.tail_entries = 0
+        self.tail_file = open(self._path("positions.tail"), "a+b")
+        self.tail_file.seek(0)
+        data = self.tail_file.read()
+        data = data[:len(data) - len(data) % ENTRY_SIZE]
+        last_game = self.tail_start - 1
+        kept = bytearray()
+        for (key, game_id, ply) in ENTRY_FORMAT.iter_unpack(data):
+            if not self.tail_start <= game_id < len(self.offsets):
+                continue
+            self.tail.setdefault(key, []).append(PositionHit(game_id, ply))
+            self.tail_entries += 1
+            kept += ENTRY_FORMAT.pack(key, game_id, ply)
+            last_game = max(last_game, game_id)
+        if len(kept) != len(data):
+            self.tail_file.truncate(0)
+            self.tail_file.write(kept)
+        # a game's entries are written together, so the last one may be cut
+        self._forget_tail_game(last_game)
+        for game_id in range(max(last_game, self.tail_start),
+                             len(self.offsets)):
+            record = self.game(game_id)
+            replayed = _replay(self.game_replayer, record.fen, record.moves,
+                               record.result, record.tags)
+            self._index(game_id, replayed.keys)
+
+    def _forget_tail_game(self, game_id):
+        if game_id < self.tail_start:
+            return
+        for key in list(self.tail):
+            hits = [hit for hit in self.tail[key] if hit.game_id != game_id]
+            self.tail_entries -= len(self.tail[key]) - len(hits)
+            if hits:
+                self.tail[key] = hits
+            else:
+                del self.tail[key]
+        self.tail_file.truncate(0)
+        self.tail_file.write(b"".join(
+            ENTRY_FORMAT.pack(key, hit.game_id, hit.ply)
+            for (key, hits) in self.tail.items() for hit in hits))
+
+    def add_game(self, moves: Iterable[Move], fen: Optional[str] = None,
+                 result="*", tags: Optional[Dict[str, str]] = None) -> int:
+        # validates and stores a game, returning its id
+        replayed = _replay(self.game_replayer, fen, moves, result, tags or {})
+        return self._append(replayed)
+
+    def add_pgn(self, paths: Iterable[str],
+                processes: Optional[int] = None) -> Tuple[int, int]:
+        # Stores every legal game of the PGN files, replayed on a process
+        # pool. Returns the numbers of games added and rejected.
+        def texts():
+            for path in paths:
+                with open(path, encoding="utf-8",
+                          errors="replace") as stream:
+                    yield from split_games(stream)
+
+        (added, rejected) = (0, 0)
+        for batch in _replayed_batches(texts(), processes, self.backend):
+            for replayed in batch:
+                if replayed is None:
+                    rejected += 1
+                else:
+                    self._append(replayed)
+                    added += 1
+        self.flush()
+        return (added, rejected)
+
+    def _append(self, replayed: _Replayed) -> int:
+        fen = replayed.fen.encode()
+        tags = "".join(f"{name}\t{value}\n" for (name, value)
+                       in replayed.tags.items()).encode()
+        if len(fen) > 255 or len(tags) > 65535:
+            raise ChessInputError("FEN or tags too long to store")
+        game_id = len(self.offsets)
+        self.games_file.write(GAME_FORMAT.pack(
+            len(replayed.moves) // 2, RESULT_CODES[replayed.result],
+            len(fen), len(tags)))
+        self.games_file.write(fen + tags + replayed.moves)
+        self.offsets_file.write(OFFSET_FORMAT.pack(self.games_end))
+        self.offsets.append(self.games_end)
+        self.games_end += (GAME_FORMAT.size + len(fen) + len(tags)
+                           + len(replayed.moves))
+        self._index(game_id, replayed.keys)
+        return game_id
+
+    def _index(self, game_id, keys: List[tuple]):
+        self.tail_file.write(b"".join(ENTRY_FORMAT.pack(key, game_id, ply)
+                                      for (key, ply) in keys))
+        for (key, ply) in keys:
+            self.tail.setdefault(key, []).append(PositionHit(game_id, ply))
+        self.tail_entries += len(keys)
+        if self.tail_entries >= TAIL_ENTRIES:
+            self._write_segment()
+
+    def _write_segment(self):
+        # The tail as a new sorted segment, then merges of the newest. The
+        # games go to disk first, the manifest must not name lost games.
+        self.flush()
+        entries = sorted((key, hit.game_id, hit.ply)
+                         for (key, hits) in self.tail.items() for hit in hits)
+        name = self._new_segment_name()
+        with open(self._path(name + ".tmp"), "wb") as out:
+            for start in range(0, len(entries), 65536):
+                out.write(b"".join(ENTRY_FORMAT.pack(*entry)
+                                   for entry in entries[start:start+65536]))
+            sync_file(out)
+        replace_file(self._path(name))
+        self.segments.append(_Segment(self._path(name)))
+        self.tail_start = len(self.offsets)
+        self._write_manifest()
+        self.tail = {}
+        self.tail_entries = 0
+        self.tail_file.truncate(0)
+
+        while (len(self.segments) > 1 and self.segments[-2].entries
+               <= MERGE_RATIO * self.segments[-1].entries):
+            self._merge_last_segments()
+
+    def _merge_last_segments(self):
+        (older, newer) = self.segments[-2:]
+        name = self._new_segment_name()
+        with open(self._path(name + ".tmp"), "wb") as out:
+            buffer = []
+            for entry in heapq.merge(older, newer):
+                buffer.append(ENTRY_FORMAT.pack(*entry))
+                if len(buffer) == 65536:
+                    out.write(b"".join(buffer))
+                    buffer = []
+            out.write(b"".join(buffer))
+            sync_file(out)
+        replace_file(self._path(name))
+        self.segments[-2:] = [_Segment(self._path(name))]
+        self._write_manifest()
+        for segment in (older, newer):
+            segment.close()
+            os.remove(segment.path)
+
+    def _new_segment_name(self) -> str:
+        name = f"positions-{self.next_segment:06d}.seg"
+        self.next_segment += 1
+        return name
+
+    def _write_manifest(self):
+        path = self._path("manifest.json")
+        with open(path + ".tmp", "w") as out:
+            json.dump({"segments": [os.path.basename(segment.path)
+                                    for segment in self.segments],
+                       "tail_start": self.tail_start,
+                       "next_segment": self.next_segment}, out)
+            sync_file(out)
+        replace_file(path)
+
+    def game(self, game_id) -> GameRecord:
+        if not 0 <= game_id < len(self.offsets):
+            raise ChessInputError(f"No game {game_id}")
+        self.games_file.flush()
+        self.games_file.seek(self.offsets[game_id])
+        (plies, result, fen_length, tags_length) = GAME_FORMAT.unpack(
+            self.games_file.read(GAME_FORMAT.size))
+        fen = self.games_file.read(fen_length).decode()
+        tags = {}
+        for line in self.games_file.read(tags_length).decode().splitlines():
+            (name, _, value) = line.partition("\t")
+            tags[name] = value
+        codes = array('H')
+        codes.frombytes(self.games_file.read(2*plies))
+        return GameRecord(game_id, fen or START_FEN, RESULT_NAMES[result],
+                          tags, [decode_move(code) for code in codes])
+
+    def find(self, position) -> List[PositionHit]:
+        # the games that reached a position, given as a Chess or its
+        # zobrist_key, with the ply each first reached it at
+        key = position if isinstance(position, int) else position.zobrist_key
+        hits = []
+        for segment in self.segments:
+            hits.extend(segment.lookup(key))
+        hits.extend(self.tail.get(key, ()))
+        return sorted(hits)
+
+
+def import_pgn(path: str, directory: str, processes: Optional[int] = None,
+               backend=Chess):
+    # adds a PGN file to a database, printing the throughput
+    start = time.perf_counter()
+    with GameDatabase(directory, backend) as database:
+        (added, rejected) = database.add_pgn([path], processes)
+        total = len(database)
+    elapsed = time.perf_counter() - start
+    print(f"Added: {added}")
+    print(f"Rejected: {rejected}")
+    print(f"Games in database: {total}")
+    print(f"Time: {elapsed:.3f}s")
+    print(f"Games per second: {added / elapsed if elapsed else 0:.0f}")
+
+
+def find_position(fen: str, directory: str, backend=Chess, limit=20):
+    # prints the games of a database that reached a position
+    game = backend()
+    game.set_fen(fen)
+    with GameDatabase(directory, backend) as database:
+        start = time.perf_counter()
+        hits = database.find(game)
+        elapsed = time.perf_counter() - start
+        for hit in hits[:limit]:
+            tags = database.game(hit.game_id).tags
+            print(f"Game {hit.game_id} ply {hit.ply}: "
+                  f"{tags.get('White', '?')} - {tags.get('Black', '?')} "
+                  f"{tags.get('Result', '*')}")
+    if len(hits) > limit:
+        print(f"... and {len(hits) - limit} more")
+    print(f"Games: {len(hits)}")
+    print(f"Time: {elapsed * 1000:.3f}ms")
@@ -0,0 +1,158 @@
+import json
+import time
+from typing import Dict, List, Optional
+
+# Opt-in call counts and timings for the hot methods of Chess. Nothing is
+# checked on the hot path while it is off: instrument() swaps the methods
+# for timed wrappers, on one game or on a whole class, and
+# uninstrument() puts the originals back.
+
+TIMED_METHODS = ["make_move", "push", "pop", "is_square_attacked",
+                 "add_piece", "remove_piece", "generate_legal_moves",
+                 "generate_pseudo_legal_moves", "generate_evasions",
+                 "generate_captures", "has_legal_move"]
+BUCKETS = 64  # latency histogram, bucket n counts calls under 2**n ns
+MOVE_METHOD = "make_move"  # the calls a move's breakdown is taken over
+
+
+class Timer:
+    __slots__ = ("calls", "total_ns", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.buckets = [0] * BUCKETS
+
+    def record(self, elapsed_ns):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        self.buckets[elapsed_ns.bit_length()] += 1
+
+    def percentile(self, fraction) -> int:
+        # upper bound in ns of the bucket holding that fraction of calls
+        target = self.calls * fraction
+        seen = 0
+        for (bucket, count) in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return 1 << bucket
+        return 0
+
+    def snapshot(self) -> dict:
+        return {"calls": self.calls,
+                "total_seconds": self.total_ns / 1e9,
+                "mean_ns": self.total_ns // self.calls if self.calls else 0,
+                "p50_ns": self.percentile(0.5),
+                "p99_ns": self.percentile(0.99),
+                # [upper bound in ns, calls] for buckets with any calls
+                "histogram": [[1 << bucket, count] for (bucket, count)
+                              in enumerate(self.buckets) if count]}
+
+
+class Stats:
+    # the timers of one or more instrumented games: per call by method name,
+    # and per move, the time each method took within one make_move. The
+    # per move timers are kept under the phase label set at the time, so
+    # a caller can split them into opening, middlegame and so on.
+
+    def __init__(self):
+        self.timers: Dict[str, Timer] = {}
+        self.moves: Dict[str, Dict[str, Timer]] = {}
+        self.phase = "game"
+        self.move_ns: Optional[Dict[str, int]] = None  # of the move under way
+        self.started = time.time()
+
+    def timer(self, name: str) -> Timer:
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer()
+        return timer
+
+    def record_move(self, move_ns: Dict[str, int]):
+        timers = self.moves.setdefault(self.phase, {})
+        for (name, elapsed_ns) in move_ns.items():
+            timer = timers.get(name)
+            if timer is None:
+                timer = timers[name] = Timer()
+            timer.record(elapsed_ns)
+
+    def reset(self):
+        self.timers = {}
+        self.moves = {}
+        self.move_ns = None
+        self.started = time.time()
+
+    def snapshot(self) -> dict:
+        return {"started": self.started,
+                "taken": time.time(),
+                "methods": {name: timer.snapshot()
+                            for (name, timer) in sorted(self.timers.items())},
+                # by phase, then method: a method's time within each move
+                # that called it
+                "moves": {phase: {name: timer.snapshot()
+                                  for (name, timer) in sorted(timers.items())}
+                          for (phase, timers) in self.moves.items()}}
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def write_json(self, path: str):
+        with open(path, "w") as out:
+            out.write(self.to_json())
+            out.write("\n")
+
+
+def _timed(method, name: str, stats: Stats):
+    perf_counter_ns = time.perf_counter_ns
+    record = stats.timer(name).record
+    starts_move = name == MOVE_METHOD
+    def timed(*args, **kwargs):
+        # the outermost make_move starts a move, and every timed call
+        # inside it adds to that move's breakdown
+        move_ns = stats.move_ns
+        begins = starts_move and move_ns is None
+        if begins:
+            move_ns = stats.move_ns = {}
+        start = perf_counter_ns()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            elapsed = perf_counter_ns() - start
+            record(elapsed)
+            if move_ns is not None:
+                move_ns[name] = move_ns.get(name, 0) + elapsed
+            if begins:
+                stats.move_ns = None
+                stats.record_move(move_ns)
+    timed.__wrapped__ = method
+    timed.__name__ = getattr(method, "__name__", "timed")
+    return timed
+
+
+def instrument(target, stats: Optional[Stats] = None,
+               methods: Optional[List[str]] = None) -> Stats:
+    # Times the methods of target, a game or a class. For a class every
+    # game of it is timed, made before or after, while a game's own timing
+    # leaves other games alone. Returns the Stats the timings go to.
+    stats = stats or Stats()
+    uninstrument(target)
+    saved = {}
+    for name in methods or TIMED_METHODS:
+        saved[name] = target.__dict__.get(name)
+        setattr(target, name, _timed(getattr(target, name), name, stats))
+    # read back from target's own __dict__, so a game and its class can
+    # be instrumented separately
+    setattr(target, "_instrumented", saved)
+    return stats
+
+
+def uninstrument(target):
+    saved = target.__dict__.get("_instrumented")
+    if saved is None:
+        return
+    for (name, original) in saved.items():
+        if original is None:
+            delattr(target, name)
+        else:
+            setattr(target, name, original)
+    delattr(target, "_instrumented")
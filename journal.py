@@ -0,0 +1,339 @@
+import os
+import struct
+import threading
+import zlib
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from chess import START_FEN, Chess, Move, decode_move, encode_move
+from durable import replace_file, sync_file
+from packed import POSITION_SIZE, pack_position, unpack_position
+
+# Crash-safe record of games in progress. Every move accepted by the
+# make_move of an attached game appends a fixed size record to the
+# journal. A move only adds its record to a buffer, costing a struct.pack
+# and a lock; a background thread writes the buffer with one fsync per
+# batch and compacts, so no move ever waits for the disk. Compaction
+# writes the live games to a snapshot and starts a new journal, and
+# opening the directory rebuilds the games from the snapshot and the
+# journals after it.
+#   journal-N.log   16 byte records, little endian:
+#                     game id  4 bytes
+#                     value  4 bytes, by kind: START the slot of the
+#                       start position in starts-N.bin plus 1 (0 for the
+#                       standard start), MOVE the game ply after the move,
+#                       END the result code
+#                     move, as chess.encode_move  2 bytes
+#                     kind  1 byte, then 1 byte padding
+#                     CRC-32 of the 12 bytes before it  4 bytes
+#   starts-N.bin    packed.py positions games started from
+#   snapshot.bin    header (magic, generation N, games), then per game its
+#                   id, plies, a flag and the start position if the flag
+#                   is set, and the moves; the state before journal-N
+# A MOVE record drops any moves of the game from its ply on before adding
+# its own, so a move made after Chess.undo() replaces the undone ones and
+# replaying a record twice changes nothing. A torn record at the end of a
+# journal fails its CRC and ends the replay of that journal.
+RECORD_FORMAT = struct.Struct("<IIHBxI")
+RECORD_SIZE = RECORD_FORMAT.size  # 16
+FIELDS_FORMAT = struct.Struct("<IIHBx")  # the record before its CRC
+CRC_FORMAT = struct.Struct("<I")
+SNAPSHOT_HEADER = struct.Struct("<4sII")
+SNAPSHOT_GAME = struct.Struct("<IIB")
+MAGIC = b"CJS1"
+START = 1
+MOVE = 2
+END = 3
+RESULT_CODES = {"*": 0, "1-0": 1, "0-1": 2, "1/2-1/2": 3}
+SYNC_RECORDS = 4096  # records that wake the writer before the interval
+SYNC_INTERVAL = 0.05  # seconds a record may wait for its fsync
+COMPACT_RECORDS = 1 << 20  # journal records between compactions
+
+
+class JournalGame(NamedTuple):
+    start: Optional[bytes]  # packed position, None for the standard start
+    moves: array  # encode_move of each move
+
+
+class Journal:
+    # Opens or creates a journal directory. resume() gives the games that
+    # were in progress, attach() journals a game from then on and
+    # end_game() drops it. A background thread writes and syncs what is
+    # buffered every sync_interval seconds, or sooner once sync_records
+    # are waiting; flush() and close() write it at once.
+    #   lock       the buffers and games, held only for moments
+    #   file_lock  the files: writes, fsyncs and starting a generation
+
+    def __init__(self, directory: str, sync_records=SYNC_RECORDS,
+                 sync_interval=SYNC_INTERVAL,
+                 compact_records=COMPACT_RECORDS):
+        self.directory = directory
+        self.sync_records = sync_records
+        self.compact_records = compact_records
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        self.games: Dict[int, JournalGame] = {}
+        self.generation = self._load_snapshot()
+        while os.path.exists(self._path(f"journal-{self.generation}.log")):
+            self._replay(self.generation)
+            self.generation += 1
+        # a new journal after what was recovered, the old ones go with
+        # the first compaction
+        self.buffer = bytearray()
+        self.start_buffer = bytearray()  # positions for starts-N.bin
+        self.starts = 0  # start positions in this generation
+        self.records = 0  # since the last compaction
+        self._open_generation()
+        self._write_snapshot(self.generation, self._saved_games())
+
+        self.closed = threading.Event()
+        self.wake = threading.Event()
+        self.syncer = threading.Thread(target=self._sync_loop,
+                                       args=(sync_interval,), daemon=True)
+        self.syncer.start()
+
+    def _path(self, name) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load_snapshot(self) -> int:
+        # the games of the snapshot, returning the generation after it
+        path = self._path("snapshot.bin")
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as stream:
+            data = stream.read()
+        (magic, generation, count) = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a journal snapshot")
+        offset = SNAPSHOT_HEADER.size
+        for i in range(count):
+            (game_id, plies, has_start) = SNAPSHOT_GAME.unpack_from(data,
+                                                                    offset)
+            offset += SNAPSHOT_GAME.size
+            start = None
+            if has_start:
+                start = data[offset:offset + POSITION_SIZE]
+                offset += POSITION_SIZE
+            moves = array('H')
+            moves.frombytes(data[offset:offset + 2*plies])
+            offset += 2*plies
+            self.games[game_id] = JournalGame(start, moves)
+        return generation
+
+    def _replay(self, generation):
+        starts = b""
+        if os.path.exists(self._path(f"starts-{generation}.bin")):
+            with open(self._path(f"starts-{generation}.bin"), "rb") as stream:
+                starts = stream.read()
+        with open(self._path(f"journal-{generation}.log"), "rb") as stream:
+            data = stream.read()
+        for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+            (game_id, value, move, kind, crc) = RECORD_FORMAT.unpack_from(
+                data, offset)
+            if crc != zlib.crc32(data[offset:offset + RECORD_SIZE - 4]):
+                break  # torn by a crash
+            self._apply(game_id, value, move, kind, starts)
+
+    def _apply(self, game_id, value, move, kind, starts=b""):
+        if kind == START:
+            start = None
+            if value:
+                start = starts[(value-1) * POSITION_SIZE:value*POSITION_SIZE]
+            self.games[game_id] = JournalGame(start, array('H'))
+        elif kind == MOVE:
+            game = self.games.get(game_id)
+            if game is not None:
+                del game.moves[value-1:]
+                game.moves.append(move)
+        elif kind == END:
+            self.games.pop(game_id, None)
+
+    def _open_generation(self):
+        # never used before, though a crash may have left its starts file
+        self.journal_file = open(
+            self._path(f"journal-{self.generation}.log"), "wb")
+        self.starts_file = open(
+            self._path(f"starts-{self.generation}.bin"), "wb")
+
+    def resume(self, backend=Chess) -> Dict[int, Chess]:
+        # the games in progress, by id, at their last journaled move
+        games = {}
+        with self.lock:
+            saved = dict(self.games)
+        new_game = backend()
+        for (game_id, journaled) in saved.items():
+            game = new_game.clone()  # cheaper than constructing each
+            if journaled.start is not None:
+                unpack_position(journaled.start, 0, game)
+            for code in journaled.moves:
+                game.push(decode_move(code))
+            games[game_id] = game
+        return games
+
+    def start_game(self, game_id, game: Chess):
+        # journals game's position as the start of game_id
+        start = None if game.fen() == START_FEN else pack_position(game)
+        with self.lock:
+            value = 0
+            if start is not None:
+                self.start_buffer += start
+                self.starts += 1
+                value = self.starts
+            self._append(game_id, value, 0, START)
+            self.games[game_id] = JournalGame(start, array('H'))
+
+    def record_move(self, game_id, ply, move: Move):
+        with self.lock:
+            code = encode_move(move)
+            self._append(game_id, ply, code, MOVE)
+            game = self.games.get(game_id)
+            if game is not None:
+                del game.moves[ply-1:]
+                game.moves.append(code)
+
+    def end_game(self, game_id, result="*"):
+        with self.lock:
+            self._append(game_id, RESULT_CODES.get(result, 0), 0, END)
+            self.games.pop(game_id, None)
+
+    def _append(self, game_id, value, move, kind):
+        # with the lock held; the writer thread takes it from here
+        fields = FIELDS_FORMAT.pack(game_id, value, move, kind)
+        self.buffer += fields
+        self.buffer += CRC_FORMAT.pack(zlib.crc32(fields))
+        self.records += 1
+        if len(self.buffer) >= self.sync_records * RECORD_SIZE:
+            self.wake.set()
+
+    def _take_buffers(self) -> Tuple[bytearray, bytearray]:
+        # with the lock held
+        (records, starts) = (self.buffer, self.start_buffer)
+        self.buffer = bytearray()
+        self.start_buffer = bytearray()
+        return (records, starts)
+
+    def _write(self, records, starts):
+        # with the file lock held. Start positions first, the records that
+        # refer to them after.
+        if starts:
+            self.starts_file.write(starts)
+            self.starts_file.flush()
+            os.fsync(self.starts_file.fileno())
+        if records:
+            self.journal_file.write(records)
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+
+    def flush(self):
+        # writes and syncs what is buffered, while moves go on buffering
+        with self.file_lock:
+            with self.lock:
+                (records, starts) = self._take_buffers()
+            self._write(records, starts)
+
+    def _sync_loop(self, interval):
+        while not self.closed.is_set():
+            self.wake.wait(interval)
+            self.wake.clear()
+            self.flush()
+            if self.records >= self.compact_records:
+                self.compact()
+
+    def compact(self):
+        # a snapshot of the live games, taken as a new journal starts;
+        # moves only wait for the lock while the buffers are swapped
+        with self.file_lock:
+            with self.lock:
+                (records, starts) = self._take_buffers()
+                self.generation += 1
+                self.starts = 0
+                self.records = 0
+                saved = self._saved_games()
+            # what was buffered belongs to the journal being ended
+            self._write(records, starts)
+            self.journal_file.close()
+            self.starts_file.close()
+            self._open_generation()
+            self._write_snapshot(self.generation, saved)
+
+    def _saved_games(self) -> List[tuple]:
+        return [(game_id, game.start, game.moves.tobytes())
+                for (game_id, game) in self.games.items()]
+
+    def _write_snapshot(self, generation, saved: List[tuple]):
+        # the games as the snapshot before journal generation, then the
+        # older journals are removed
+        parts = [SNAPSHOT_HEADER.pack(MAGIC, generation, len(saved))]
+        for (game_id, start, moves) in saved:
+            parts.append(SNAPSHOT_GAME.pack(game_id, len(moves) // 2,
+                                            start is not None))
+            if start is not None:
+                parts.append(start)
+            parts.append(moves)
+        path = self._path("snapshot.bin")
+        with open(path + ".tmp", "wb") as out:
+            out.write(b"".join(parts))
+            sync_file(out)
+        # the snapshot must be on disk before the journals it replaces go
+        replace_file(path)
+        for name in os.listdir(self.directory):
+            (kind, _, rest) = name.partition("-")
+            if (kind in ("journal", "starts") and rest.split(".")[0].isdigit()
+                    and int(rest.split(".")[0]) < generation):
+                os.remove(self._path(name))
+
+    def attach(self, game: Chess, game_id, start=True):
+        # Journals every move game.make_move accepts from now on, starting
+        # game_id at the current position unless start is False (for a
+        # game from resume()). Like instrumentation.instrument, only this
+        # game's make_move is replaced.
+        if start:
+            self.start_game(game_id, game)
+        with self.lock:
+            journaled = self.games.get(game_id)
+            # the game ply of the journaled start
+            base = game.game_ply() - (len(journaled.moves) if journaled
+                                      else 0)
+        make_move = game.make_move
+        journal = self
+
+        def journaled_make_move(*args, **kwargs):
+            nonlocal base
+            result = make_move(*args, **kwargs)
+            ply = game.game_ply() - base
+            if ply < 1:
+                # a move after undoing past the journaled start
+                base = game.game_ply()
+                journal.start_game(game_id, game)
+            else:
+                journal.record_move(game_id, ply, result.move)
+            return result
+        journaled_make_move.__wrapped__ = make_move
+        game.__dict__.setdefault("_journaled", game.__dict__.get("make_move"))
+        game.make_move = journaled_make_move
+
+    def close(self):
+        self.closed.set()
+        self.wake.set()
+        self.syncer.join()
+        self.flush()
+        self.journal_file.close()
+        self.starts_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def detach(game: Chess):
+    # stops journaling game, undoing Journal.attach
+    if "_journaled" not in game.__dict__:
+        return
+    original = game.__dict__.pop("_journaled")
+    if original is None:
+        del game.make_move
+    else:
+        game.make_move = original
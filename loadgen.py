@@ -0,0 +1,78 @@
+import asyncio
+import random
+import time
+from typing import List
+
+from bitboard import BitboardChess
+from chess import Side
+from server import raise_file_limit
+
+# Load generator for server.py: opens two connections per game, pairs
+# them with PLAY and has each side play random legal moves. The time from
+# sending MOVE to receiving the matching MOVED is recorded per move.
+
+
+async def _player(host, port, plies, latencies: List[float],
+                  rng: random.Random, connecting: asyncio.Semaphore):
+    async with connecting:
+        (reader, writer) = await asyncio.open_connection(host, port)
+    mirror = BitboardChess()  # the game as the client sees it
+    writer.write(b"PLAY\n")
+    words = (await reader.readline()).decode().split()
+    if not words or words[0] != "START":
+        writer.close()
+        return
+    side = Side.WHITE if words[2] == "white" else Side.BLACK
+    sent = None
+    while True:
+        if mirror.turn == side and sent is None:
+            moves = mirror.generate_legal_moves()
+            if mirror.ply >= plies or not moves:
+                writer.write(b"RESIGN\n")
+            else:
+                sent = time.perf_counter()
+                writer.write(f"MOVE {rng.choice(moves)}\n".encode())
+        line = await reader.readline()
+        if not line:
+            break
+        words = line.decode().split()
+        if words[0] == "MOVED":
+            if sent is not None:
+                latencies.append(time.perf_counter() - sent)
+                sent = None
+            mirror.push(mirror.parse_move(words[2]))
+        elif words[0] == "OVER":
+            break
+        elif words[0] == "ERROR":
+            raise RuntimeError(f"server rejected a move: {line!r}")
+    writer.write(b"QUIT\n")
+    writer.close()
+
+
+async def run_load(host="127.0.0.1", port=8765, games=100, plies=80,
+                   seed=1):
+    # plays the games concurrently and prints moves per second and
+    # latency percentiles
+    raise_file_limit()
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    # connections are opened a few at a time so the listen queue of the
+    # server does not overflow
+    connecting = asyncio.Semaphore(64)
+    start = time.perf_counter()
+    await asyncio.gather(*[_player(host, port, plies, latencies, rng,
+                                   connecting)
+                           for i in range(2*games)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies)-1, int(len(latencies) * p))]
+    print(f"Games: {games}")
+    print(f"Moves: {len(latencies)}")
+    print(f"Time: {elapsed:.3f}s")
+    print(f"Moves per second: {len(latencies) / elapsed:.0f}")
+    print(f"Latency p50: {percentile(0.5)*1000:.2f}ms")
+    print(f"Latency p99: {percentile(0.99)*1000:.2f}ms")
+    print(f"Latency max: {percentile(1.0)*1000:.2f}ms")
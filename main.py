@@ -1,11 +1,253 @@
-from chess import Chess
+import argparse
+import asyncio
+import time
+
+from bitboard import BACKENDS
+from book import OpeningBook, build_book
+from chess import START_FEN, Chess, Side
+from engine import Engine
+from gamedb import find_position, import_pgn
+from instrumentation import instrument
+from journal import Journal
+from loadgen import run_load
+from parallel import ParallelSearch, measure_scaling
+from pgn import validate_file
+from render import Renderer
+from server import serve
+from tablebase import DEFAULT_ENDGAMES, Tablebases, generate_tables
+from tournament import (load_openings, parse_player,
+                        run_tournament)
+from transposition import TranspositionTable
+from uci import run_uci
+
+
+def run_perft(game: Chess, depth: int, hash_bits: int):
+    table = TranspositionTable(hash_bits) if hash_bits else None
+    start = time.perf_counter()
+    divide = game.perft_divide(depth, table)
+    elapsed = time.perf_counter() - start
+    for move, nodes in divide.items():
+        print(f"{move}: {nodes}")
+    total = sum(divide.values())
+    print("")
+    print(f"Moves: {len(divide)}")
+    print(f"Nodes: {total}")
+    print(f"Time: {elapsed:.3f}s")
+    print(f"Nodes per second: {total / elapsed if elapsed else 0:.0f}")
 
 def main():
-    game : Chess = Chess()
-    game.run()
+    parser = argparse.ArgumentParser(description="Chess game")
+    parser.add_argument("--perft", type=int, metavar="DEPTH",
+                        help="count legal move tree nodes and exit")
+    parser.add_argument("--backend", choices=BACKENDS, default="board",
+                        help="position representation to use")
+    parser.add_argument("--hash-bits", type=int, default=0, metavar="BITS",
+                        help="transposition table of 2^BITS buckets "
+                             "(0 for none)")
+    parser.add_argument("--pgn", metavar="FILE",
+                        help="replay and validate every game in a PGN file")
+    parser.add_argument("--build-book", metavar="BOOK",
+                        help="with --pgn, compile the openings of the "
+                             "games into an opening book instead")
+    parser.add_argument("--db", metavar="DIR",
+                        help="game database: with --pgn add the games to "
+                             "it, with --fen list the games that reached "
+                             "the position")
+    parser.add_argument("--book", metavar="BOOK",
+                        help="engines play from this opening book while "
+                             "it has a move")
+    parser.add_argument("--tablebases", metavar="DIR",
+                        help="endgame tables for the engine to use")
+    parser.add_argument("--generate-tables", metavar="DIR",
+                        help="make endgame tables in DIR and exit")
+    parser.add_argument("--endgames", default=",".join(DEFAULT_ENDGAMES),
+                        help="tables for --generate-tables, e.g. KQK,KRK "
+                             "(default: %(default)s)")
+    parser.add_argument("--tournament", type=int, metavar="GAMES",
+                        help="play GAMES engine games between the --player "
+                             "configurations and report Elo")
+    parser.add_argument("--player", action="append", metavar="SPEC",
+                        help="a tournament player, name[:movetime=S,depth=N,"
+                             "hash=BITS,backend=B], given twice or more")
+    parser.add_argument("--openings", metavar="FILE",
+                        help="FEN, EPD or PGN file of tournament openings "
+                             "(default: random ones)")
+    parser.add_argument("--games-pgn", metavar="FILE",
+                        help="append the tournament games to FILE")
+    parser.add_argument("--sprt", metavar="ELO0,ELO1",
+                        help="stop the tournament once a sequential test "
+                             "decides between these Elo differences for "
+                             "the first player")
+    parser.add_argument("--jobs", type=int, default=None, metavar="N",
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--fen", help="start from this position")
+    parser.add_argument("--white", choices=["human", "engine"],
+                        default="human", help="who plays White")
+    parser.add_argument("--black", choices=["human", "engine"],
+                        default="human", help="who plays Black")
+    parser.add_argument("--movetime", type=float, default=1.0,
+                        metavar="SECONDS", help="engine time per move")
+    parser.add_argument("--depth", type=int, default=None,
+                        help="engine depth limit")
+    parser.add_argument("--threads", type=int, default=1, metavar="N",
+                        help="engine worker processes, splitting the root "
+                             "moves between them")
+    parser.add_argument("--scaling", type=int, metavar="N",
+                        help="report search throughput with 1 to N "
+                             "workers and exit")
+    parser.add_argument("--search", action="store_true",
+                        help="search the position, print each iteration "
+                             "and exit")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="time the game's hot methods and write the "
+                             "counts and latency histograms to FILE as "
+                             "JSON at the end")
+    parser.add_argument("--plain", action="store_true",
+                        help="print each board in full without terminal "
+                             "escapes, as when output is not a terminal")
+    parser.add_argument("--uci", action="store_true",
+                        help="talk the UCI protocol on stdin and stdout, "
+                             "for chess GUIs")
+    parser.add_argument("--journal", metavar="DIR",
+                        help="journal the game, or with --serve every "
+                             "game, to DIR and resume what was in progress "
+                             "there")
+    parser.add_argument("--serve", action="store_true",
+                        help="run the multiplayer server")
+    parser.add_argument("--load", type=int, metavar="GAMES",
+                        help="play GAMES random games against a running "
+                             "server and report moves per second and "
+                             "latency")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="server address")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="server port")
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.host, args.port, BACKENDS[args.backend],
+                          args.journal))
+        return
+    if args.load is not None:
+        asyncio.run(run_load(args.host, args.port, args.load))
+        return
+
+    if args.uci:
+        book = OpeningBook(args.book) if args.book is not None else None
+        tablebases = (Tablebases(args.tablebases)
+                      if args.tablebases is not None else None)
+        try:
+            run_uci(BACKENDS[args.backend], book, tablebases)
+        finally:
+            if book is not None:
+                book.close()
+            if tablebases is not None:
+                tablebases.close()
+        return
+    if args.tournament is not None:
+        players = [parse_player(spec) for spec in args.player
+                   or ["first", "second"]]
+        openings = (load_openings(args.openings)
+                    if args.openings is not None else None)
+        bounds = (tuple(float(elo) for elo in args.sprt.split(","))
+                  if args.sprt is not None else None)
+        run_tournament(players, args.tournament, openings, args.jobs,
+                       args.games_pgn, bounds)
+        return
+    if args.generate_tables is not None:
+        generate_tables(args.endgames.split(","), args.generate_tables,
+                        args.jobs)
+        return
+    if args.db is not None and args.pgn is not None:
+        import_pgn(args.pgn, args.db, args.jobs, BACKENDS[args.backend])
+        return
+    if args.db is not None:
+        find_position(args.fen or START_FEN, args.db,
+                      BACKENDS[args.backend])
+        return
+    if args.pgn is not None and args.build_book is not None:
+        start = time.perf_counter()
+        entries = build_book([args.pgn], args.build_book, args.jobs,
+                             backend=BACKENDS[args.backend])
+        print(f"Entries: {entries}")
+        print(f"Time: {time.perf_counter() - start:.3f}s")
+        return
+    if args.pgn is not None:
+        validate_file(args.pgn, args.jobs, BACKENDS[args.backend])
+        return
+
+    game : Chess = BACKENDS[args.backend]()
+    if args.fen is not None:
+        game.set_fen(args.fen)
+    journal = None
+    if args.journal is not None:
+        # game 0 of the journal, unless a new position is given
+        journal = Journal(args.journal)
+        resumed = journal.resume(BACKENDS[args.backend])
+        if 0 in resumed and args.fen is None:
+            game = resumed[0]
+        journal.attach(game, 0, start=game is not resumed.get(0))
+    stats = instrument(game) if args.stats is not None else None
+    try:
+        play(args, game)
+        if journal is not None:
+            journal.end_game(0)  # over, nothing to resume
+    finally:
+        if stats is not None:
+            stats.write_json(args.stats)
+        if journal is not None:
+            journal.close()
+
+
+def play(args, game: Chess):
+    # perft, a search or a game on the position main() set up
+    if args.perft is not None:
+        run_perft(game, args.perft, args.hash_bits)
+        return
+
+    if args.scaling is not None:
+        measure_scaling(game, args.scaling, args.movetime,
+                        args.hash_bits or 20, BACKENDS[args.backend])
+        return
 
+    tablebases = (Tablebases(args.tablebases)
+                   if args.tablebases is not None else None)
+    if args.threads > 1:
+        engine = ParallelSearch(args.threads, args.hash_bits or 20,
+                                args.movetime, backend=BACKENDS[args.backend],
+                                tablebases=tablebases)
+    else:
+        engine = Engine(args.hash_bits or 20, args.movetime,
+                        tablebases=tablebases)
+        engine.info = print if args.search else None
+    if args.depth is not None:
+        engine.max_depth = args.depth
+    try:
+        if args.search:
+            info = engine.search(game)
+            if args.threads > 1:
+                print(info)
+            print(f"bestmove {info.pv[0] if info.pv else '(none)'}")
+            return
 
+        engines = {}
+        if args.white == "engine":
+            engines[Side.WHITE] = engine
+        if args.black == "engine":
+            engines[Side.BLACK] = engine
+        book = OpeningBook(args.book) if args.book is not None else None
+        try:
+            game.run(engines, Renderer(tty=False) if args.plain else None,
+                     book)
+        finally:
+            if book is not None:
+                book.close()
+    finally:
+        if args.threads > 1:
+            engine.close()
+        if tablebases is not None:
+            tablebases.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,107 @@
+import struct
+from typing import Iterable, Iterator, Optional
+
+from chess import Chess, ChessInputError, PieceType, Side
+
+# Fixed size binary positions for storing positions in bulk:
+#   occupied squares bitboard    8 bytes, bit row*8 + file
+#   one nibble per occupied square in square order, piece type plus 8
+#   for black, low nibble first  16 bytes
+#   castling rights | 16 if black to move  1 byte
+#   en passant file + 1, 0 for none  1 byte
+#   halfmove clock (capped at 255)  1 byte
+#   move number (capped at 65535)  2 bytes
+#   reserved  3 bytes
+POSITION_FORMAT = struct.Struct("<Q16sBBBH3x")
+POSITION_SIZE = POSITION_FORMAT.size  # 32
+MAX_PIECES = 32
+
+
+def pack_into(buffer, offset, game: Chess):
+    occupied = 0
+    nibbles = bytearray(16)
+    count = 0
+    for square in range(64):
+        (piece, color) = game.piece_at(square >> 3, square & 7)
+        if piece == PieceType.NOPIECE:
+            continue
+        if count == MAX_PIECES:
+            raise ChessInputError("Too many pieces to pack")
+        occupied |= 1 << square
+        code = piece | (8 if color == Side.BLACK else 0)
+        nibbles[count >> 1] |= code << (4 * (count & 1))
+        count += 1
+    flags = game.castling | (16 if game.turn == Side.BLACK else 0)
+    ep_file = 0 if game.ep_square is None else (game.ep_square & 7) + 1
+    POSITION_FORMAT.pack_into(buffer, offset, occupied, bytes(nibbles),
+                              flags, ep_file, min(game.halfmove_clock, 255),
+                              min(game.move_num, 65535))
+
+
+def pack_position(game: Chess) -> bytes:
+    buffer = bytearray(POSITION_SIZE)
+    pack_into(buffer, 0, game)
+    return bytes(buffer)
+
+
+def _set_unpacked(game: Chess, fields):
+    (occupied, nibbles, flags, ep_file, halfmove_clock, move_num) = fields
+    pieces = []
+    count = 0
+    while occupied:
+        square = (occupied & -occupied).bit_length() - 1
+        occupied &= occupied - 1
+        code = (nibbles[count >> 1] >> (4 * (count & 1))) & 15
+        count += 1
+        color = Side.BLACK if code & 8 else Side.WHITE
+        pieces.append((square >> 3, square & 7, PieceType(code & 7), color))
+    turn = Side.BLACK if flags & 16 else Side.WHITE
+    ep_square = None
+    if ep_file:
+        ep_square = (5 if turn == Side.WHITE else 2)*8 + ep_file-1
+    game.set_position(pieces, turn, flags & 15, ep_square,
+                      halfmove_clock, move_num)
+    return game
+
+
+def unpack_position(data, offset=0, game: Optional[Chess] = None) -> Chess:
+    # loads the position into game, or a new Chess if none is given
+    if game is None:
+        game = Chess()
+    return _set_unpacked(game, POSITION_FORMAT.unpack_from(data, offset))
+
+
+def pack_positions(games: Iterable[Chess]) -> bytearray:
+    # the games may be the same object at different points of a game
+    buffer = bytearray()
+    for game in games:
+        offset = len(buffer)
+        buffer.extend(bytes(POSITION_SIZE))
+        pack_into(buffer, offset, game)
+    return buffer
+
+
+def unpack_positions(data, game: Optional[Chess] = None) -> Iterator[Chess]:
+    # Yields each packed position in a buffer. The same Chess object is
+    # loaded with every position in turn, so read what is needed from it
+    # before moving on.
+    if game is None:
+        game = Chess()
+    for fields in POSITION_FORMAT.iter_unpack(data):
+        yield _set_unpacked(game, fields)
+
+
+def pack_fens(fens: Iterable[str], game: Optional[Chess] = None) -> bytearray:
+    if game is None:
+        game = Chess()
+    return pack_positions(_load_fen(game, fen) for fen in fens)
+
+
+def _load_fen(game: Chess, fen: str) -> Chess:
+    game.set_fen(fen)
+    return game
+
+
+def unpack_fens(data, game: Optional[Chess] = None) -> Iterator[str]:
+    for position in unpack_positions(data, game):
+        yield position.fen()
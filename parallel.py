@@ -0,0 +1,169 @@
+import multiprocessing
+import time
+from typing import List, Optional
+
+from chess import Chess, Move, Snapshot
+from engine import MATE_BOUND, MAX_DEPTH, Engine, SearchInfo
+from tablebase import Tablebases
+
+STOP_POLL = 0.01  # seconds between looks at stop_event while searching
+
+# one engine per worker process, its transposition table is kept between
+# searches
+_worker_game: Optional[Chess] = None
+_worker_engine: Optional[Engine] = None
+
+def _init_worker(backend, hash_bits, tablebase_directory, stop_event):
+    # the tables are opened again in each worker, they map the same files.
+    # The time limit is given with each search, None being no limit.
+    global _worker_game, _worker_engine
+    _worker_game = backend()
+    _worker_engine = Engine(hash_bits, None, tablebases=(
+        Tablebases(tablebase_directory)
+        if tablebase_directory is not None else None))
+    _worker_engine.stop_event = stop_event
+
+def _search_root_moves(snapshot: Snapshot, root_moves, time_limit,
+                       max_depth, node_limit):
+    # every completed iteration and the node count of the whole search.
+    # The snapshot brings the positions the root can repeat, so the
+    # workers see the same draws as a search of the game itself.
+    iterations: List[SearchInfo] = []
+    _worker_game.restore(snapshot)
+    _worker_engine.info = iterations.append
+    _worker_engine.node_limit = node_limit
+    final = _worker_engine.search(_worker_game, time_limit, max_depth,
+                                  root_moves)
+    return (iterations, final.nodes)
+
+
+class ParallelSearch:
+    # Root splitting over a process pool: the legal moves at the root are
+    # dealt out to the workers, each searches its share with iterative
+    # deepening under the same time limit, and the best move is taken
+    # from the deepest iteration every worker finished. Has the same
+    # choose_move/last_info interface as Engine so run() can use it, and
+    # honours stop_event and node_limit the same way, node_limit being
+    # shared out between the workers.
+
+    def __init__(self, processes: Optional[int] = None, hash_bits=20,
+                 time_limit: Optional[float] = 1.0, max_depth=MAX_DEPTH,
+                 backend=Chess, book=None, tablebases=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.last_info: Optional[SearchInfo] = None
+        self.book = book  # a book.OpeningBook tried before searching
+        # tablebase.Tablebases played from, and probed by the workers
+        self.tablebases = tablebases
+        self.stop_event = None  # as for Engine
+        self.node_limit: Optional[int] = None
+        # passed on to the workers when stop_event is set
+        self.workers_stop = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(
+            self.processes, _init_worker,
+            (backend, hash_bits,
+             tablebases.directory if tablebases is not None else None,
+             self.workers_stop))
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def choose_move(self, game: Chess) -> Move:
+        if self.book is not None:
+            move = self.book.choose_move(game)
+            if move is not None:
+                self.last_info = SearchInfo(0, 0, 0, 0.0, 0, [move])
+                return move
+        if self.tablebases is not None:
+            move = self.tablebases.best_move(game)
+            if move is not None:
+                score = Engine._table_score(self.tablebases.probe(game), 0)
+                self.last_info = SearchInfo(0, score, 0, 0.0, 0, [move])
+                return move
+        return self.search(game).pv[0]
+
+    def search(self, game: Chess, time_limit: Optional[float] = None,
+               max_depth: Optional[int] = None) -> SearchInfo:
+        if time_limit is None:
+            time_limit = self.time_limit
+        if max_depth is None:
+            max_depth = self.max_depth
+        start = time.perf_counter()
+        moves = game.generate_legal_moves()
+        if len(moves) < 2:
+            # nothing to split, or nothing to search
+            engine = Engine(10, None, tablebases=self.tablebases)
+            engine.stop_event = self.stop_event
+            engine.node_limit = self.node_limit
+            self.last_info = engine.search(game, time_limit, max_depth)
+            return self.last_info
+
+        snapshot = game.snapshot()
+        shares = [moves[i::self.processes]
+                  for i in range(min(self.processes, len(moves)))]
+        node_limit = None
+        if self.node_limit is not None:
+            node_limit = -(-self.node_limit // len(shares))
+        self.workers_stop.clear()
+        pending = [self.pool.apply_async(_search_root_moves,
+                                         (snapshot, share, time_limit,
+                                          max_depth, node_limit))
+                   for share in shares]
+        if self.stop_event is not None:
+            for result in pending:
+                while not result.ready():
+                    result.wait(STOP_POLL)
+                    if self.stop_event.is_set():
+                        self.workers_stop.set()
+        results = [result.get() for result in pending]
+        nodes = sum(worker_nodes for (iterations, worker_nodes) in results)
+
+        # a worker that stopped early on a mate score has an exact result,
+        # the others are compared at the depth all of them reached
+        reached = []
+        for (iterations, worker_nodes) in results:
+            if not iterations:
+                reached.append(0)
+            elif abs(iterations[-1].score) >= MATE_BOUND:
+                reached.append(max_depth)
+            else:
+                reached.append(iterations[-1].depth)
+        depth = min(reached)
+        best: Optional[SearchInfo] = None
+        for (iterations, worker_nodes) in results:
+            completed = [info for info in iterations if info.depth <= depth]
+            if completed and (best is None
+                              or completed[-1].score > best.score):
+                best = completed[-1]
+        if best is None:
+            best = SearchInfo(0, 0, 0, 0.0, 0, [moves[0]])
+
+        elapsed = time.perf_counter() - start
+        self.last_info = SearchInfo(best.depth, best.score, nodes, elapsed,
+                                    int(nodes / elapsed) if elapsed else 0,
+                                    best.pv)
+        return self.last_info
+
+
+def measure_scaling(game: Chess, max_processes: int, time_limit: float,
+                    hash_bits=20, backend=Chess):
+    # searches the same position with 1 to max_processes workers and
+    # prints how throughput grows
+    base_nps = None
+    print("Workers  Depth  Nodes       NPS         Speedup  Move")
+    for processes in range(1, max_processes + 1):
+        with ParallelSearch(processes, hash_bits, time_limit,
+                            backend=backend) as search:
+            info = search.search(game)
+        if base_nps is None:
+            base_nps = info.nps or 1
+        print(f"{processes:<8} {info.depth:<6} {info.nodes:<11} "
+              f"{info.nps:<11} {info.nps / base_nps:<8.2f} {info.pv[0]}")
@@ -0,0 +1,206 @@
+import collections
+import multiprocessing
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO
+
+from chess import Chess, ChessInputError, ChessMoveError
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+# comments, variations, NAGs and move numbers are skipped in movetext
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+
+
+class PgnGame(NamedTuple):
+    headers: Dict[str, str]
+    moves: List[str]  # SAN as written in the file
+    result: str
+
+
+class GameReport(NamedTuple):
+    index: int  # position of the game in the input
+    plies: int  # moves replayed before stopping
+    error: Optional[str]  # None if every move was legal
+
+
+def split_games(stream: TextIO) -> Iterator[str]:
+    # Yields the text of one game at a time, reading line by line so a
+    # file of any size is never held in memory. A game ends when tag
+    # lines start again after its movetext.
+    lines: List[str] = []
+    in_movetext = False
+    for line in stream:
+        stripped = line.strip()
+        if stripped.startswith("[") and in_movetext:
+            yield "".join(lines)
+            lines = []
+            in_movetext = False
+        elif stripped and not stripped.startswith("["):
+            in_movetext = True
+        lines.append(line)
+    if in_movetext:
+        yield "".join(lines)
+
+
+def parse_game(text: str) -> PgnGame:
+    headers: Dict[str, str] = {}
+    moves: List[str] = []
+    result = "*"
+    comment = False  # inside {...}, which may span lines
+    variation = 0  # nesting depth of (...)
+    for line in text.splitlines():
+        if not comment and variation == 0 and line.startswith("["):
+            match = TAG_PATTERN.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+            continue
+        if line.startswith("%"):
+            continue
+        for token in re.split(r"(\s+|[{}()]|;.*)", line):
+            if not token or token.isspace():
+                continue
+            if comment:
+                comment = "}" not in token
+            elif token == "{":
+                comment = True
+            elif token == "(":
+                variation += 1
+            elif token == ")":
+                variation -= 1
+            elif variation or token.startswith((";", "$")):
+                continue
+            elif token in RESULTS:
+                result = token
+            else:
+                token = MOVE_NUMBER_PATTERN.sub("", token)
+                if token:
+                    moves.append(token)
+    return PgnGame(headers, moves, result)
+
+
+def format_game(headers: Dict[str, str], moves: List[str], result: str,
+                line_length=79) -> str:
+    # PGN text of a game, headers then movetext in SAN wrapped to
+    # line_length, as parse_game reads it back
+    lines = [f'[{name} "{value}"]' for (name, value) in headers.items()]
+    lines.append("")
+    fields = headers.get("FEN", "").split()
+    black_first = fields[1:2] == ["b"]
+    move_num = int(fields[5]) if fields[5:6] and fields[5].isdigit() else 1
+    tokens = []
+    for (index, move) in enumerate(moves):
+        white = (index % 2 == 0) != black_first
+        if white:
+            tokens.append(f"{move_num}.")
+        elif index == 0:
+            tokens.append(f"{move_num}...")
+        tokens.append(move)
+        if not white:
+            move_num += 1
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > line_length:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def read_games(stream: TextIO) -> Iterator[PgnGame]:
+    for text in split_games(stream):
+        yield parse_game(text)
+
+
+def validate_game(game: Chess, pgn_game: PgnGame,
+                  index: int = 0) -> GameReport:
+    # replays the moves on game, which is reset first
+    try:
+        if "FEN" in pgn_game.headers:
+            game.set_fen(pgn_game.headers["FEN"])
+        else:
+            game.reset()
+    except ChessInputError as e:
+        return GameReport(index, 0, f"FEN: {e}")
+    for (ply, san) in enumerate(pgn_game.moves):
+        try:
+            game.push(game.parse_san(san))
+        except (ChessInputError, ChessMoveError) as e:
+            move_num = ply // 2 + 1
+            dots = "." if ply % 2 == 0 else "..."
+            return GameReport(index, ply, f"{move_num}{dots}{san}: {e}")
+    return GameReport(index, len(pgn_game.moves), None)
+
+
+# one Chess per worker process, reset for each game it replays
+_worker_game: Optional[Chess] = None
+
+def _init_worker(backend):
+    global _worker_game
+    _worker_game = backend()
+
+def _validate_batch(batch):
+    (first_index, texts) = batch
+    return [validate_game(_worker_game, parse_game(text), first_index + i)
+            for (i, text) in enumerate(texts)]
+
+
+def validate_games(texts: Iterable[str], processes: Optional[int] = None,
+                   batch_size: int = 64, backend=Chess) -> Iterator[GameReport]:
+    # Validates games given as PGN text (see split_games) across a process
+    # pool, yielding reports in input order. Only a few batches per worker
+    # are in flight at a time, so memory stays flat however long the
+    # input is. Parsing happens in the workers too.
+    if processes == 1:
+        game = backend()
+        for (index, text) in enumerate(texts):
+            yield validate_game(game, parse_game(text), index)
+        return
+
+    with multiprocessing.Pool(processes, _init_worker, (backend,)) as pool:
+        max_pending = 4 * (processes or multiprocessing.cpu_count())
+        pending = collections.deque()
+        batch: List[str] = []
+        index = 0
+        for text in texts:
+            batch.append(text)
+            if len(batch) == batch_size:
+                pending.append(pool.apply_async(_validate_batch,
+                                                ((index, batch),)))
+                index += len(batch)
+                batch = []
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().get()
+        if batch:
+            pending.append(pool.apply_async(_validate_batch,
+                                            ((index, batch),)))
+        while pending:
+            yield from pending.popleft().get()
+
+
+def validate_file(path: str, processes: Optional[int] = None,
+                  backend=Chess, verbose: bool = True):
+    # validates every game in a PGN file, printing errors and throughput
+    games = 0
+    invalid = 0
+    plies = 0
+    start = time.perf_counter()
+    with open(path, encoding="utf-8", errors="replace") as stream:
+        for report in validate_games(split_games(stream), processes,
+                                     backend=backend):
+            games += 1
+            plies += report.plies
+            if report.error is not None:
+                invalid += 1
+                if verbose:
+                    print(f"Game {report.index + 1}: {report.error}")
+    elapsed = time.perf_counter() - start
+    print(f"Games: {games}")
+    print(f"Invalid: {invalid}")
+    print(f"Moves: {plies}")
+    print(f"Time: {elapsed:.3f}s")
+    print(f"Games per second: {games / elapsed if elapsed else 0:.0f}")
+    print(f"Moves per second: {plies / elapsed if elapsed else 0:.0f}")
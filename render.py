@@ -0,0 +1,66 @@
+import sys
+from typing import List, Optional, TextIO
+
+# Terminal drawing for Chess.run(). A board is given as cells, 8 lists of 8
+# single characters with row 8 first, as made by Chess.board_cells().
+
+ESC = "\x1b["
+BOARD_TOP = 3  # screen line of the top border, after message and blank lines
+PROMPT_LINE = BOARD_TOP + 12  # first line below the board and a blank line
+
+
+def board_lines(cells: List[List[str]]) -> List[str]:
+    size = len(cells)
+    lines = ["  " + "__" * size + "_"]
+    for (i, row) in enumerate(cells):
+        lines.append(f"{size - i} |" + "|".join(row) + "|")
+    lines.append("  " + "~~" * size + "~")
+    lines.append("  " + "".join(f" {chr(ord('a') + file)}"
+                                for file in range(size)))
+    return lines
+
+
+class Renderer:
+    # Draws the message line and the board as one write per frame. On a
+    # terminal, ANSI escapes move the cursor so only the squares that
+    # changed since the last frame are redrawn. Without one (output piped
+    # to a file or another program) every frame is written out in full as
+    # plain text, which is easy to script against.
+
+    def __init__(self, stream: Optional[TextIO] = None,
+                 tty: Optional[bool] = None):
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty() if tty is None else tty
+        self.cells: Optional[List[List[str]]] = None  # on screen now
+        self.message = ""
+
+    def reset(self):
+        # the next frame is drawn in full
+        self.cells = None
+
+    def draw(self, cells: List[List[str]], message=""):
+        if not self.tty:
+            self.stream.write("\n".join([message, ""] + board_lines(cells)
+                                        + ["", ""]))
+            self.stream.flush()
+            return
+
+        if self.cells is None:
+            frame = [f"{ESC}H{ESC}2J", message, "\n\n",
+                     "\n".join(board_lines(cells)), "\n"]
+        else:
+            frame = []
+            if message != self.message:
+                frame.append(f"{ESC}1;1H{ESC}2K{message}")
+            for (i, row) in enumerate(cells):
+                for (file, cell) in enumerate(row):
+                    if cell != self.cells[i][file]:
+                        # after "8 |", two columns per square
+                        frame.append(f"{ESC}{BOARD_TOP + 1 + i};"
+                                     f"{4 + 2*file}H{cell}")
+        # leave the cursor under the board with old prompts cleared
+        frame.append(f"{ESC}{PROMPT_LINE};1H{ESC}J")
+        self.stream.write("".join(frame))
+        self.stream.flush()
+        self.cells = [list(row) for row in cells]
+        self.message = message
@@ -0,0 +1,317 @@
+import asyncio
+import itertools
+from typing import Dict, Optional, Set
+
+from bitboard import BitboardChess
+from chess import (Chess, ChessInputError, ChessMoveError, GameStatus,
+                   PieceType, Side)
+from journal import Journal
+
+# Line protocol, one command or message per line.
+# Client to server:
+#   PLAY                wait for an opponent, both are sent START
+#   MOVE <move>         coordinate notation, e.g. e2e4 or e7e8q
+#   WATCH <game>        follow a game as a spectator
+#   REJOIN <game> <white|black>
+#                       take a free seat in a game recovered from the
+#                       journal after a restart; it goes on once both are
+#                       taken, and is over as abandoned if they are not
+#                       within RECOVERY_TIMEOUT
+#   RESIGN
+#   LIST                ids of the games being played
+#   QUIT
+# Server to client:
+#   START <game> <white|black> <fen>
+#   WATCHING <game> <fen>
+#   MOVED <game> <move> <ongoing|check|checkmate|stalemate|repetition|
+#                        fifty-moves>
+#   OVER <game> <1-0|0-1|1/2-1/2|*> <reason>
+#   GAMES <game> ...
+#   ERROR <message>
+
+STATUS_NAMES = {GameStatus.CHECKMATE: "checkmate",
+                GameStatus.STALEMATE: "stalemate",
+                GameStatus.REPETITION: "repetition",
+                GameStatus.FIFTY_MOVES: "fifty-moves"}
+SIDE_NAMES = {"white": Side.WHITE, "black": Side.BLACK}
+RECOVERY_TIMEOUT = 300.0  # seconds recovered games wait to be rejoined
+
+
+class Connection:
+    __slots__ = ("reader", "writer", "game", "side")
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.game: Optional["ServerGame"] = None
+        self.side: Optional[Side] = None  # None for spectators
+
+    def playing(self) -> bool:
+        # seated in a game that is not over, rather than watching one
+        return (self.side is not None and self.game is not None
+                and not self.game.over)
+
+    def send(self, line: str):
+        # buffered, flushed by the event loop, so one slow reader does
+        # not hold up the others
+        if not self.writer.is_closing():
+            self.writer.write(line.encode() + b"\n")
+
+
+class ServerGame:
+    __slots__ = ("id", "chess", "players", "spectators", "over")
+
+    def __init__(self, game_id: int, chess: Chess,
+                 white: Optional[Connection], black: Optional[Connection]):
+        # a seat is None in a recovered game until it is rejoined
+        self.id = game_id
+        self.chess = chess
+        self.players: Dict[Side, Connection] = {
+            side: player for (side, player) in ((Side.WHITE, white),
+                                                (Side.BLACK, black))
+            if player is not None}
+        self.spectators: Set[Connection] = set()
+        self.over = False
+
+    def broadcast(self, line: str):
+        for connection in self.players.values():
+            connection.send(line)
+        for connection in self.spectators:
+            connection.send(line)
+
+
+class ChessServer:
+    # Pairs connections into games and relays moves. Every move is checked
+    # by Chess.make_move before it is sent to both players and any
+    # spectators. Games use the bitboard backend by default since it is
+    # the smaller of the two. With a journal.Journal every game is
+    # journaled as it is played, and the games it held from before a
+    # restart are open to REJOIN, with new ids following theirs.
+
+    def __init__(self, backend=BitboardChess,
+                 journal: Optional[Journal] = None,
+                 recovery_timeout=RECOVERY_TIMEOUT):
+        self.backend = backend
+        self.journal = journal
+        self.recovery_timeout = recovery_timeout
+        self.games: Dict[int, ServerGame] = {}
+        if journal is not None:
+            for (game_id, chess) in journal.resume(backend).items():
+                journal.attach(chess, game_id, start=False)
+                self.games[game_id] = ServerGame(game_id, chess, None, None)
+        self.recovered = len(self.games)  # games open to REJOIN at start
+        self.waiting: Optional[Connection] = None
+        self.game_ids = itertools.count(max(self.games, default=0) + 1)
+        self.moves = 0
+
+    async def start(self, host="127.0.0.1", port=8765) -> asyncio.Server:
+        if self.recovered:
+            asyncio.get_running_loop().call_later(self.recovery_timeout,
+                                                  self.expire_recovered)
+        # a deep backlog so bursts of new connections are not refused
+        return await asyncio.start_server(self.handle, host, port,
+                                          limit=1024, backlog=4096)
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        connection = Connection(reader, writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode(errors="replace").split()
+                if not words:
+                    continue
+                command = words[0].upper()
+                if command == "QUIT":
+                    break
+                handler = self.COMMANDS.get(command)
+                if handler is None:
+                    connection.send(f"ERROR Unknown command {words[0]}")
+                    continue
+                handler(self, connection, words[1:])
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # reset, or a line over the limit
+        finally:
+            self.disconnect(connection)
+            writer.close()
+
+    def play(self, connection: Connection, args):
+        if connection.playing():
+            connection.send("ERROR Already in a game")
+            return
+        if self.waiting is None or self.waiting.writer.is_closing():
+            self.waiting = connection
+            return
+        if self.waiting is connection:
+            return
+        white = self.waiting
+        self.waiting = None
+        game = ServerGame(next(self.game_ids), self.backend(), white,
+                          connection)
+        self.games[game.id] = game
+        if self.journal is not None:
+            self.journal.attach(game.chess, game.id)
+        fen = game.chess.fen()
+        for (side, player) in game.players.items():
+            self.stop_watching(player)
+            player.game = game
+            player.side = side
+            name = "white" if side == Side.WHITE else "black"
+            player.send(f"START {game.id} {name} {fen}")
+
+    def move(self, connection: Connection, args):
+        game = connection.game
+        if game is None or game.over or connection.side is None:
+            connection.send("ERROR Not playing a game")
+            return
+        if game.chess.turn != connection.side:
+            connection.send("ERROR Not your turn")
+            return
+        if len(game.players) < 2:
+            connection.send("ERROR Waiting for the opponent to rejoin")
+            return
+        if len(args) != 1:
+            connection.send("ERROR Usage: MOVE <move>")
+            return
+        try:
+            move = game.chess.parse_move(args[0])
+            promotion = (None if move.promotion == PieceType.NOPIECE
+                         else move.promotion)
+            result = game.chess.make_move(*move[:4], promotion)
+        except (ChessInputError, ChessMoveError) as e:
+            connection.send(f"ERROR {e}")
+            return
+        self.moves += 1
+        status = STATUS_NAMES.get(result.status,
+                                  "check" if result.check else "ongoing")
+        game.broadcast(f"MOVED {game.id} {result.move} {status}")
+        if result.status == GameStatus.CHECKMATE:
+            winner = "1-0" if connection.side == Side.WHITE else "0-1"
+            self.finish(game, winner, "checkmate")
+        elif result.status != GameStatus.ONGOING:
+            self.finish(game, "1/2-1/2", status)
+
+    def watch(self, connection: Connection, args):
+        try:
+            game = self.games[int(args[0])]
+        except (IndexError, ValueError, KeyError):
+            connection.send("ERROR No such game")
+            return
+        if connection.playing():
+            connection.send("ERROR Already in a game")
+            return
+        if self.waiting is connection:
+            self.waiting = None  # watching instead
+        self.stop_watching(connection)
+        game.spectators.add(connection)
+        connection.game = game
+        connection.side = None
+        connection.send(f"WATCHING {game.id} {game.chess.fen()}")
+
+    def rejoin(self, connection: Connection, args):
+        if connection.playing():
+            connection.send("ERROR Already in a game")
+            return
+        try:
+            game = self.games[int(args[0])]
+            side = SIDE_NAMES[args[1].lower()]
+        except (IndexError, ValueError, KeyError):
+            connection.send("ERROR Usage: REJOIN <game> <white|black>")
+            return
+        if side in game.players:
+            connection.send("ERROR That seat is taken")
+            return
+        if self.waiting is connection:
+            self.waiting = None
+        self.stop_watching(connection)
+        game.players[side] = connection
+        connection.game = game
+        connection.side = side
+        connection.send(f"START {game.id} {args[1].lower()} "
+                        f"{game.chess.fen()}")
+
+    def stop_watching(self, connection: Connection):
+        # a spectator taking a seat or watching another game no longer
+        # gets the moves of the one it watched
+        if connection.game is not None and connection.side is None:
+            connection.game.spectators.discard(connection)
+            connection.game = None
+
+    def expire_recovered(self):
+        # recovered games still missing a player are given up
+        for game in list(self.games.values()):
+            if len(game.players) < 2:
+                self.finish(game, "*", "abandoned")
+
+    def resign(self, connection: Connection, args):
+        game = connection.game
+        if game is None or game.over or connection.side is None:
+            connection.send("ERROR Not playing a game")
+            return
+        winner = "0-1" if connection.side == Side.WHITE else "1-0"
+        self.finish(game, winner, "resignation")
+
+    def list_games(self, connection: Connection, args):
+        connection.send(" ".join(["GAMES"] + [str(game_id)
+                                              for game_id in self.games]))
+
+    COMMANDS = {"PLAY": play, "MOVE": move, "WATCH": watch,
+                "REJOIN": rejoin, "RESIGN": resign, "LIST": list_games}
+
+    def finish(self, game: ServerGame, result: str, reason: str):
+        game.over = True
+        game.broadcast(f"OVER {game.id} {result} {reason}")
+        del self.games[game.id]
+        if self.journal is not None:
+            self.journal.end_game(game.id, result)
+
+    def disconnect(self, connection: Connection):
+        if self.waiting is connection:
+            self.waiting = None
+        game = connection.game
+        if game is None:
+            return
+        if connection.side is None:
+            game.spectators.discard(connection)
+        elif not game.over:
+            winner = "0-1" if connection.side == Side.WHITE else "1-0"
+            self.finish(game, winner, "disconnect")
+
+
+def raise_file_limit():
+    # every connection is a file descriptor, allow as many as the system
+    # lets this process have
+    try:
+        import resource
+    except ImportError:  # not on Unix
+        return
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = 65536
+    if soft != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def serve(host="127.0.0.1", port=8765, backend=BitboardChess,
+                journal_directory=None):
+    raise_file_limit()
+    journal = None
+    if journal_directory is not None:
+        journal = Journal(journal_directory)
+    server = ChessServer(backend, journal)
+    if server.recovered:
+        print(f"Recovered {server.recovered} games from "
+              f"{journal_directory}, open to REJOIN for "
+              f"{server.recovery_timeout:.0f}s")
+    listener = await server.start(host, port)
+    print(f"Serving on {host}:{port}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if journal is not None:
+            journal.close()
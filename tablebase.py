@@ -0,0 +1,519 @@
+import mmap
+import multiprocessing
+import os
+import struct
+from typing import Dict, List, NamedTuple, Optional
+
+from bitboard import BitboardChess
+from chess import (BISHOP_RAYS, FEN_NAMES, KING_SQUARES, KNIGHT_SQUARES,
+                   ROOK_RAYS, Chess, ChessInputError, Move, PieceType, Side)
+from durable import replace_file, sync_file
+from evaluation import PIECE_VALUES
+
+# Endgame tables for a king and a few pieces against a lone king, made by
+# retrograde analysis: checkmates are found first, then the positions one
+# move from them, and so on back. Every position of a table is one byte:
+#   0    draw
+#   255  not a legal position, or stored under a symmetric one
+#   n    the side to move is mated in n-1 plies, so wins when n-1 is odd
+#        and loses when it is even
+# In the file a 16 byte header (magic and material) is followed by the
+# bytes in index order. Positions are stored with the stronger side as
+# White and indexed by side to move (stronger first), stronger king, lone
+# king, then the other pieces, one square (row*8 + file) each. Mirror
+# images share an entry: the stronger king is kept to a1-d1-d4 without
+# pawns, or to files a-d with them.
+HEADER_FORMAT = struct.Struct("<4s12s")
+MAGIC = b"CTB1"
+DRAW = 0
+ILLEGAL = 255
+DEFAULT_ENDGAMES = ["KQK", "KRK", "KPK", "KBNK"]
+CHUNK_SIZE = 4096  # positions per task given to a worker
+
+PIECE_LETTERS = {letter: piece for (piece, letter) in FEN_NAMES.items()}
+
+
+class TableResult(NamedTuple):
+    wdl: int  # 1 win, 0 draw, -1 loss, for the side to move
+    plies: int  # to mate, 0 for a draw
+
+
+def _square_maps(transforms):
+    return [[row*8 + file for (row, file) in
+             (transform(*divmod(square, 8)) for square in range(64))]
+            for transform in transforms]
+
+# (row, file) maps, the first two keep pawns moving up the board
+TRANSFORMS = _square_maps([
+    lambda row, file: (row, file),
+    lambda row, file: (row, 7-file),
+    lambda row, file: (7-row, file),
+    lambda row, file: (7-row, 7-file),
+    lambda row, file: (file, row),
+    lambda row, file: (file, 7-row),
+    lambda row, file: (7-file, row),
+    lambda row, file: (7-file, 7-row)])
+
+def _king_slots(allowed):
+    slots = [-1] * 64
+    count = 0
+    for square in range(64):
+        if allowed(*divmod(square, 8)):
+            slots[square] = count
+            count += 1
+    return slots
+
+TRIANGLE_SLOTS = _king_slots(lambda row, file: file <= 3 and row <= file)
+HALF_SLOTS = _king_slots(lambda row, file: file <= 3)
+
+
+def material_pieces(material: str) -> List[PieceType]:
+    # the pieces besides the king of the stronger side, e.g. [BISHOP,
+    # KNIGHT] for KBNK, most valuable first
+    if (len(material) < 3 or material[0] != "K" or material[-1] != "K"
+            or any(letter not in "QRBNP" for letter in material[1:-1])):
+        raise ChessInputError(f"Not a king and pieces against a king: "
+                              f"{material}")
+    return sorted((PIECE_LETTERS[letter] for letter in material[1:-1]),
+                  reverse=True)
+
+def material_name(pieces: List[PieceType]) -> str:
+    return "K" + "".join(FEN_NAMES[piece] for piece in
+                         sorted(pieces, reverse=True)) + "K"
+
+def _is_known_draw(pieces: List[PieceType]):
+    # no table is needed when a lone minor piece or nothing is left
+    return pieces in ([], [PieceType.BISHOP], [PieceType.KNIGHT])
+
+
+class TableLayout:
+    # Index arithmetic for one material. squares are [stronger king, lone
+    # king, pieces...] with the pieces in material_pieces order.
+
+    def __init__(self, material: str):
+        self.pieces = material_pieces(material)
+        self.name = material_name(self.pieces)
+        self.types = [PieceType.KING, PieceType.KING] + self.pieces
+        has_pawns = PieceType.PAWN in self.pieces
+        self.transforms = TRANSFORMS[:2] if has_pawns else TRANSFORMS
+        self.king_slots = HALF_SLOTS if has_pawns else TRIANGLE_SLOTS
+        self.king_squares = [square for square in range(64)
+                             if self.king_slots[square] >= 0]
+        self.king_count = len(self.king_squares)
+        self.others = len(self.types) - 1  # squares after the strong king
+        self.size = 2 * self.king_count * 64**self.others
+        # runs of the same piece, stored with their squares in order
+        self.runs = []
+        start = 2
+        for piece in sorted(set(self.pieces), reverse=True):
+            count = self.pieces.count(piece)
+            if count > 1:
+                self.runs.append((start, start + count))
+            start += count
+
+    def index(self, stm, squares) -> int:
+        # the smallest index of the position and its mirror images
+        best = -1
+        for transform in self.transforms:
+            slot = self.king_slots[transform[squares[0]]]
+            if slot < 0:
+                continue
+            moved = [transform[square] for square in squares]
+            for (start, end) in self.runs:
+                moved[start:end] = sorted(moved[start:end])
+            index = stm*self.king_count + slot
+            for square in moved[1:]:
+                index = index*64 + square
+            if best < 0 or index < best:
+                best = index
+        return best
+
+    def decode(self, index):
+        squares = []
+        for i in range(self.others):
+            (index, square) = divmod(index, 64)
+            squares.append(square)
+        (stm, slot) = divmod(index, self.king_count)
+        squares.append(self.king_squares[slot])
+        squares.reverse()
+        return (stm, squares)
+
+
+def encode_result(result: TableResult):
+    return DRAW if result.wdl == 0 else result.plies + 1
+
+def decode_result(value) -> Optional[TableResult]:
+    if value == ILLEGAL:
+        return None
+    if value == DRAW:
+        return TableResult(0, 0)
+    plies = value - 1
+    return TableResult(1 if plies % 2 else -1, plies)
+
+
+class EndgameTable:
+    # one table file, read through mmap without copying
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, name) = HEADER_FORMAT.unpack_from(self.data)
+        self.layout = TableLayout(name.rstrip(b"\0").decode())
+        if (magic != MAGIC or len(self.data)
+                != HEADER_FORMAT.size + self.layout.size):
+            self.close()
+            raise ChessInputError(f"Not an endgame table: {path}")
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def probe(self, stm, squares) -> Optional[TableResult]:
+        index = self.layout.index(stm, squares)
+        return decode_result(self.data[HEADER_FORMAT.size + index])
+
+
+class Tablebases:
+    # The tables in a directory, each opened when first needed. probe()
+    # answers for any position of a king and pieces against a lone king
+    # that has a table, with either side the stronger one.
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.tables: Dict[str, Optional[EndgameTable]] = {}
+        # the most material of any table, cheaper to test than the pieces.
+        # A lone minor piece is a draw without one.
+        self.max_material = PIECE_VALUES[PieceType.BISHOP]
+        if os.path.isdir(directory):
+            for file_name in os.listdir(directory):
+                (name, extension) = os.path.splitext(file_name)
+                if extension == ".tb":
+                    try:
+                        material = sum(PIECE_VALUES[piece] for piece
+                                       in material_pieces(name))
+                    except ChessInputError:
+                        continue
+                    self.max_material = max(self.max_material, material)
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def table(self, name: str) -> Optional[EndgameTable]:
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + ".tb")
+            self.tables[name] = (EndgameTable(path) if os.path.exists(path)
+                                 else None)
+        return self.tables[name]
+
+    def probe(self, game: Chess) -> Optional[TableResult]:
+        # None when the position is not covered
+        white = game.material[Side.WHITE]
+        black = game.material[Side.BLACK]
+        if (white and black) or white + black > self.max_material:
+            return None
+        if game.castling:
+            return None
+        strong = Side.WHITE if white >= black else Side.BLACK
+        kings = [0, 0]
+        pieces = []
+        for (square, piece, color) in game.placements():
+            if strong == Side.BLACK:
+                square ^= 56  # mirror the rows, Black moves up the board
+            if piece == PieceType.KING:
+                kings[color != strong] = square
+            elif color != strong:
+                return None  # a pawn, which has no material value
+            else:
+                pieces.append((piece, square))
+        pieces.sort(reverse=True)
+        if _is_known_draw([piece for (piece, square) in pieces]):
+            return TableResult(0, 0)
+        table = self.table(material_name([piece for (piece, square)
+                                          in pieces]))
+        if table is None:
+            return None
+        stm = 0 if game.turn == strong else 1
+        return table.probe(stm, kings + [square for (piece, square)
+                                         in pieces])
+
+    def best_move(self, game: Chess) -> Optional[Move]:
+        # the move that mates soonest, holds the draw or puts off mate the
+        # longest, or None if the position is not covered
+        best = None
+        best_key = None
+        for move in game.generate_legal_moves():
+            game.push(move)
+            result = self.probe(game)
+            game.pop()
+            if result is None:
+                return None
+            # the opponent's result, so a loss for them is best
+            if result.wdl < 0:
+                key = (2, -result.plies)
+            elif result.wdl == 0:
+                key = (1, 0)
+            else:
+                key = (0, result.plies)
+            if best_key is None or key > best_key:
+                (best, best_key) = (move, key)
+        return best
+
+
+def _material_dependencies(pieces: List[PieceType]) -> List[str]:
+    # tables reached by a capture or a promotion
+    names = set()
+    for (i, piece) in enumerate(pieces):
+        rest = pieces[:i] + pieces[i+1:]
+        if not _is_known_draw(rest):
+            names.add(material_name(rest))
+        if piece == PieceType.PAWN:
+            for promotion in Chess.PROMOTION_PIECES:
+                if not _is_known_draw(rest + [promotion]):
+                    names.add(material_name(rest + [promotion]))
+    return sorted(names)
+
+
+# per worker process: the layout being made, a position to set up and the
+# finished tables for positions after captures and promotions
+_worker_layout: Optional[TableLayout] = None
+_worker_game: Optional[Chess] = None
+_worker_tables: Optional[Tablebases] = None
+
+def _init_worker(material, directory, backend):
+    global _worker_layout, _worker_game, _worker_tables
+    _worker_layout = TableLayout(material)
+    _worker_game = backend()
+    _worker_tables = Tablebases(directory)
+
+def _analyse(start):
+    # First pass over CHUNK_SIZE positions with the rules of Chess. For
+    # each: its value if already known (mated, or not legal), the number
+    # of different positions in this table it can move to, plus one if a
+    # capture or promotion draws, and the best win and worst loss by a
+    # capture or promotion, as result bytes (0 for none).
+    layout = _worker_layout
+    game = _worker_game
+    end = min(start + CHUNK_SIZE, layout.size)
+    values = bytearray(end - start)
+    counts = bytearray(end - start)
+    wins = bytearray(end - start)
+    losses = bytearray(end - start)
+    for index in range(start, end):
+        i = index - start
+        (stm, squares) = layout.decode(index)
+        if (layout.index(stm, squares) != index
+                or len(set(squares)) != len(squares)
+                or any(piece == PieceType.PAWN and square // 8 in (0, 7)
+                       for (piece, square) in zip(layout.types, squares))):
+            values[i] = ILLEGAL
+            continue
+        game.set_position([(*divmod(square, 8), piece,
+                            Side.BLACK if j == 1 else Side.WHITE)
+                           for (j, (piece, square))
+                           in enumerate(zip(layout.types, squares))],
+                          Side.WHITE if stm == 0 else Side.BLACK, 0)
+        other = Side.BLACK if stm == 0 else Side.WHITE
+        if game.is_square_attacked(*game.king_square(other), game.turn):
+            values[i] = ILLEGAL
+            continue
+        moves = game.generate_legal_moves()
+        if not moves:
+            if game.is_check():
+                values[i] = encode_result(TableResult(-1, 0))
+            else:
+                counts[i] = 1  # stalemate, never lost
+            continue
+        # moves within the table only change one square, the others are
+        # played to probe the smaller table they lead to
+        where = {square: j for (j, square) in enumerate(squares)}
+        children = set()
+        for move in moves:
+            to_square = move.to_row*8 + move.to_file
+            if move.promotion == PieceType.NOPIECE and to_square not in where:
+                moved = list(squares)
+                moved[where[move.from_row*8 + move.from_file]] = to_square
+                children.add(layout.index(1 - stm, moved))
+                continue
+            game.push(move)
+            result = _worker_tables.probe(game)
+            game.pop()
+            if result is None:
+                raise ChessInputError(f"{layout.name} needs the tables "
+                                      f"{_material_dependencies(layout.pieces)}")
+            if result.wdl < 0:
+                win = encode_result(TableResult(1, result.plies + 1))
+                if not wins[i] or win < wins[i]:
+                    wins[i] = win
+            elif result.wdl > 0:
+                losses[i] = max(losses[i], encode_result(
+                    TableResult(-1, result.plies + 1)))
+            else:
+                counts[i] = 1
+        counts[i] += len(children)
+        if wins[i]:
+            counts[i] += 1  # never lost either
+        elif not counts[i]:
+            values[i] = losses[i]  # every move converts and loses
+    return (start, values, counts, wins, losses)
+
+
+def _retro_origins(piece, square, occupied):
+    # squares a piece now on square could have moved from without a capture
+    if piece == PieceType.KING:
+        steps = KING_SQUARES[square]
+    elif piece == PieceType.KNIGHT:
+        steps = KNIGHT_SQUARES[square]
+    elif piece == PieceType.PAWN:
+        origins = []
+        if square >= 16 and not occupied & (1 << (square-8)):
+            origins.append(square - 8)
+            if (square // 8 == 3
+                    and not occupied & (1 << (square-16))):
+                origins.append(square - 16)
+        return origins
+    else:
+        rays = []
+        if piece in (PieceType.ROOK, PieceType.QUEEN):
+            rays += ROOK_RAYS[square]
+        if piece in (PieceType.BISHOP, PieceType.QUEEN):
+            rays += BISHOP_RAYS[square]
+        origins = []
+        for ray in rays:
+            for origin in ray:
+                if occupied & (1 << origin):
+                    break
+                origins.append(origin)
+        return origins
+    return [origin for origin in steps if not occupied & (1 << origin)]
+
+def _predecessors(indices):
+    # for each position, the different positions of the table that move to
+    # it, found by taking back moves of the side that just moved
+    layout = _worker_layout
+    result = []
+    for index in indices:
+        (stm, squares) = layout.decode(index)
+        occupied = 0
+        for square in squares:
+            occupied |= 1 << square
+        movers = ([0] + list(range(2, len(squares))) if stm == 1 else [1])
+        previous = set()
+        for i in movers:
+            for origin in _retro_origins(layout.types[i], squares[i],
+                                         occupied):
+                moved = list(squares)
+                moved[i] = origin
+                previous.add(layout.index(1 - stm, moved))
+        result.append(previous)
+    return result
+
+
+def generate_table(material: str, directory: str,
+                   processes: Optional[int] = None,
+                   backend=BitboardChess) -> str:
+    # Makes one table in directory, which must already hold the tables
+    # for its captures and promotions, and returns its path. The first
+    # pass and the taking back of moves are spread over a process pool.
+    layout = TableLayout(material)
+    size = layout.size
+    if processes == 1:
+        _init_worker(layout.name, directory, backend)
+        map_chunks = map
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (layout.name, directory, backend))
+        map_chunks = pool.imap
+    try:
+        values = bytearray(size)
+        counts = bytearray(size)
+        losses = bytearray(size)
+        levels: Dict[int, List[int]] = {}  # candidates by result byte
+        for (start, chunk_values, chunk_counts, chunk_wins, chunk_losses) \
+                in map_chunks(_analyse, range(0, size, CHUNK_SIZE)):
+            end = start + len(chunk_values)
+            values[start:end] = chunk_values
+            counts[start:end] = chunk_counts
+            losses[start:end] = chunk_losses
+            for (i, value) in enumerate(chunk_values):
+                if value != DRAW and value != ILLEGAL:
+                    levels.setdefault(value, []).append(start + i)
+            for (i, win) in enumerate(chunk_wins):
+                if win:
+                    levels.setdefault(win, []).append(start + i)
+
+        # Positions are settled a ply at a time. A position settled as a
+        # loss makes every position moving to it a win one ply longer. One
+        # settled as a win takes a move from the count of the positions
+        # moving to it; one left with none is a loss.
+        done = bytearray(size)
+        level = 1
+        while level <= max(levels, default=0):
+            frontier = []
+            for index in levels.pop(level, []):
+                if values[index] == DRAW:
+                    values[index] = level
+                if values[index] == level and not done[index]:
+                    done[index] = 1
+                    frontier.append(index)
+            chunks = [frontier[i:i+CHUNK_SIZE]
+                      for i in range(0, len(frontier), CHUNK_SIZE)]
+            lost = level % 2 == 1  # the side to move in frontier is mated
+            for (chunk, chunk_previous) in zip(chunks, map_chunks(
+                    _predecessors, chunks)):
+                for previous in chunk_previous:
+                    for index in previous:
+                        if values[index] != DRAW:
+                            continue
+                        if lost:
+                            values[index] = level + 1
+                            levels.setdefault(level + 1, []).append(index)
+                        else:
+                            counts[index] -= 1
+                            if not counts[index]:
+                                loss = max(level + 1, losses[index])
+                                levels.setdefault(loss, []).append(index)
+            level += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, layout.name + ".tb")
+    with open(path + ".tmp", "wb") as out:
+        out.write(HEADER_FORMAT.pack(MAGIC, layout.name.encode()))
+        out.write(values)
+        sync_file(out)
+    replace_file(path)
+    return path
+
+
+def generate_tables(materials: List[str], directory: str,
+                    processes: Optional[int] = None, verbose=True):
+    # makes the tables and any they depend on that are not there yet
+    made = set()
+    def make(material):
+        name = material_name(material_pieces(material))
+        if name in made:
+            return
+        made.add(name)
+        for dependency in _material_dependencies(material_pieces(name)):
+            if not os.path.exists(os.path.join(directory,
+                                               dependency + ".tb")):
+                make(dependency)
+        path = generate_table(name, directory, processes)
+        if verbose:
+            print(f"Wrote {path}")
+    for material in materials:
+        make(material)
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import durable
+from tablebase import generate_table
+
+
+@pytest.fixture(scope="session")
+def kqk_directory(tmp_path_factory):
+    # KQK needs no smaller tables, a capture of the queen is a known draw
+    directory = tmp_path_factory.mktemp("tables")
+    generate_table("KQK", str(directory), 1)
+    return str(directory)
+
+
+@pytest.fixture
+def file_events(monkeypatch):
+    # ("replace" | "remove" | "sync", name) for every file renamed into
+    # place or removed and every directory synced, in order. A removal
+    # after a rename that was not synced fails at once.
+    events = []
+    (replace, remove) = (os.replace, os.remove)
+    sync_directory = durable.sync_directory
+
+    def recorded(kind, action):
+        def record(path, *args):
+            if kind == "remove":
+                last = [event for (event, name) in events if event != kind]
+                assert not last or last[-1] == "sync", (
+                    f"{path} removed before a rename was synced")
+            events.append((kind, os.path.basename(args[0] if args
+                                                  else path)))
+            return action(path, *args)
+        return record
+
+    monkeypatch.setattr(os, "replace", recorded("replace", replace))
+    monkeypatch.setattr(os, "remove", recorded("remove", remove))
+    monkeypatch.setattr(durable, "sync_directory",
+                        recorded("sync", sync_directory))
+    return events
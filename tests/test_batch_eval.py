@@ -0,0 +1,127 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import batch_eval
+from batch_eval import (DOUBLED_PAWN_PENALTY, ISOLATED_PAWN_PENALTY,
+                        MOBILITY_WEIGHTS, PASSED_PAWN_BONUS, evaluate_batch,
+                        from_fens, from_games, from_packed, to_planes)
+from chess import Chess, PieceType, Side
+from engine import evaluate
+from packed import pack_fens
+
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1),
+                (-2, 1), (-1, 2)]
+ROOK_STEPS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_STEPS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+STEPS = {PieceType.KNIGHT: KNIGHT_STEPS, PieceType.BISHOP: BISHOP_STEPS,
+         PieceType.ROOK: ROOK_STEPS, PieceType.QUEEN: ROOK_STEPS + BISHOP_STEPS}
+
+
+def _random_fens(count, seed=5):
+    rng = random.Random(seed)
+    game = Chess()
+    fens = []
+    while len(fens) < count:
+        game.reset()
+        for ply in range(rng.randrange(20, 160)):
+            moves = game.generate_legal_moves()
+            if not moves:
+                break
+            game.push(rng.choice(moves))
+            if rng.random() < 0.3:
+                fens.append(game.fen())
+    return fens[:count]
+
+
+def _mobility(game):
+    # squares attacked by each kind of piece, walking the board square by
+    # square, less those of its own side
+    score = 0
+    for (color, sign) in ((Side.WHITE, 1), (Side.BLACK, -1)):
+        for (piece, steps) in STEPS.items():
+            attacked = set()
+            for (square, placed, placed_color) in game.placements():
+                if (placed, placed_color) != (piece, color):
+                    continue
+                for (row_step, file_step) in steps:
+                    (row, file) = divmod(square, 8)
+                    while True:
+                        (row, file) = (row + row_step, file + file_step)
+                        if not (0 <= row < 8 and 0 <= file < 8):
+                            break
+                        (target, target_color) = game.piece_at(row, file)
+                        if target_color != color:
+                            attacked.add((row, file))
+                        if (piece == PieceType.KNIGHT
+                                or target != PieceType.NOPIECE):
+                            break
+            score += sign * MOBILITY_WEIGHTS[piece] * len(attacked)
+    return score
+
+
+def _pawn_structure(game):
+    pawns = {Side.WHITE: [], Side.BLACK: []}
+    for (square, piece, color) in game.placements():
+        if piece == PieceType.PAWN:
+            pawns[color].append(divmod(square, 8))
+    score = 0
+    for (color, enemy, sign) in ((Side.WHITE, Side.BLACK, 1),
+                                 (Side.BLACK, Side.WHITE, -1)):
+        files = [file for (row, file) in pawns[color]]
+        for file in set(files):
+            score -= sign * DOUBLED_PAWN_PENALTY * (files.count(file) - 1)
+        for (row, file) in pawns[color]:
+            if file - 1 not in files and file + 1 not in files:
+                score -= sign * ISOLATED_PAWN_PENALTY
+            ahead = [(enemy_row - row) * sign > 0
+                     for (enemy_row, enemy_file) in pawns[enemy]
+                     if abs(enemy_file - file) <= 1]
+            if not any(ahead):
+                advanced = row if color == Side.WHITE else 7 - row
+                score += sign * PASSED_PAWN_BONUS[advanced]
+    return score
+
+
+def _scalar_score(game):
+    # evaluate() plus the terms only the batch evaluator has
+    extra = _mobility(game) + _pawn_structure(game)
+    return evaluate(game) + (extra if game.turn == Side.WHITE else -extra)
+
+
+def test_batch_matches_scalar_evaluation():
+    fens = _random_fens(400) + [
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        "4k3/1p4p1/1P1p4/3P4/6P1/8/2P5/4K3 b - - 0 40",
+        "8/8/8/8/8/8/8/K6k w - - 0 1"]
+    scores = evaluate_batch(from_fens(fens))
+    game = Chess()
+    for (fen, score) in zip(fens, scores):
+        game.set_fen(fen)
+        assert int(score) == _scalar_score(game), fen
+
+
+def test_chunks_agree(monkeypatch):
+    batch = from_fens(_random_fens(300, seed=6))
+    whole = evaluate_batch(batch)
+    monkeypatch.setattr(batch_eval, "CHUNK_SIZE", 7)
+    assert (evaluate_batch(batch) == whole).all()
+
+
+def test_constructors_and_planes():
+    fens = _random_fens(50, seed=7)
+    batch = from_fens(fens)
+    assert (from_packed(pack_fens(fens)).bitboards == batch.bitboards).all()
+    game = Chess()
+    planes = to_planes(batch)
+    assert planes.shape == (50, 12, 8, 8)
+    for (index, fen) in enumerate(fens):
+        game.set_fen(fen)
+        assert batch.white_to_move[index] == (game.turn == Side.WHITE)
+        for (square, piece, color) in game.placements():
+            plane = (0 if color == Side.WHITE else 6) + piece - 1
+            assert planes[index, plane, square // 8, square % 8] == 1
+        assert planes[index].sum() == len(list(game.placements()))
+    assert len(from_games([])) == 0
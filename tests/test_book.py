@@ -0,0 +1,78 @@
+import book
+from book import (ENTRY_FORMAT, ENTRY_SIZE, OpeningBook, build_book,
+                  game_entries)
+from chess import Chess
+from pgn import parse_game
+
+GAMES = [
+    ('1-0', "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6"),
+    ('0-1', "1. d4 d5 2. c4 e6 3. Nc3 Nf6"),
+    ('1/2-1/2', "1. e4 c5 2. Nf3 d6"),
+    ('1-0', "1. e4 e6 2. d4 d5"),
+    ('*', "1. Nf3 d5 2. g3 Qxz9"),  # stops at the illegal move
+]
+
+
+def _write_pgn(path):
+    with open(path, "w") as out:
+        for (result, moves) in GAMES:
+            out.write(f'[Event "test"]\n[Result "{result}"]\n\n'
+                      f'{moves} {result}\n\n')
+
+
+def _entries(path):
+    with open(path, "rb") as stream:
+        return list(ENTRY_FORMAT.iter_unpack(stream.read()))
+
+
+def test_build_matches_game_entries(tmp_path):
+    _write_pgn(tmp_path / "games.pgn")
+    count = build_book([tmp_path / "games.pgn"], tmp_path / "book.bin", 1)
+    entries = _entries(tmp_path / "book.bin")
+    assert count == len(entries)
+    assert (tmp_path / "book.bin").stat().st_size == count * ENTRY_SIZE
+    assert entries == sorted(entries)
+
+    expected = {}
+    game = Chess()
+    for (result, moves) in GAMES:
+        text = f'[Result "{result}"]\n\n{moves} {result}\n'
+        for (key, move, weight) in game_entries(game, parse_game(text)):
+            expected[key, move] = expected.get((key, move), 0) + weight
+    assert {(key, move): weight for (key, move, weight) in entries} == {
+        entry: weight for (entry, weight) in expected.items() if weight}
+
+
+def test_merged_runs_match_one_run(tmp_path, monkeypatch):
+    _write_pgn(tmp_path / "games.pgn")
+    build_book([tmp_path / "games.pgn"], tmp_path / "one.bin", 1)
+    monkeypatch.setattr(book, "RUN_ENTRIES", 3)
+    build_book([tmp_path / "games.pgn"], tmp_path / "runs.bin", 1)
+    assert ((tmp_path / "runs.bin").read_bytes()
+            == (tmp_path / "one.bin").read_bytes())
+
+
+def test_lookup_and_choose_move(tmp_path):
+    _write_pgn(tmp_path / "games.pgn")
+    build_book([tmp_path / "games.pgn"], tmp_path / "book.bin", 1)
+    game = Chess()
+    with OpeningBook(tmp_path / "book.bin") as opening_book:
+        weights = {str(entry.move): entry.weight
+                   for entry in opening_book.lookup(game.zobrist_key)}
+        # two wins and a draw for e4, one game each for d4 (lost) and Nf3
+        assert weights == {"e2e4": 5, "g1f3": 1}
+        assert str(opening_book.choose_move(game)) == "e2e4"
+        game.make_move(*game.parse_move("e2e4"))
+        assert str(opening_book.choose_move(game)) in ("e7e5", "c7c5",
+                                                       "e7e6")
+        game.set_fen("8/8/8/8/8/8/8/K6k w - - 0 1")
+        assert opening_book.lookup(game.zobrist_key) == []
+        assert opening_book.choose_move(game) is None
+
+
+def test_empty_book(tmp_path):
+    (tmp_path / "empty.pgn").write_text("")
+    assert build_book([tmp_path / "empty.pgn"], tmp_path / "book.bin",
+                      1) == 0
+    with OpeningBook(tmp_path / "book.bin") as opening_book:
+        assert opening_book.lookup(Chess().zobrist_key) == []
@@ -0,0 +1,156 @@
+import random
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess, GameStatus
+
+BACKENDS = [Chess, BitboardChess]
+# the knights out and back, so every fourth ply repeats the start
+SHUFFLE = ["g1f3", "g8f6", "f3g1", "f6g8"]
+
+
+def _random_game(backend, plies, seed=7):
+    rng = random.Random(seed)
+    game = backend()
+    for ply in range(plies):
+        game.make_move(*rng.choice(game.generate_legal_moves()))
+    return game
+
+
+def _play(game, texts):
+    for text in texts:
+        result = game.make_move(*game.parse_move(text))
+    return result
+
+
+def _state(game):
+    # everything a game's history and position can be told apart by. A
+    # seek rebuilds the board, so the pieces may be listed in a new order.
+    return (game.fen(), game.zobrist_key, game.compute_zobrist_key(),
+            game.move_log(), game.game_ply(), game.repetitions(),
+            game.game_status(), sorted(game.placements()), game.snapshot(),
+            sorted(str(move) for move in game.generate_legal_moves()))
+
+
+def _check_piece_lists(game):
+    # the linked lists of the mailbox board hold its own squares, linked
+    # both ways, and every piece on the board
+    if isinstance(game, BitboardChess):
+        return
+    count = 0
+    for color in game.piece_list:
+        (last, piece) = (None, game.piece_list[color])
+        while piece is not None:
+            assert piece is game.board[piece.row][piece.file]
+            assert piece.prev is last and piece.color == color
+            (last, piece) = (piece, piece.next)
+            count += 1
+    assert count == sum(1 for row in game.board for square in row
+                        if square.piece)
+
+
+def _mutate(game, rng):
+    # moves made, pushed, taken back and replayed, and a seek back into
+    # the shared record followed by a different move
+    for ply in range(10):
+        game.make_move(*rng.choice(game.generate_legal_moves()))
+    for ply in range(4):
+        game.push(rng.choice(game.generate_legal_moves()))
+    game.pop()
+    game.undo()
+    game.undo()
+    game.redo()
+    game.seek(game.game_ply() - 30)
+    game.make_move(*rng.choice(game.generate_legal_moves()))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_clone_matches(backend):
+    game = _random_game(backend, 41)
+    clone = game.clone()
+    assert type(clone) is backend
+    assert _state(clone) == _state(game)
+    # pieces in the same order, so moves are generated in the same order
+    assert clone.placements() == game.placements()
+    assert clone.generate_legal_moves() == game.generate_legal_moves()
+    _check_piece_lists(clone)
+    # the same start, record and undo stack
+    clone.seek(0)
+    assert clone.fen() == Chess().fen()
+    clone.seek(41)
+    assert _state(clone) == _state(game)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_clone_independent(backend):
+    game = _random_game(backend, 70)
+    game.undo()
+    before = _state(game)
+    clone = game.clone()
+    _mutate(clone, random.Random(1))
+    assert _state(game) == before
+    _check_piece_lists(game)
+    _check_piece_lists(clone)
+    assert clone.zobrist_key == clone.compute_zobrist_key()
+    if not isinstance(game, BitboardChess):
+        assert all(square is not game.board[square.row][square.file]
+                   for row in clone.board for square in row)
+
+    # the original's undo stack and record still work, redo included
+    move = game.redo()
+    game.undo()
+    assert _state(game) == before
+    game.seek(10)
+    game.seek(69)
+    assert _state(game) == before
+    assert game.redo() == move
+
+    # and the other way round
+    clone_state = _state(clone)
+    _mutate(game, random.Random(2))
+    assert _state(clone) == clone_state
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_clone_repetitions(backend):
+    game = backend()
+    _play(game, SHUFFLE)
+    assert game.repetitions() == 2
+    clone = game.clone()
+    assert clone.repetitions() == 2
+    assert _play(clone, SHUFFLE).status == GameStatus.REPETITION
+    assert game.repetitions() == 2
+    assert game.game_status() == GameStatus.ONGOING
+    # the position after two plies, once before in this game's record
+    _play(game, SHUFFLE[:2])
+    assert game.repetitions() == 2
+    clone.seek(4)
+    assert clone.repetitions() == 2
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_snapshot_round_trip(backend):
+    game = _random_game(backend, 30)
+    snapshot = game.snapshot()
+    assert snapshot.zobrist_key == game.zobrist_key
+    copy = backend.from_snapshot(snapshot)
+    assert copy.fen() == game.fen()
+    assert copy.zobrist_key == game.zobrist_key
+    assert copy.repetitions() == game.repetitions()
+    assert copy.snapshot() == snapshot
+    _check_piece_lists(copy)
+
+    # a snapshot repeats the positions its record can repeat
+    game = backend()
+    _play(game, SHUFFLE * 2 + SHUFFLE[:2])
+    other = backend()
+    other.restore(game.snapshot())
+    assert other.repetitions() == game.repetitions() == 3
+    _play(other, SHUFFLE[2:])
+    assert other.repetitions() == 4
+    assert game.repetitions() == 3
+    assert game.snapshot() != other.snapshot()
+    # the other backend reads it the same way
+    for cls in BACKENDS:
+        assert cls.from_snapshot(snapshot).fen() == copy.fen()
@@ -0,0 +1,115 @@
+import random
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess, ChessInputError, ChessMoveError, GameStatus
+
+BACKENDS = [Chess, BitboardChess]
+# the knights out and back, so every fourth ply repeats the start
+SHUFFLE = ["g1f3", "g8f6", "f3g1", "f6g8"]
+
+
+def _random_game(backend, plies, seed=11):
+    # the moves of a game made with make_move, and the FEN after each ply
+    rng = random.Random(seed)
+    game = backend()
+    (moves, fens) = ([], [game.fen()])
+    for ply in range(plies):
+        legal = game.generate_legal_moves()
+        if not legal:
+            break
+        move = rng.choice(legal)
+        game.make_move(*move)
+        moves.append(move)
+        fens.append(game.fen())
+    return (game, moves, fens)
+
+
+def _play(game, texts):
+    for text in texts:
+        result = game.make_move(*game.parse_move(text))
+    return result
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_seek_across_checkpoints(backend):
+    plies = 3*Chess.CHECKPOINT_INTERVAL + 5
+    (game, moves, fens) = _random_game(backend, plies)
+    assert len(moves) == plies
+    rng = random.Random(2)
+    targets = [0, plies, Chess.CHECKPOINT_INTERVAL - 1,
+               Chess.CHECKPOINT_INTERVAL, 2*Chess.CHECKPOINT_INTERVAL + 1,
+               1, plies - 1] + [rng.randrange(plies + 1) for i in range(30)]
+    for ply in targets:
+        game.seek(ply)
+        assert game.game_ply() == ply
+        assert game.fen() == fens[ply]
+        assert game.zobrist_key == game.compute_zobrist_key()
+        assert game.move_log() == moves[:ply]
+    with pytest.raises(ChessInputError):
+        game.seek(plies + 1)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_undo_redo(backend):
+    (game, moves, fens) = _random_game(backend, 40)
+    assert game.undo() == moves[-1]
+    assert game.undo() == moves[-2]
+    assert game.fen() == fens[-3]
+    assert game.redo() == moves[-2]
+    assert game.fen() == fens[-2]
+
+    # a different move drops the moves that could be played again
+    game.undo()
+    other = [move for move in game.generate_legal_moves()
+             if move != moves[-2]][0]
+    game.make_move(*other)
+    assert game.move_log() == moves[:-2] + [other]
+    with pytest.raises(ChessMoveError):
+        game.redo()
+    # the same move again keeps them
+    game.undo()
+    game.make_move(*moves[-2])
+    game.undo()
+    assert game.redo() == moves[-2]
+
+    game.seek(0)
+    with pytest.raises(ChessMoveError):
+        game.undo()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_repetition_after_seeking(backend):
+    game = backend()
+    assert _play(game, SHUFFLE * 2).status == GameStatus.REPETITION
+    game.seek(4)
+    assert game.repetitions() == 2
+    assert game.game_status() == GameStatus.ONGOING
+    game.seek(8)
+    assert game.repetitions() == 3
+    assert game.game_status() == GameStatus.REPETITION
+
+    # across a checkpoint, and back from one
+    _play(game, SHUFFLE * 8)
+    plies = 40
+    assert game.game_ply() == plies
+    for ply in (plies, 3, 36, 5, 33, 0, 32, 12, plies):
+        game.seek(ply)
+        assert game.repetitions() == ply // 4 + 1
+    game.seek(6)
+    assert game.repetitions() == 2
+    game.redo()
+    game.redo()
+    assert game.repetitions() == 3
+    assert game.game_status() == GameStatus.REPETITION
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_fifty_moves(backend):
+    game = backend()
+    game.set_fen("4k3/8/8/8/8/8/8/4K2R w K - 98 80")
+    assert _play(game, ["h1h2"]).status == GameStatus.ONGOING
+    assert _play(game, ["e8d8"]).status == GameStatus.FIFTY_MOVES
+    game.undo()
+    assert game.game_status() == GameStatus.ONGOING
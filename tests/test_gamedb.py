@@ -0,0 +1,133 @@
+import os
+import random
+
+import gamedb
+from chess import START_FEN, Chess
+from gamedb import GameDatabase, PositionHit
+
+KIWIPETE = ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq "
+            "- 0 1")
+
+
+def _random_games(count, seed=1, plies=40):
+    # (fen, moves, result, tags) of random games, some from a FEN
+    rng = random.Random(seed)
+    game = Chess()
+    games = []
+    for i in range(count):
+        fen = KIWIPETE if i % 7 == 3 else None
+        game.set_fen(fen or START_FEN)
+        moves = []
+        for ply in range(rng.randrange(plies)):
+            legal = game.generate_legal_moves()
+            if not legal:
+                break
+            moves.append(rng.choice(legal))
+            game.push(moves[-1])
+        games.append((fen, moves, rng.choice(["1-0", "0-1", "1/2-1/2", "*"]),
+                      {"Event": f"game {i}", "Round": str(i)}))
+    return games
+
+
+def _add(database, games):
+    return [database.add_game(moves, fen, result, tags)
+            for (fen, moves, result, tags) in games]
+
+
+def _reference(games):
+    # key -> sorted hits, the first ply each game reaches each position
+    hits = {}
+    game = Chess()
+    for (game_id, (fen, moves, result, tags)) in enumerate(games):
+        game.set_fen(fen or START_FEN)
+        seen = {game.zobrist_key: 0}
+        for (ply, move) in enumerate(moves, 1):
+            game.push(move)
+            seen.setdefault(game.zobrist_key, ply)
+        for (key, ply) in seen.items():
+            hits.setdefault(key, []).append(PositionHit(game_id, ply))
+    return hits
+
+
+def _check(database, games):
+    assert len(database) == len(games)
+    for (game_id, (fen, moves, result, tags)) in enumerate(games):
+        record = database.game(game_id)
+        assert (record.fen, record.moves, record.result, record.tags) == (
+            fen or START_FEN, moves, result, tags)
+    for (key, hits) in _reference(games).items():
+        assert database.find(key) == sorted(hits)
+    assert database.find(12345) == []
+
+
+def test_round_trip(tmp_path):
+    games = _random_games(60)
+    with GameDatabase(str(tmp_path)) as database:
+        assert _add(database, games) == list(range(60))
+        _check(database, games)
+    with GameDatabase(str(tmp_path)) as database:
+        _check(database, games)
+        more = _random_games(10, seed=2)
+        _add(database, more)
+        _check(database, games + more)
+
+
+def test_segment_merging_keeps_every_game(tmp_path, monkeypatch):
+    monkeypatch.setattr(gamedb, "TAIL_ENTRIES", 100)
+    games = _random_games(150)
+    with GameDatabase(str(tmp_path)) as database:
+        _add(database, games)
+        sizes = [segment.entries for segment in database.segments]
+        assert len(sizes) > 1
+        # each segment more than MERGE_RATIO times the size of the next
+        assert all(older > gamedb.MERGE_RATIO * newer
+                   for (older, newer) in zip(sizes, sizes[1:]))
+        assert sum(sizes) + database.tail_entries == sum(
+            len(hits) for hits in _reference(games).values())
+        _check(database, games)
+    names = sorted(name for name in os.listdir(tmp_path)
+                   if name.endswith(".seg"))
+    assert len(names) == len(sizes)
+    with GameDatabase(str(tmp_path)) as database:
+        _check(database, games)
+
+
+def test_torn_game_is_dropped(tmp_path):
+    games = _random_games(20)
+    with GameDatabase(str(tmp_path)) as database:
+        _add(database, games)
+    # the last game cut short in games.bin, and half an offset after it
+    with open(tmp_path / "games.bin", "r+b") as stream:
+        stream.truncate(os.path.getsize(tmp_path / "games.bin") - 3)
+    with open(tmp_path / "games.idx", "ab") as stream:
+        stream.write(b"\x01\x02\x03")
+    with GameDatabase(str(tmp_path)) as database:
+        _check(database, games[:-1])
+        assert database.add_game(games[-1][1], games[-1][0],
+                                 *games[-1][2:]) == len(games) - 1
+        _check(database, games)
+
+
+def test_lost_tail_entries_are_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(gamedb, "TAIL_ENTRIES", 300)
+    games = _random_games(40)
+    with GameDatabase(str(tmp_path)) as database:
+        _add(database, games)
+        assert database.segments and database.tail_entries
+    # a crash before the tail reached the disk, part of an entry left
+    with open(tmp_path / "positions.tail", "r+b") as stream:
+        stream.truncate(gamedb.ENTRY_SIZE * 3 + 5)
+    (tmp_path / "positions-999999.seg.tmp").write_bytes(b"partial")
+    with GameDatabase(str(tmp_path)) as database:
+        _check(database, games)
+    assert "positions-999999.seg.tmp" not in os.listdir(tmp_path)
+
+
+def test_manifest_synced_before_segments_removed(tmp_path, monkeypatch,
+                                                 file_events):
+    monkeypatch.setattr(gamedb, "TAIL_ENTRIES", 100)
+    with GameDatabase(str(tmp_path)) as database:
+        _add(database, _random_games(60))
+    removed = [name for (kind, name) in file_events if kind == "remove"]
+    assert removed and all(name.endswith(".seg") for name in removed)
+    assert ("replace", "manifest.json") in file_events
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess, ChessMoveError
+from instrumentation import TIMED_METHODS, Stats, instrument, uninstrument
+
+BACKENDS = [Chess, BitboardChess]
+OPENING = ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6"]
+
+
+def _play(game, texts):
+    for text in texts:
+        game.make_move(*game.parse_move(text)[:4])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_counts_and_histograms(backend):
+    game = backend()
+    stats = instrument(game)
+    _play(game, OPENING[:2])
+    stats.phase = "middlegame"
+    _play(game, OPENING[2:])
+    with pytest.raises(ChessMoveError):
+        game.make_move(0, 0, 5, 5)
+
+    assert stats.timers["make_move"].calls == len(OPENING) + 1
+    assert stats.timers["push"].calls == len(OPENING)
+    for timer in stats.timers.values():
+        assert sum(timer.buckets) == timer.calls
+        assert timer.total_ns >= timer.calls
+    # one record per move, of every method the move called
+    moves = stats.moves
+    assert sorted(moves) == ["game", "middlegame"]
+    assert moves["game"]["make_move"].calls == 2
+    assert moves["middlegame"]["make_move"].calls == len(OPENING) - 1
+    assert moves["game"]["push"].calls == 2
+    for timers in moves.values():
+        for (name, timer) in timers.items():
+            assert sum(timer.buckets) == timer.calls
+            assert timer.calls <= timers["make_move"].calls
+            assert timer.total_ns <= timers["make_move"].total_ns
+    assert (sum(timers["make_move"].total_ns for timers in moves.values())
+            == stats.timers["make_move"].total_ns)
+    assert stats.move_ns is None
+
+    snapshot = json.loads(stats.to_json())
+    assert snapshot["methods"]["push"]["calls"] == len(OPENING)
+    assert (sum(count for (bound, count)
+                in snapshot["moves"]["middlegame"]["push"]["histogram"])
+            == len(OPENING) - 2)
+
+    # outside a move a call is timed, but not added to a move
+    before = {phase: {name: timer.calls for (name, timer) in timers.items()}
+              for (phase, timers) in moves.items()}
+    game.generate_legal_moves()
+    assert stats.timers["generate_legal_moves"].calls >= 1
+    assert before == {phase: {name: timer.calls
+                              for (name, timer) in timers.items()}
+                      for (phase, timers) in moves.items()}
+    stats.reset()
+    assert stats.timers == {} and stats.moves == {}
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_uninstrument_game(backend):
+    game = backend()
+    method = game.make_move
+    stats = instrument(game)
+    assert set(TIMED_METHODS) <= set(game.__dict__)
+    assert game.make_move.__wrapped__ == method
+    uninstrument(game)
+    assert not set(TIMED_METHODS) & set(game.__dict__)
+    assert "_instrumented" not in game.__dict__
+    _play(game, OPENING)
+    assert stats.timers["make_move"].calls == 0
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_uninstrument_class(backend):
+    # methods the class defines are put back, inherited ones are dropped
+    # so the base class's show through again
+    originals = {name: backend.__dict__.get(name) for name in TIMED_METHODS}
+    stats = instrument(backend)
+    try:
+        game = backend()
+        own = instrument(game, Stats(), ["push"])
+        _play(game, OPENING)
+        assert stats.timers["make_move"].calls == len(OPENING)
+        assert own.timers["push"].calls == len(OPENING)
+        # the game's own timing goes, the class's stays
+        uninstrument(game)
+        assert "push" not in game.__dict__
+        _play(game, ["b5c6"])
+        assert stats.timers["push"].calls == len(OPENING) + 1
+        assert own.timers["push"].calls == len(OPENING)
+    finally:
+        uninstrument(backend)
+    for (name, original) in originals.items():
+        assert backend.__dict__.get(name) is original
+        assert not hasattr(getattr(backend, name), "__wrapped__")
+    assert "_instrumented" not in backend.__dict__
+    _play(backend(), OPENING)
+    assert stats.timers["make_move"].calls == len(OPENING) + 1
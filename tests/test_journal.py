@@ -0,0 +1,140 @@
+import os
+import random
+import shutil
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess
+from journal import RECORD_SIZE, Journal, detach
+
+KIWIPETE = ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq "
+            "- 0 1")
+
+
+def _play(journal, games, steps, rng):
+    # random moves, undoing one now and then and ending finished games.
+    # Every undo is followed by a move, the journal only sees make_move.
+    for step in range(steps):
+        game_id = rng.choice(sorted(games))
+        game = games[game_id]
+        if rng.random() < 0.1 and game.game_ply() > 1:
+            game.undo()
+        legal = game.generate_legal_moves()
+        if not legal:
+            journal.end_game(game_id, "1/2-1/2")
+            detach(game)
+            del games[game_id]
+            if not games:
+                return
+            continue
+        game.make_move(*rng.choice(legal))
+
+
+def _start_games(journal, first, count):
+    games = {}
+    for game_id in range(first, first + count):
+        game = Chess()
+        if game_id % 4 == 1:
+            game.set_fen(KIWIPETE)
+        journal.attach(game, game_id)
+        games[game_id] = game
+    return games
+
+
+def _fens(games):
+    return {game_id: game.fen() for (game_id, game) in games.items()}
+
+
+def _crash_copy(journal, directory):
+    # the files as a crash right after a flush would leave them, copied
+    # while no compaction is changing them
+    journal.flush()
+    with journal.file_lock:
+        shutil.copytree(journal.directory, directory)
+    return directory
+
+
+@pytest.mark.parametrize("backend", [Chess, BitboardChess])
+def test_resume_after_reopening(tmp_path, backend):
+    rng = random.Random(1)
+    with Journal(str(tmp_path)) as journal:
+        games = _start_games(journal, 0, 12)
+        _play(journal, games, 400, rng)
+        expected = _fens(games)
+    with Journal(str(tmp_path)) as journal:
+        resumed = journal.resume(backend)
+        assert _fens(resumed) == expected
+        # resumed games go on being journaled from where they were
+        for (game_id, game) in resumed.items():
+            journal.attach(game, game_id, start=False)
+        _play(journal, resumed, 200, rng)
+        expected = _fens(resumed)
+    with Journal(str(tmp_path)) as journal:
+        assert _fens(journal.resume(backend)) == expected
+
+
+def test_torn_last_record_is_dropped(tmp_path):
+    with Journal(str(tmp_path / "live")) as journal:
+        games = _start_games(journal, 0, 3)
+        _play(journal, games, 30, random.Random(2))
+        expected = _fens(games)
+        directory = _crash_copy(journal, str(tmp_path / "crashed"))
+    name = os.path.basename(journal.journal_file.name)
+    with open(os.path.join(directory, name), "ab") as stream:
+        stream.write(bytes(RECORD_SIZE - 5))  # a record half written
+    with Journal(directory) as journal:
+        assert _fens(journal.resume()) == expected
+    # recovery compacted the torn journal away, a second opening agrees
+    with Journal(directory) as journal:
+        assert _fens(journal.resume()) == expected
+
+
+def test_bad_crc_ends_the_replay(tmp_path):
+    with Journal(str(tmp_path / "live")) as journal:
+        game = Chess()
+        journal.attach(game, 7)
+        for text in ("e2e4", "e7e5", "g1f3"):
+            before = game.fen()
+            game.make_move(*game.parse_move(text))
+        directory = _crash_copy(journal, str(tmp_path / "crashed"))
+    name = os.path.basename(journal.journal_file.name)
+    path = os.path.join(directory, name)
+    with open(path, "r+b") as stream:
+        # the move code of the last record, g1f3
+        stream.seek(os.path.getsize(path) - RECORD_SIZE + 8)
+        stream.write(b"\xff")
+    with Journal(directory) as journal:
+        assert _fens(journal.resume()) == {7: before}
+
+
+def test_replay_after_compaction_matches_live_games(tmp_path):
+    rng = random.Random(3)
+    journal = Journal(str(tmp_path / "live"), compact_records=150)
+    try:
+        generation = journal.generation
+        games = _start_games(journal, 0, 10)
+        _play(journal, games, 600, rng)
+        journal.compact()
+        games.update(_start_games(journal, 10, 5))
+        _play(journal, games, 300, rng)
+        assert journal.generation > generation
+        directory = _crash_copy(journal, str(tmp_path / "crashed"))
+        names = os.listdir(directory)
+        assert names.count("snapshot.bin") == 1
+        # the journals before the last compaction are gone
+        assert all(int(name.split("-")[1].split(".")[0]) > generation
+                   for name in names if name.startswith("journal-"))
+        with Journal(directory) as reopened:
+            assert _fens(reopened.resume()) == _fens(games)
+    finally:
+        journal.close()
+
+
+def test_snapshot_synced_before_journals_removed(tmp_path, file_events):
+    with Journal(str(tmp_path)) as journal:
+        games = _start_games(journal, 0, 3)
+        _play(journal, games, 50, random.Random(4))
+        journal.compact()
+        assert ("replace", "snapshot.bin") in file_events
+        assert ("remove", "journal-0.log") in file_events
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess, ChessMoveError, ChessPromotionError, PieceType
+
+BACKENDS = [Chess, BitboardChess]
+
+REJECTED = [
+    ("r3k2r/8/8/8/8/8/8/R3K1r1 w Qkq - 0 1", "e1c1",
+     "Cannot castle out of check"),
+    ("4k3/8/8/8/8/5r2/8/R3K2R w KQ - 0 1", "e1g1",
+     "Cannot castle through check"),
+    ("4k3/4r3/8/8/8/8/4B3/4K3 w - - 0 1", "e2d3",
+     "Cannot put own King into check"),
+    ("4k3/8/8/8/8/8/3r4/4K3 w - - 0 1", "e1e2",
+     "Cannot move King into check!"),
+    ("4k3/8/8/8/8/8/8/4K3 w - - 0 1", "e1e3", "Invalid move!"),
+    ("4k3/8/8/8/8/8/8/4K3 w - - 0 1", "e8e7", "Not your piece!"),
+    ("4k3/8/8/8/8/8/4P3/4K3 w - - 0 1", "e1e2", "Cannot take own piece"),
+    ("4k3/8/8/8/8/8/8/4K3 w - - 0 1", "d4d5", "No piece there!"),
+]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize(("fen", "text", "message"), REJECTED)
+def test_rejected(backend, fen, text, message):
+    game = backend()
+    game.set_fen(fen)
+    with pytest.raises(ChessMoveError, match=message):
+        game.make_move(*game.parse_move(text)[:4])
+    assert game.fen() == fen
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_promotion(backend):
+    game = backend()
+    game.set_fen("4k3/P7/8/8/8/8/8/4K3 w - - 0 1")
+    with pytest.raises(ChessPromotionError):
+        game.make_move(6, 0, 7, 0)
+    result = game.make_move(6, 0, 7, 0, PieceType.QUEEN)
+    assert result.check
+    assert game.fen().startswith("Q3k3/")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_every_legal_move_accepted(backend):
+    # make_move checks only the moves of the piece moved, and must agree
+    # with full generation
+    rng = random.Random(5)
+    game = backend()
+    for i in range(20):
+        game.reset()
+        for ply in range(150):
+            moves = game.generate_legal_moves()
+            for row in range(8):
+                for file in range(8):
+                    assert sorted(map(str, game.legal_moves_from(row, file))
+                                  ) == sorted(str(move) for move in moves
+                                              if move[:2] == (row, file))
+            if not moves:
+                break
+            move = rng.choice(moves)
+            result = game.make_move(*move)
+            assert result.move == move
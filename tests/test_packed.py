@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess
+from packed import (POSITION_SIZE, pack_fens, pack_position, pack_positions,
+                    unpack_fens, unpack_position, unpack_positions)
+
+FENS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b Kq e3 0 3",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 7 42",
+    "8/8/8/8/8/8/8/K6k w - - 99 300",
+]
+
+
+def _random_fens(backend, games=20, plies=80):
+    rng = random.Random(7)
+    game = backend()
+    fens = []
+    for i in range(games):
+        game.reset()
+        for ply in range(plies):
+            moves = game.generate_legal_moves()
+            if not moves:
+                break
+            game.push(rng.choice(moves))
+            fens.append(game.fen())
+    return fens
+
+
+@pytest.mark.parametrize("backend", [Chess, BitboardChess])
+def test_position_round_trip(backend):
+    for fen in FENS + _random_fens(backend):
+        game = backend()
+        game.set_fen(fen)
+        data = pack_position(game)
+        assert len(data) == POSITION_SIZE
+        unpacked = unpack_position(data, 0, backend())
+        assert unpacked.fen() == fen
+        assert unpacked.zobrist_key == game.zobrist_key
+
+
+def test_buffers_round_trip():
+    fens = FENS + _random_fens(Chess, games=5)
+    data = pack_fens(fens)
+    assert len(data) == len(fens) * POSITION_SIZE
+    assert list(unpack_fens(data)) == fens
+
+    games = []
+    for fen in fens:
+        game = Chess()
+        game.set_fen(fen)
+        games.append(game)
+    assert pack_positions(games) == data
+    assert [game.fen() for game in unpack_positions(data)] == fens
+    assert unpack_position(data, 2 * POSITION_SIZE).fen() == fens[2]
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from chess import Chess
+from engine import MATE_BOUND, MAX_DEPTH, TIME_CHECK_NODES, Engine
+from parallel import ParallelSearch
+from tablebase import Tablebases
+
+# Black is a queen up. With the knight's shuffle played twice, Nf3 repeats
+# a position of the game and is the only move that does not lose.
+FEN = "7k/8/8/8/8/8/q7/4K1N1 w - - 0 1"
+SHUFFLE = ["g1f3", "h8g8", "f3g1", "g8h8"]
+
+
+@pytest.fixture(scope="module")
+def search():
+    with ParallelSearch(2, hash_bits=12, time_limit=None,
+                        max_depth=3) as parallel:
+        yield parallel
+
+
+def _game(moves):
+    game = Chess()
+    game.set_fen(FEN)
+    for text in moves:
+        game.make_move(*game.parse_move(text))
+    return game
+
+
+def test_workers_see_the_game_history(search):
+    game = _game(SHUFFLE)
+    single = Engine(12, None, 3).search(game)
+    info = search.search(game)
+    assert single.score == 0
+    assert (info.score, str(info.pv[0])) == (0, "g1f3")
+    assert game.fen().split()[0] == FEN.split()[0]
+
+
+def test_without_history_no_draw(search):
+    info = search.search(_game([]))
+    assert info.score < -500
+
+
+def test_workers_probe_the_tablebases(kqk_directory):
+    # a long mate that a two ply search only sees through the tables
+    game = Chess()
+    game.set_fen("8/8/4k3/8/8/8/8/Q3K3 w - - 0 1")
+    with Tablebases(kqk_directory) as tablebases:
+        with ParallelSearch(2, hash_bits=12, time_limit=None, max_depth=2,
+                            tablebases=tablebases) as parallel:
+            assert parallel.search(game).score >= MATE_BOUND
+    with ParallelSearch(2, hash_bits=12, time_limit=None,
+                        max_depth=2) as parallel:
+        assert parallel.search(game).score < MATE_BOUND
+
+
+def test_stop_and_node_limit(search):
+    game = Chess()
+    search.stop_event = threading.Event()
+    timer = threading.Timer(0.5, search.stop_event.set)
+    timer.start()
+    start = time.perf_counter()
+    info = search.search(game, max_depth=MAX_DEPTH)
+    timer.join()
+    assert time.perf_counter() - start < 5
+    assert info.pv[0] in game.generate_legal_moves()
+    search.stop_event = None
+
+    search.node_limit = 3000
+    info = search.search(game, max_depth=MAX_DEPTH)
+    search.node_limit = None
+    assert info.nodes <= 3000 + 2*TIME_CHECK_NODES
+    # the next search is not stopped by the last one
+    assert search.search(game, max_depth=2).depth == 2
+
+
+def test_root_moves_not_stored():
+    # a search of some root moves is no result for the position, and must
+    # not be found by a later search through it
+    game = Chess()
+    engine = Engine(12, None, 3)
+    moves = game.generate_legal_moves()[:3]
+    info = engine.search(game, root_moves=moves)
+    assert info.pv[0] in moves and len(info.pv) > 1
+    assert engine.table.probe(game.zobrist_key) is None
+    engine.search(game)
+    assert engine.table.probe(game.zobrist_key) is not None
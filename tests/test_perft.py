@@ -0,0 +1,63 @@
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess
+from transposition import TranspositionTable
+
+# the standard perft positions with their node counts by depth, kept
+# shallow enough for both backends to run in a few seconds
+POSITIONS = [
+    ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902]),
+    # Kiwipete: castling through and out of attack, pins, en passant
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862]),
+    # en passant that uncovers a check along the rank
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    # promotions, with and without capture and check
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379]),
+]
+
+
+@pytest.mark.parametrize("backend", [Chess, BitboardChess])
+@pytest.mark.parametrize(("fen", "counts"), POSITIONS)
+def test_perft(backend, fen, counts):
+    game = backend()
+    game.set_fen(fen)
+    for (depth, count) in enumerate(counts, 1):
+        assert game.perft(depth) == count
+    # push and pop leave the position as it was
+    assert game.fen() == fen
+
+
+@pytest.mark.parametrize("backend", [Chess, BitboardChess])
+def test_divide_and_table(backend):
+    (fen, counts) = POSITIONS[1]
+    game = backend()
+    game.set_fen(fen)
+    divide = game.perft_divide(2)
+    assert len(divide) == counts[0]
+    assert sum(divide.values()) == counts[1]
+    for (move, nodes) in divide.items():
+        game.push(move)
+        assert len(game.generate_legal_moves()) == nodes
+        game.pop()
+    assert game.perft(3, TranspositionTable(12)) == counts[2]
+
+
+def test_backends_agree():
+    # the same moves from every position along a game
+    board = Chess()
+    bitboard = BitboardChess()
+    for ply in range(60):
+        moves = sorted(map(str, board.generate_legal_moves()))
+        assert sorted(map(str, bitboard.generate_legal_moves())) == moves
+        if not moves:
+            break
+        move = board.generate_legal_moves()[ply * 7 % len(moves)]
+        board.push(move)
+        bitboard.push(move)
+        assert bitboard.fen() == board.fen()
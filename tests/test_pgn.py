@@ -0,0 +1,91 @@
+import io
+import random
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess
+from pgn import format_game, parse_game, read_games
+
+BACKENDS = [Chess, BitboardChess]
+
+# positions and SAN some of their moves must be written as
+SAN = [
+    # file, rank and both to tell the pieces apart
+    ("7k/8/8/8/8/8/8/1N3N1K w - - 0 1", ["Nbd2", "Nfd2", "Na3", "Ne3"]),
+    ("4k3/8/8/R7/8/8/8/R3K3 w Q - 0 1",
+     ["R1a3", "R5a3", "Rb5", "Rb1", "O-O-O"]),
+    ("8/8/k7/8/4Q2Q/8/8/K3Q3 w - - 0 1", ["Qe4h1", "Qhh1", "Q1h1", "Q4e2+"]),
+    # castling both ways for both sides
+    ("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1", ["O-O", "O-O-O", "Rxa8+"]),
+    ("r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1", ["O-O", "O-O-O", "Rxh1+"]),
+    # promotion with check and mate, by capture too
+    ("r3k3/1P6/8/8/8/8/8/4K3 w q - 0 1",
+     ["b8=Q+", "bxa8=Q+", "b8=N", "bxa8=R+"]),
+    ("k7/2P5/1K6/8/8/8/8/8 w - - 0 1", ["c8=Q#", "c8=R#", "c8=N"]),
+    ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", ["exd6", "e6"]),
+]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize(("fen", "expected"), SAN)
+def test_san_round_trip(backend, fen, expected):
+    game = backend()
+    game.set_fen(fen)
+    written = {}
+    for move in game.generate_legal_moves():
+        text = game.san(move)
+        assert game.parse_san(text) == move
+        assert text not in written
+        written[text] = move
+    assert set(expected) <= set(written)
+    assert game.fen() == fen
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_san_random_games(backend):
+    rng = random.Random(4)
+    game = backend()
+    for i in range(4):
+        game.reset()
+        for ply in range(100):
+            moves = game.generate_legal_moves()
+            if not moves:
+                break
+            for move in moves:
+                assert game.parse_san(game.san(move)) == move
+            game.push(rng.choice(moves))
+
+
+def test_format_black_to_move():
+    fen = "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 3 12"
+    game = Chess()
+    game.set_fen(fen)
+    moves = []
+    for text in ["Nf6", "Nc3", "Bb4", "Nd5", "O-O"]:
+        move = game.parse_san(text)
+        moves.append(game.san(move))
+        game.push(move)
+    headers = {"Event": "test", "SetUp": "1", "FEN": fen, "Result": "*"}
+    text = format_game(headers, moves, "*", line_length=20)
+    # the first move numbered for black, the rest as usual
+    movetext = text.split("\n\n")[1]
+    assert " ".join(movetext.split()) == "12... Nf6 13. Nc3 Bb4 14. Nd5 O-O *"
+    assert all(len(line) <= 20 for line in movetext.splitlines())
+
+    game_read = parse_game(text)
+    assert game_read.headers == headers
+    assert game_read.moves == moves
+    assert game_read.result == "*"
+    assert [read.moves for read in read_games(io.StringIO(text * 2))
+            ] == [moves, moves]
+    replay = Chess()
+    replay.set_fen(game_read.headers["FEN"])
+    for text in game_read.moves:
+        replay.push(replay.parse_san(text))
+    assert replay.fen() == game.fen()
+
+
+def test_format_white_to_move():
+    text = format_game({"Result": "1-0"}, ["e4", "e5", "Qh5"], "1-0")
+    assert text == '[Result "1-0"]\n\n1. e4 e5 2. Qh5 1-0\n\n'
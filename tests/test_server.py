@@ -0,0 +1,170 @@
+import asyncio
+
+from journal import Journal
+from server import ChessServer
+
+TIMEOUT = 10  # seconds before a test waiting on a reply fails
+AFTER_E4_E5 = "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR"
+AFTER_NF3 = "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R"
+
+
+async def _connect(port):
+    (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+    return (reader, writer)
+
+
+async def _send(connection, line):
+    (reader, writer) = connection
+    writer.write(line.encode() + b"\n")
+    await writer.drain()
+    return (await reader.readline()).decode().split()
+
+
+def test_malformed_move_keeps_the_game():
+    async def run():
+        server = ChessServer()
+        listener = await server.start("127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        white = await _connect(port)
+        black = await _connect(port)
+        white[1].write(b"PLAY\n")
+        await asyncio.sleep(0.05)
+        black[1].write(b"PLAY\n")
+        assert (await white[0].readline()).split()[:3] == [b"START", b"1",
+                                                            b"white"]
+        await black[0].readline()
+
+        for text in ("e2ex", "e2e9", "z2e4"):
+            reply = await _send(white, f"MOVE {text}")
+            assert reply[0] == "ERROR"
+        assert await _send(white, "MOVE e2e4") == ["MOVED", "1", "e2e4",
+                                                   "ongoing"]
+        assert 1 in server.games and not server.games[1].over
+        for (reader, writer) in (white, black):
+            writer.close()
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(asyncio.wait_for(run(), TIMEOUT))
+
+
+async def _start(server):
+    listener = await server.start("127.0.0.1", 0)
+    return (listener, listener.sockets[0].getsockname()[1])
+
+
+async def _play_opening(journal_directory):
+    # a journaled game of two moves, left unfinished
+    journal = Journal(journal_directory)
+    server = ChessServer(journal=journal)
+    (listener, port) = await _start(server)
+    white = await _connect(port)
+    black = await _connect(port)
+    white[1].write(b"PLAY\n")
+    await asyncio.sleep(0.05)
+    black[1].write(b"PLAY\n")
+    await white[0].readline()
+    await black[0].readline()
+    assert (await _send(white, "MOVE e2e4"))[0] == "MOVED"
+    await black[0].readline()
+    assert (await _send(black, "MOVE e7e5"))[0] == "MOVED"
+    for (reader, writer) in (white, black):
+        writer.close()
+    listener.close()
+    await listener.wait_closed()
+    # what a crash would leave, as nothing is written after a flush
+    journal.flush()
+    journal.close()
+
+
+def test_recovered_game_can_be_rejoined(tmp_path):
+    async def run():
+        await _play_opening(tmp_path)
+        # a restart, reading the journal as the first server left it
+        journal = Journal(tmp_path)
+        server = ChessServer(journal=journal)
+        assert server.recovered == 1
+        (listener, port) = await _start(server)
+        white = await _connect(port)
+        black = await _connect(port)
+        assert await _send(white, "LIST") == ["GAMES", "1"]
+        assert await _send(white, "REJOIN 1 white") == [
+            "START", "1", "white", AFTER_E4_E5, "w", "KQkq", "-", "0", "2"]
+        assert (await _send(black, "REJOIN 1 white"))[0] == "ERROR"
+        assert (await _send(white, "MOVE g1f3"))[0] == "ERROR"  # alone
+        assert (await _send(black, "REJOIN 1 black"))[:3] == [
+            "START", "1", "black"]
+        assert await _send(white, "MOVE g1f3") == ["MOVED", "1", "g1f3",
+                                                   "ongoing"]
+        # a new game does not reuse the recovered id
+        assert next(server.game_ids) == 2
+        for (reader, writer) in (white, black):
+            writer.close()
+        listener.close()
+        await listener.wait_closed()
+        journal.close()
+        with Journal(tmp_path) as reopened:
+            assert reopened.resume()[1].fen().split()[0] == AFTER_NF3
+
+    asyncio.run(asyncio.wait_for(run(), TIMEOUT))
+
+
+def test_unclaimed_recovered_game_is_abandoned(tmp_path):
+    async def run():
+        await _play_opening(tmp_path)
+        journal = Journal(tmp_path)
+        server = ChessServer(journal=journal, recovery_timeout=0.05)
+        (listener, port) = await _start(server)
+        watcher = await _connect(port)
+        assert (await _send(watcher, "WATCH 1"))[:2] == ["WATCHING", "1"]
+        assert (await watcher[0].readline()).split() == [
+            b"OVER", b"1", b"*", b"abandoned"]
+        assert server.games == {}
+        assert journal.resume() == {}
+        watcher[1].close()
+        listener.close()
+        await listener.wait_closed()
+        journal.close()
+
+    asyncio.run(asyncio.wait_for(run(), TIMEOUT))
+
+
+def test_spectator_can_play():
+    async def run():
+        server = ChessServer()
+        (listener, port) = await _start(server)
+        clients = [await _connect(port) for i in range(6)]
+        (white, black, watcher, opponent, waiter, other) = clients
+        white[1].write(b"PLAY\n")
+        await asyncio.sleep(0.05)
+        black[1].write(b"PLAY\n")
+        await white[0].readline()
+        await black[0].readline()
+
+        # a spectator is not in a game, and stops watching once seated
+        assert (await _send(watcher, "WATCH 1"))[:2] == ["WATCHING", "1"]
+        watcher[1].write(b"PLAY\n")
+        await asyncio.sleep(0.05)
+        assert (await _send(opponent, "PLAY"))[:3] == ["START", "2", "black"]
+        assert (await watcher[0].readline()).split()[:3] == [
+            b"START", b"2", b"white"]
+        assert (await _send(white, "MOVE e2e4"))[0] == "MOVED"
+        assert await _send(watcher, "LIST") == ["GAMES", "1", "2"]
+        assert server.games[1].spectators == set()
+
+        # a waiting connection that watches instead is not paired
+        waiter[1].write(b"PLAY\n")
+        await asyncio.sleep(0.05)
+        assert (await _send(waiter, "WATCH 1"))[:2] == ["WATCHING", "1"]
+        other[1].write(b"PLAY\n")
+        await asyncio.sleep(0.05)
+        assert await _send(waiter, "LIST") == ["GAMES", "1", "2"]
+        assert server.waiting is not None and server.waiting.side is None
+        assert len(server.games) == 2
+
+        for (reader, writer) in clients:
+            writer.close()
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(asyncio.wait_for(run(), TIMEOUT))
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import Chess, GameStatus
+
+BACKENDS = [Chess, BitboardChess]
+
+POSITIONS = [
+    ("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1", GameStatus.STALEMATE),
+    ("k7/P7/K7/8/8/8/8/8 b - - 0 1", GameStatus.STALEMATE),
+    ("7k/8/8/8/8/8/5PPP/r5K1 w - - 0 1", GameStatus.CHECKMATE),
+    ("6rk/5Npp/8/8/8/8/8/6K1 b - - 0 1", GameStatus.CHECKMATE),
+    # the rook is pinned along a diagonal and cannot move
+    ("k7/1r1N4/K7/8/4B3/8/8/8 b - - 0 1", GameStatus.STALEMATE),
+    # the pinned rook can still move along the file
+    ("k7/2Q5/8/r7/8/8/8/R5K1 b - - 0 1", GameStatus.ONGOING),
+    # en passant is the only move, and without it stalemate
+    ("7k/5Q2/8/8/3Pp3/4P3/8/K7 b - d3 0 1", GameStatus.ONGOING),
+    ("7k/5Q2/8/8/3Pp3/4P3/8/K7 b - - 0 1", GameStatus.STALEMATE),
+]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize(("fen", "status"), POSITIONS)
+def test_status(backend, fen, status):
+    game = backend()
+    game.set_fen(fen)
+    assert game.game_status() == status
+    assert game.is_checkmate() == (status == GameStatus.CHECKMATE)
+    assert game.is_stalemate() == (status == GameStatus.STALEMATE)
+    assert game.has_legal_move() == bool(game.generate_legal_moves())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_has_legal_move_agrees(backend):
+    rng = random.Random(3)
+    game = backend()
+    for i in range(50):
+        game.reset()
+        for ply in range(200):
+            moves = game.generate_legal_moves()
+            assert game.has_legal_move() == bool(moves)
+            if not moves:
+                break
+            game.push(rng.choice(moves))
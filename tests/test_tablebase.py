@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from bitboard import BitboardChess
+from chess import ChessInputError, PieceType, Side
+from tablebase import (HEADER_FORMAT, MAGIC, EndgameTable, TableLayout,
+                       TableResult, Tablebases)
+
+
+@pytest.fixture(scope="module")
+def tables(kqk_directory):
+    with Tablebases(kqk_directory) as tablebases:
+        yield tablebases
+
+
+def test_file_format(tables):
+    path = f"{tables.directory}/KQK.tb"
+    with open(path, "rb") as stream:
+        data = stream.read()
+    assert HEADER_FORMAT.unpack_from(data) == (MAGIC, b"KQK".ljust(12, b"\0"))
+    assert len(data) == HEADER_FORMAT.size + TableLayout("KQK").size
+
+
+def test_truncated_table_is_rejected(tables, tmp_path):
+    with open(f"{tables.directory}/KQK.tb", "rb") as stream:
+        data = stream.read()
+    (tmp_path / "KQK.tb").write_bytes(data[:-1])
+    with pytest.raises(ChessInputError):
+        EndgameTable(str(tmp_path / "KQK.tb"))
+
+
+def test_known_positions(tables):
+    game = BitboardChess()
+    game.set_fen("k7/8/1K6/8/8/8/8/6Q1 w - - 0 1")
+    assert tables.probe(game) == TableResult(1, 1)
+    assert str(tables.best_move(game)) == "g1g8"
+    game.set_fen("k7/8/1K6/8/8/8/8/6Q1 b - - 0 1")
+    assert tables.probe(game).wdl == -1
+    # the same endgame with colours swapped is read from the same table
+    game.set_fen("6q1/8/8/8/8/1k6/8/K7 b - - 0 1")
+    assert tables.probe(game) == TableResult(1, 1)
+    game.set_fen("8/8/8/8/8/8/8/K6k w - - 0 1")
+    assert tables.probe(game) == TableResult(0, 0)
+    # stalemate
+    game.set_fen("k7/2Q5/1K6/8/8/8/8/8 b - - 0 1")
+    assert tables.probe(game) == TableResult(0, 0)
+
+
+def test_results_agree_with_the_moves(tables):
+    # a win is one ply longer than the quickest loss it can move to, a
+    # loss one ply longer than the slowest win every move leads to
+    rng = random.Random(3)
+    game = BitboardChess()
+    checked = 0
+    while checked < 300:
+        squares = rng.sample(range(64), 3)
+        turn = rng.choice((Side.WHITE, Side.BLACK))
+        game.set_position(
+            [(*divmod(squares[0], 8), PieceType.KING, Side.WHITE),
+             (*divmod(squares[1], 8), PieceType.KING, Side.BLACK),
+             (*divmod(squares[2], 8), PieceType.QUEEN, Side.WHITE)],
+            turn, 0)
+        other = Side.BLACK if turn == Side.WHITE else Side.WHITE
+        if game.is_square_attacked(*game.king_square(other), turn):
+            continue
+        checked += 1
+        result = tables.probe(game)
+        children = []
+        for move in game.generate_legal_moves():
+            game.push(move)
+            children.append(tables.probe(game))
+            game.pop()
+        if not children:
+            expected = TableResult(-1 if game.is_check() else 0, 0)
+        elif any(child.wdl < 0 for child in children):
+            expected = TableResult(1, 1 + min(child.plies for child in children
+                                              if child.wdl < 0))
+        elif all(child.wdl > 0 for child in children):
+            expected = TableResult(-1, 1 + max(child.plies
+                                               for child in children))
+        else:
+            expected = TableResult(0, 0)
+        assert result == expected, game.fen()
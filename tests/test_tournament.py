@@ -0,0 +1,58 @@
+import math
+
+import pytest
+
+from tournament import elo, elo_estimate, sprt
+
+
+def test_elo():
+    assert elo(0.5) == 0.0 and math.copysign(1, elo(0.5)) == 1
+    assert elo(0.75) == pytest.approx(190.85, abs=0.01)
+    assert elo(0.25) == pytest.approx(-190.85, abs=0.01)
+
+
+def test_elo_estimate():
+    # a score of 0.7 with a standard deviation of 0.4 per game
+    (difference, margin) = elo_estimate(60, 20, 20)
+    assert difference == pytest.approx(147.19, abs=0.01)
+    assert margin == pytest.approx(66.01, abs=0.01)
+    assert elo_estimate(20, 20, 60) == pytest.approx((-147.19, 66.01),
+                                                     abs=0.01)
+    (difference, margin) = elo_estimate(30, 40, 30)
+    assert difference == 0.0
+    assert margin == pytest.approx(53.16, abs=0.01)
+    # four times the games, half the margin near an even score
+    assert (elo_estimate(120, 160, 120)[1]
+            == pytest.approx(53.16 / 2, abs=0.5))
+
+
+def test_elo_estimate_no_spread():
+    # with every result the same nothing is known of the error
+    assert elo_estimate(0, 0, 0) == (0.0, math.inf)
+    assert elo_estimate(0, 10, 0) == (0.0, math.inf)
+    assert f"{elo_estimate(0, 10, 0)[0]:+.1f}" == "+0.0"
+    (difference, margin) = elo_estimate(5, 0, 0)
+    assert difference > 2000 and margin == math.inf
+    (difference, margin) = elo_estimate(0, 0, 5)
+    assert difference < -2000 and margin == math.inf
+
+
+def test_sprt():
+    test = sprt(60, 20, 20, 0, 10)
+    assert test.lower == pytest.approx(-2.944, abs=0.001)
+    assert test.upper == pytest.approx(2.944, abs=0.001)
+    assert test.llr == pytest.approx(1.734, abs=0.001)
+    assert test.decision is None
+    # the ratio grows with the games at the same score
+    test = sprt(600, 200, 200, 0, 10)
+    assert test.llr == pytest.approx(17.337, abs=0.001)
+    assert test.decision == "H1"
+    test = sprt(200, 600, 200, 0, 10)
+    assert test.llr == pytest.approx(-1.035, abs=0.001)
+    assert test.decision is None
+    assert sprt(500, 1000, 700, 0, 10).decision == "H0"
+    # nothing to go on yet
+    assert sprt(0, 0, 0, 0, 10).llr == 0.0
+    assert sprt(0, 30, 0, 0, 10).decision is None
+    wider = sprt(60, 20, 20, 0, 10, alpha=0.01, beta=0.01)
+    assert wider.upper == pytest.approx(math.log(99), abs=1e-9)
@@ -0,0 +1,39 @@
+import io
+
+from uci import UciSession
+
+MATE_IN_ONE = "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1"
+
+
+def _run(commands):
+    output = io.StringIO()
+    UciSession(io.StringIO("\n".join(commands) + "\n"), output).run()
+    return output.getvalue().splitlines()
+
+
+def test_malformed_position_move_is_reported():
+    lines = _run(["position startpos moves e2e4 e7ex d7d5", "isready",
+                  "go depth 1", "quit"])
+    assert "info string Invalid row notation in move e7ex" in lines
+    assert "readyok" in lines
+    # e2e4 was played and the rest ignored, so Black is to move
+    (bestmove,) = [line for line in lines if line.startswith("bestmove")]
+    assert bestmove.split()[1][1] in "78"
+
+
+def test_go_nodes_limits_the_search():
+    lines = _run(["position startpos", "go nodes 2000"])
+    infos = [line.split() for line in lines if line.startswith("info depth")]
+    assert infos
+    # checked with the clock, once every 256 nodes
+    assert all(int(info[info.index("nodes") + 1]) <= 2000 + 256
+               for info in infos)
+    assert lines[-1].startswith("bestmove")
+
+
+def test_go_mate_finds_the_mate():
+    lines = _run([f"position fen {MATE_IN_ONE}", "go mate 1"])
+    infos = [line for line in lines if line.startswith("info depth")]
+    assert infos[-1].split()[2] == "1"
+    assert "score mate 1" in infos[-1]
+    assert lines[-1].split()[:2] == ["bestmove", "a1a8"]
@@ -0,0 +1,365 @@
+import collections
+import itertools
+import math
+import multiprocessing
+import random
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from bitboard import BACKENDS
+from chess import (START_FEN, Chess, ChessInputError, ChessMoveError,
+                   GameStatus, PieceType, Side)
+from engine import MAX_DEPTH, Engine
+from pgn import format_game, read_games
+
+# Engine against engine matches on a process pool. Every opening is
+# played twice by each pair of players, once with each colour, and games
+# end on checkmate, stalemate, threefold repetition, the fifty move rule,
+# bare kings or MAX_PLIES. Results stream out as PGN and, for the first
+# player against the rest, as an Elo estimate and a sequential probability
+# ratio test that can stop the match once the result is clear.
+
+MAX_PLIES = 300  # a game still going after this many plies is drawn
+OPENING_PLIES = 8  # plies of each PGN game (or random moves) to start from
+TERMINATIONS = {GameStatus.STALEMATE: "stalemate",
+                GameStatus.REPETITION: "threefold repetition",
+                GameStatus.FIFTY_MOVES: "fifty move rule"}
+
+
+class PlayerConfig(NamedTuple):
+    name: str
+    movetime: float = 0.1  # seconds per move
+    depth: int = MAX_DEPTH
+    hash_bits: int = 16
+    backend: str = "board"
+
+
+class GameOutcome(NamedTuple):
+    index: int  # round the game was scheduled in
+    white: PlayerConfig
+    black: PlayerConfig
+    fen: str  # opening position
+    moves: List[str]  # SAN
+    result: str  # 1-0, 0-1 or 1/2-1/2
+    termination: str
+    seconds: float
+
+
+class SprtResult(NamedTuple):
+    llr: float  # log likelihood ratio of elo1 against elo0
+    lower: float  # elo0 is accepted at or below this
+    upper: float  # elo1 is accepted at or above this
+
+    @property
+    def decision(self) -> Optional[str]:
+        if self.llr >= self.upper:
+            return "H1"
+        if self.llr <= self.lower:
+            return "H0"
+        return None
+
+
+def parse_player(spec: str) -> PlayerConfig:
+    # name[:key=value,...] with keys movetime, depth, hash (bits) and
+    # backend, e.g. quick:movetime=0.05,backend=bitboard
+    (name, _, options) = spec.partition(":")
+    config = PlayerConfig(name)
+    for option in filter(None, options.split(",")):
+        (key, _, value) = option.partition("=")
+        try:
+            if key == "movetime":
+                config = config._replace(movetime=float(value))
+            elif key == "depth":
+                config = config._replace(depth=int(value))
+            elif key == "hash":
+                config = config._replace(hash_bits=int(value))
+            elif key == "backend" and value in BACKENDS:
+                config = config._replace(backend=value)
+            else:
+                raise ChessInputError(f"Unknown player option {option}")
+        except ValueError:
+            raise ChessInputError(f"Invalid player option {option}")
+    return config
+
+
+def load_openings(path: str, plies=OPENING_PLIES) -> List[str]:
+    # FENs from a file of FEN or EPD lines, or of PGN games cut to plies
+    with open(path, encoding="utf-8", errors="replace") as stream:
+        text = stream.read()
+    game = Chess()
+    openings = []
+    if "[" in text or "1." in text:
+        for pgn_game in read_games(iter(text.splitlines(True))):
+            try:
+                game.set_fen(pgn_game.headers.get("FEN", START_FEN))
+                for san in pgn_game.moves[:plies]:
+                    game.push(game.parse_san(san))
+            except (ChessInputError, ChessMoveError):
+                continue
+            openings.append(game.fen())
+        return openings
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        try:
+            game.set_fen(" ".join(fields[:4]) + " 0 1")
+        except ChessInputError:
+            continue
+        openings.append(game.fen())
+    return openings
+
+
+def random_openings(count, rng: random.Random,
+                    plies=OPENING_PLIES) -> List[str]:
+    # positions after plies random legal moves, skipping any game over
+    game = Chess()
+    openings = []
+    while len(openings) < count:
+        game.reset()
+        for ply in range(plies):
+            moves = game.generate_legal_moves()
+            if not moves:
+                break
+            game.push(rng.choice(moves))
+        if game.has_legal_move():
+            openings.append(game.fen())
+    return openings
+
+
+def schedule(players: List[PlayerConfig], openings: List[str],
+             games: int) -> Iterator[tuple]:
+    # (index, fen, white, black) for games rounds of every pair of
+    # players, each opening played with both colours in turn
+    pairs = list(itertools.combinations(players, 2))
+    index = 0
+    for fen in itertools.cycle(openings):
+        for (first, second) in pairs:
+            for (white, black) in ((first, second), (second, first)):
+                if index == games:
+                    return
+                yield (index, fen, white, black)
+                index += 1
+
+
+def _insufficient_material(game: Chess) -> bool:
+    # bare kings, or a lone knight or bishop, cannot mate
+    pieces = [piece for (square, piece, color) in game.placements()
+              if piece != PieceType.KING]
+    return not pieces or (len(pieces) == 1
+                          and pieces[0] in (PieceType.KNIGHT,
+                                            PieceType.BISHOP))
+
+
+# one engine and game per player configuration in each worker process,
+# kept from game to game
+_worker_players: Dict[PlayerConfig, Tuple[Engine, Chess]] = {}
+
+def _player(config: PlayerConfig) -> Tuple[Engine, Chess]:
+    player = _worker_players.get(config)
+    if player is None:
+        engine = Engine(config.hash_bits, config.movetime, config.depth)
+        player = (engine, BACKENDS[config.backend]())
+        _worker_players[config] = player
+    return player
+
+
+def play_game(task, max_plies=MAX_PLIES) -> GameOutcome:
+    # Plays one scheduled game headlessly. Each player searches its own
+    # game object, and every move is made on both so they stay the same.
+    (index, fen, white, black) = task
+    start = time.perf_counter()
+    players = {Side.WHITE: _player(white), Side.BLACK: _player(black)}
+    games = list({id(game): game for (engine, game)
+                  in players.values()}.values())
+    for (engine, game) in players.values():
+        engine.table.clear()
+        game.set_fen(fen)
+    referee = players[Side.WHITE][1]
+    moves = []
+    while True:
+        if referee.game_ply() >= max_plies:
+            (result, termination) = ("1/2-1/2", "move limit")
+            break
+        (engine, game) = players[referee.turn]
+        move = engine.choose_move(game)
+        moves.append(referee.san(move))
+        for game in games:
+            status = game.make_move(*move).status
+        if status == GameStatus.CHECKMATE:
+            winner = Side.WHITE if referee.turn == Side.BLACK else Side.BLACK
+            (result, termination) = ("1-0" if winner == Side.WHITE else "0-1",
+                                     "checkmate")
+            break
+        if status != GameStatus.ONGOING:
+            (result, termination) = ("1/2-1/2", TERMINATIONS[status])
+            break
+        if _insufficient_material(referee):
+            (result, termination) = ("1/2-1/2", "insufficient material")
+            break
+    return GameOutcome(index, white, black, fen, moves, result, termination,
+                       time.perf_counter() - start)
+
+
+def _play_batch(batch):
+    (tasks, max_plies) = batch
+    return [play_game(task, max_plies) for task in tasks]
+
+
+def play_games(tasks, processes: Optional[int] = None,
+               max_plies=MAX_PLIES) -> Iterator[GameOutcome]:
+    # outcomes in schedule order, with a few games per worker in flight as
+    # in pgn.validate_games. Closing the iterator ends the pool.
+    if processes == 1:
+        for task in tasks:
+            yield play_game(task, max_plies)
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        max_pending = 2 * (processes or multiprocessing.cpu_count())
+        pending = collections.deque()
+        for task in tasks:
+            # one game per batch, games take far longer than sending them
+            pending.append(pool.apply_async(_play_batch,
+                                            (([task], max_plies),)))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def score_of(outcome: GameOutcome, player: PlayerConfig) -> Optional[float]:
+    # points player got from the game, None if it did not play
+    if player not in (outcome.white, outcome.black):
+        return None
+    if outcome.result == "1/2-1/2":
+        return 0.5
+    won = (outcome.result == "1-0") == (outcome.white == player)
+    return 1.0 if won else 0.0
+
+
+def elo(score) -> float:
+    # an even score is +0.0, not -0.0
+    return 400 * math.log10(score / (1-score))
+
+
+def elo_estimate(wins, draws, losses) -> Tuple[float, float]:
+    # (Elo difference, 95% error margin) from a match score
+    games = wins + draws + losses
+    if not games:
+        return (0.0, math.inf)
+    score = (wins + draws/2) / games
+    variance = (wins * (1-score)**2 + draws * (0.5-score)**2
+                + losses * score**2) / games
+    if variance <= 0:
+        # every game the same result, which says nothing of the spread
+        score = min(max(score, 1e-6), 1 - 1e-6)
+        return (elo(score), math.inf)
+    error = 1.96 * math.sqrt(variance / games)
+    low = min(max(score - error, 1e-6), 1 - 1e-6)
+    high = min(max(score + error, 1e-6), 1 - 1e-6)
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return (elo(score), (elo(high) - elo(low)) / 2)
+
+
+def sprt(wins, draws, losses, elo0, elo1, alpha=0.05,
+         beta=0.05) -> SprtResult:
+    # Log likelihood ratio of elo1 against elo0 for the match so far, with
+    # the normal approximation to the trinomial win/draw/loss
+    # distribution. H1 (at least elo1) is accepted when the ratio reaches
+    # upper, H0 (at most elo0) when it falls to lower.
+    lower = math.log(beta / (1-alpha))
+    upper = math.log((1-beta) / alpha)
+    games = wins + draws + losses
+    if not games:
+        return SprtResult(0.0, lower, upper)
+    score = (wins + draws/2) / games
+    variance = (wins + draws/4) / games - score**2
+    if variance <= 0:
+        return SprtResult(0.0, lower, upper)  # every result the same
+    score0 = 1 / (1 + 10**(-elo0/400))
+    score1 = 1 / (1 + 10**(-elo1/400))
+    llr = ((score1 - score0) * (2*score - score0 - score1)
+           / (2 * variance / games))
+    return SprtResult(llr, lower, upper)
+
+
+def run_tournament(players: List[PlayerConfig], games: int,
+                   openings: Optional[List[str]] = None,
+                   processes: Optional[int] = None,
+                   pgn_path: Optional[str] = None,
+                   sprt_bounds: Optional[Tuple[float, float]] = None,
+                   max_plies=MAX_PLIES, seed=0) -> Tuple[int, int, int]:
+    # Plays the match and prints each result and the standing of the
+    # first player as they come, writing the games to pgn_path. Returns
+    # the first player's (wins, draws, losses).
+    if len(players) < 2:
+        raise ChessInputError("A tournament needs two players")
+    if len(set(player.name for player in players)) != len(players):
+        raise ChessInputError("Player names must differ")
+    rng = random.Random(seed)
+    if openings is None:
+        openings = random_openings(max(games // 2, 1), rng)
+    else:
+        openings = openings[:]
+        rng.shuffle(openings)
+    if not openings:
+        raise ChessInputError("No openings to play")
+
+    first = players[0]
+    record = {"wins": 0, "draws": 0, "losses": 0}
+    played = 0
+    start = time.perf_counter()
+    out = open(pgn_path, "a") if pgn_path is not None else None
+    outcomes = play_games(schedule(players, openings, games), processes,
+                          max_plies)
+    try:
+        for outcome in outcomes:
+            played += 1
+            if out is not None:
+                headers = {"Event": "Tournament", "Site": "?",
+                           "Round": str(outcome.index + 1),
+                           "White": outcome.white.name,
+                           "Black": outcome.black.name,
+                           "Result": outcome.result}
+                if outcome.fen != START_FEN:
+                    headers["SetUp"] = "1"
+                    headers["FEN"] = outcome.fen
+                headers["Termination"] = outcome.termination
+                headers["PlyCount"] = str(len(outcome.moves))
+                out.write(format_game(headers, outcome.moves, outcome.result))
+                out.flush()
+            score = score_of(outcome, first)
+            if score is not None:
+                key = {1.0: "wins", 0.5: "draws", 0.0: "losses"}[score]
+                record[key] += 1
+
+            elapsed = time.perf_counter() - start
+            (wins, draws, losses) = (record["wins"], record["draws"],
+                                     record["losses"])
+            (difference, margin) = elo_estimate(wins, draws, losses)
+            line = (f"Game {outcome.index + 1}: {outcome.white.name} - "
+                    f"{outcome.black.name} {outcome.result} "
+                    f"({outcome.termination}, {len(outcome.moves)} plies). "
+                    f"{first.name}: +{wins} ={draws} -{losses}, "
+                    f"Elo {difference:+.1f} +/- {margin:.1f}, "
+                    f"{played / elapsed * 3600:.0f} games/hour")
+            if sprt_bounds is not None:
+                test = sprt(wins, draws, losses, *sprt_bounds)
+                line += (f", LLR {test.llr:.2f} "
+                         f"[{test.lower:.2f}, {test.upper:.2f}]")
+                if test.decision is not None:
+                    print(line)
+                    print(f"SPRT accepts {test.decision} "
+                          f"(elo0 {sprt_bounds[0]}, elo1 {sprt_bounds[1]})")
+                    break
+            print(line)
+    finally:
+        outcomes.close()
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"Games: {played}")
+    print(f"Time: {elapsed:.3f}s")
+    print(f"Games per hour: {played / elapsed * 3600 if elapsed else 0:.0f}")
+    return (record["wins"], record["draws"], record["losses"])
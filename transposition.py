@@ -0,0 +1,89 @@
+from typing import List, NamedTuple, Optional
+
+from chess import Move
+
+# bound types stored with a value
+EXACT = 0
+LOWER_BOUND = 1  # value is at least this (search failed high)
+UPPER_BOUND = 2  # value is at most this (search failed low)
+
+
+class TTEntry(NamedTuple):
+    key: int
+    depth: int
+    value: int
+    bound: int
+    move: Optional[Move]
+    generation: int
+
+
+class TranspositionTable:
+    # Fixed size table of search results keyed by Chess.zobrist_key.
+    # Each bucket has two slots. The first keeps the deepest result and is
+    # only replaced by one searched at least as deep, or by anything once
+    # its entry is left over from an older search. The second slot always
+    # takes the newest result, so shallow entries still get cached.
+
+    def __init__(self, size_bits=20):
+        self.buckets = 1 << size_bits
+        self.mask = self.buckets - 1
+        self.slots: List[Optional[TTEntry]] = [None] * (2*self.buckets)
+        self.generation = 0
+        self.hits = 0
+        self.probes = 0
+
+    def new_search(self):
+        # entries from older searches become the first to be replaced
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * (2*self.buckets)
+        self.generation = 0
+        self.hits = 0
+        self.probes = 0
+
+    def probe(self, key) -> Optional[TTEntry]:
+        self.probes += 1
+        index = (key & self.mask) << 1
+        slots = self.slots
+        entry = slots[index]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        entry = slots[index+1]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, value, bound=EXACT,
+              move: Optional[Move] = None):
+        index = (key & self.mask) << 1
+        slots = self.slots
+        deepest = slots[index]
+        if (deepest is None
+                or deepest.key == key
+                or depth >= deepest.depth
+                or deepest.generation != self.generation):
+            if (deepest is not None and deepest.key != key
+                    and deepest.generation == self.generation):
+                # keep the displaced entry in the always replace slot
+                slots[index+1] = deepest
+            if move is None and deepest is not None and deepest.key == key:
+                move = deepest.move
+            slots[index] = TTEntry(key, depth, value, bound, move,
+                                   self.generation)
+        else:
+            slots[index+1] = TTEntry(key, depth, value, bound, move,
+                                     self.generation)
+
+    def __len__(self):
+        return sum(1 for entry in self.slots if entry is not None)
+
+    def hashfull(self):
+        # permille of the first 1000 slots used by the current search,
+        # as reported by UCI engines
+        sample = self.slots[:1000]
+        return sum(1 for entry in sample
+                   if entry is not None
+                   and entry.generation == self.generation) * 1000 // len(sample)
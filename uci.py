@@ -0,0 +1,253 @@
+import sys
+import threading
+from typing import Dict, List, Optional, TextIO
+
+from chess import Chess, ChessInputError, ChessMoveError, Side
+from engine import MATE, MATE_BOUND, MAX_DEPTH, Engine, SearchInfo
+
+# Universal Chess Interface front-end, so GUIs and match tools can run the
+# engine. Commands are read on the calling thread while each search runs
+# on a thread of its own, which stop, ponderhit and isready reach at once:
+#   uci, isready, ucinewgame, setoption name Hash value <MB>, quit
+#   position (startpos | fen <fen>) [moves <move> ...]
+#   go [ponder] [infinite] [wtime <ms>] [btime <ms>] [winc <ms>]
+#      [binc <ms>] [movestogo <n>] [movetime <ms>] [depth <n>] [nodes <n>]
+#      [mate <moves>]
+#   stop, ponderhit
+# go ponder searches the position after the expected reply without a time
+# limit; ponderhit starts the clock on it and stop abandons it. bestmove
+# is not sent for go ponder or go infinite until one of them arrives.
+
+ENGINE_NAME = "chess-game-python"
+ENGINE_AUTHOR = "devin30"
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 4096
+HASH_BUCKET_BYTES = 256  # memory per transposition table bucket, roughly
+MOVES_TO_GO = 30  # moves the remaining time is shared over if not given
+MOVE_OVERHEAD = 0.05  # seconds kept back for the GUI and the process
+GO_PARAMETERS = ("wtime", "btime", "winc", "binc", "movestogo", "movetime",
+                 "depth", "nodes", "mate")
+
+
+def hash_bits(megabytes) -> int:
+    return max(10, (megabytes * (1 << 20) // HASH_BUCKET_BYTES).bit_length()
+               - 1)
+
+
+def format_info(info: SearchInfo) -> str:
+    if abs(info.score) >= MATE_BOUND:
+        moves = (MATE - abs(info.score) + 1) // 2
+        score = f"mate {moves if info.score > 0 else -moves}"
+    else:
+        score = f"cp {info.score}"
+    return (f"info depth {info.depth} score {score} nodes {info.nodes} "
+            f"nps {info.nps} time {int(info.time * 1000)} "
+            f"pv {' '.join(str(move) for move in info.pv)}")
+
+
+def parse_go(words: List[str]) -> Dict[str, int]:
+    # go parameters by name, ponder and infinite given as 1
+    params = {}
+    for (index, word) in enumerate(words):
+        if word in ("ponder", "infinite"):
+            params[word] = 1
+        elif word in GO_PARAMETERS and index + 1 < len(words):
+            try:
+                params[word] = int(words[index + 1])
+            except ValueError:
+                pass
+    return params
+
+
+def time_budget(params: Dict[str, int], turn: Side) -> Optional[float]:
+    # seconds to think for a go command, None for no limit
+    if "movetime" in params:
+        return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    (time_key, increment_key) = (("wtime", "winc") if turn == Side.WHITE
+                                 else ("btime", "binc"))
+    if time_key not in params:
+        return None
+    remaining = params[time_key] / 1000
+    increment = params.get(increment_key, 0) / 1000
+    budget = (remaining / max(params.get("movestogo", MOVES_TO_GO), 1)
+              + increment * 3/4)
+    return max(min(budget, remaining/2 - MOVE_OVERHEAD), 0.01)
+
+
+class UciSession:
+    # One engine driven over a pair of text streams, by default stdin and
+    # stdout. run() returns after quit or the end of the input, waiting
+    # for a search still running unless it is one only stop can end.
+
+    def __init__(self, input: Optional[TextIO] = None,
+                 output: Optional[TextIO] = None, backend=Chess,
+                 book=None, tablebases=None):
+        self.input = input or sys.stdin
+        self.output = output or sys.stdout
+        self.backend = backend
+        self.book = book
+        self.tablebases = tablebases
+        self.game: Chess = backend()
+        self.engine = self._new_engine(hash_bits(DEFAULT_HASH_MB))
+        self.output_lock = threading.Lock()
+        self.search_thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        # set when bestmove may be sent, after ponderhit or stop for a
+        # go ponder or go infinite
+        self.release = threading.Event()
+        self.budget: Optional[float] = None
+        self.timer: Optional[threading.Timer] = None
+
+    def _new_engine(self, bits) -> Engine:
+        engine = Engine(bits, None, book=self.book,
+                        tablebases=self.tablebases)
+        engine.info = lambda info: self.send(format_info(info))
+        return engine
+
+    def send(self, line: str):
+        # search and command threads both write
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def run(self):
+        for line in self.input:
+            if not self.command(line.split()):
+                self.stop()
+                return
+        # scripted input ends without quit: let a timed search finish
+        if not self.release.is_set():
+            self.stop()
+        self.wait()
+
+    def command(self, words: List[str]) -> bool:
+        # False for quit
+        if not words:
+            return True
+        (name, args) = (words[0], words[1:])
+        if name == "quit":
+            return False
+        elif name == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} "
+                      f"min 1 max {MAX_HASH_MB}")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "setoption":
+            self.set_option(args)
+        elif name == "ucinewgame":
+            self.stop()
+            self.engine.table.clear()
+            self.game.reset()
+        elif name == "position":
+            self.stop()
+            self.set_position(args)
+        elif name == "go":
+            self.stop()
+            self.go(parse_go(args))
+        elif name == "stop":
+            self.stop()
+        elif name == "ponderhit":
+            self.ponderhit()
+        else:
+            self.send(f"info string unknown command {name}")
+        return True
+
+    def set_option(self, args: List[str]):
+        text = " ".join(args)
+        if not text.startswith("name ") or " value " not in text:
+            return
+        (name, value) = text[len("name "):].split(" value ", 1)
+        if name.strip().lower() == "hash":
+            try:
+                megabytes = min(max(int(value), 1), MAX_HASH_MB)
+            except ValueError:
+                return
+            self.stop()
+            self.engine = self._new_engine(hash_bits(megabytes))
+
+    def set_position(self, args: List[str]):
+        if "moves" in args:
+            index = args.index("moves")
+            (setup, moves) = (args[:index], args[index+1:])
+        else:
+            (setup, moves) = (args, [])
+        text = None
+        try:
+            if setup[:1] == ["fen"]:
+                self.game.set_fen(" ".join(setup[1:]))
+            else:
+                self.game.reset()
+            # make_move keeps the game record, so the search sees
+            # repetitions of earlier positions
+            for text in moves:
+                self.game.make_move(*self.game.parse_move(text))
+        except (ChessInputError, ChessMoveError) as error:
+            # the moves after a bad one are ignored
+            self.send(f"info string {error}"
+                      + (f" in move {text}" if text is not None else ""))
+
+    def go(self, params: Dict[str, int]):
+        self.budget = time_budget(params, self.game.turn)
+        waiting = "ponder" in params or "infinite" in params
+        self.engine.time_limit = None if waiting else self.budget
+        self.engine.max_depth = params.get("depth", MAX_DEPTH)
+        if "mate" in params:
+            # the search already ends on a mate it finds, a mate in n moves
+            # needs no more than 2n-1 plies to find
+            self.engine.max_depth = min(self.engine.max_depth,
+                                        max(2*params["mate"] - 1, 1))
+        self.engine.node_limit = params.get("nodes")
+        # new events for each search, so a late stop cannot end the next
+        self.stop_event = self.engine.stop_event = threading.Event()
+        self.release = threading.Event()
+        if not waiting:
+            self.release.set()
+        self.search_thread = threading.Thread(
+            target=self._search, args=(self.release,), daemon=True)
+        self.search_thread.start()
+
+    def _search(self, release: threading.Event):
+        if self.game.has_legal_move():
+            move = self.engine.choose_move(self.game)
+            pv = self.engine.last_info.pv if self.engine.last_info else []
+        else:
+            (move, pv) = (None, [])
+        release.wait()  # a finished ponder search waits for ponderhit
+        if move is None:
+            self.send("bestmove 0000")
+        elif len(pv) > 1 and pv[0] == move:
+            self.send(f"bestmove {move} ponder {pv[1]}")
+        else:
+            self.send(f"bestmove {move}")
+
+    def ponderhit(self):
+        # the expected move was played: from now it is a timed search
+        if self.release.is_set():
+            return
+        if self.budget is not None:
+            self.timer = threading.Timer(self.budget, self.stop_event.set)
+            self.timer.daemon = True
+            self.timer.start()
+        self.release.set()
+
+    def stop(self):
+        # end any search at once and wait for its bestmove
+        self.stop_event.set()
+        self.release.set()
+        self.wait()
+
+    def wait(self):
+        if self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+def run_uci(backend=Chess, book=None, tablebases=None):
+    UciSession(backend=backend, book=book, tablebases=tablebases).run()